@@ -5,7 +5,16 @@ logger = logging
 
 class BaseObject(object):
 
-    pass
+    # state of the current run (open files, directory listings), which is
+    # not sent to other processes
+    transient = ('session', 'inventory')
+
+    def __getstate__(self):
+        return dict((name, value) for name, value in self.__dict__.items()
+                    if name not in self.transient)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
 
 class Track(BaseObject):
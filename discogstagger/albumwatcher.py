@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import threading
+import logging
+
+from watchdog.events import FileSystemEventHandler
+
+logger = logging
+
+
+class PendingAlbum(object):
+    """ an album directory with changes, which has not settled yet """
+
+    def __init__(self, path):
+        self.path = path
+        self.changed = set()
+        self.last_event = 0.0
+        self.snapshot = None
+
+    def touch(self, path, now):
+        self.changed.add(path)
+        self.last_event = now
+
+    def stat(self):
+        """ size and mtime of the changed files (None for removed files) """
+        snapshot = {}
+        for path in self.changed:
+            try:
+                stat = os.stat(path)
+                snapshot[path] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                snapshot[path] = None
+        return snapshot
+
+
+class AlbumWatcher(FileSystemEventHandler):
+    """ groups the (recursive) filesystem events of the source directory by
+        album directory (the directory directly below the source directory,
+        the tagging walks it for the albums in it). Every album has its own
+        settle time: once there were no events for settle_time seconds, the changed files (and only those)
+        are stat'ed, if they did not change since the last check the album is
+        settled and put into the work queue. A single worker thread calls
+        process with the album directories in the order they settled, so that
+        one large upload does not block the albums already complete.
+    """
+
+    def __init__(self, root_dir, process, settle_time=60, done_file=None,
+                 ignore_dirs=()):
+        self.root_dir = os.path.abspath(root_dir)
+        self.process = process
+        self.settle_time = settle_time
+        self.done_file = done_file
+        self.ignore_dirs = [os.path.abspath(d) for d in ignore_dirs]
+
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.queued = set()
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def album_dir(self, path, is_directory=False):
+        """ the album directory the given path belongs to: the directory
+            directly below the source directory containing it. An upload
+            settles as a whole, none of its parts (the album in an artist
+            directory, the scans of an album, the discs) is processed on its
+            own while the rest is still arriving. Files directly in the
+            source directory belong to no album.
+        """
+        path = os.path.abspath(path)
+        if not path.startswith(self.root_dir + os.sep):
+            return None
+        for ignore_dir in self.ignore_dirs:
+            if path == ignore_dir or path.startswith(ignore_dir + os.sep):
+                return None
+
+        names = os.path.relpath(path, self.root_dir).split(os.sep)
+        if len(names) == 1 and not is_directory:
+            return None
+        return os.path.join(self.root_dir, names[0])
+
+    def on_any_event(self, event):
+        path = getattr(event, "dest_path", None) or event.src_path
+        if not event.is_directory and self.done_file and \
+                os.path.basename(path) == self.done_file:
+            return
+
+        album_dir = self.album_dir(path, event.is_directory)
+        # changes of (files in) the source directory itself are no album
+        if album_dir is None:
+            return
+
+        logger.debug(f"{event.event_type}: {path}")
+        self.add(album_dir, path)
+
+    def add(self, album_dir, path):
+        """ records a change of path in the given album directory """
+        with self.lock:
+            album = self.pending.get(album_dir)
+            if album is None:
+                album = self.pending[album_dir] = PendingAlbum(album_dir)
+            album.touch(path, time.monotonic())
+
+    def settled(self, now=None):
+        """ checks the pending albums, returns (and removes) the settled ones """
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            quiet = [album for album in self.pending.values()
+                     if now - album.last_event >= self.settle_time]
+
+        settled = []
+        for album in quiet:
+            snapshot = album.stat()
+            with self.lock:
+                if album.last_event > now:
+                    # there were new events in the meantime
+                    continue
+                if snapshot == album.snapshot:
+                    del self.pending[album.path]
+                    settled.append(album.path)
+                else:
+                    # check again after another settle time
+                    album.snapshot = snapshot
+                    album.last_event = now
+
+        return settled
+
+    def enqueue(self, album_dir):
+        with self.lock:
+            if album_dir in self.queued:
+                return
+            self.queued.add(album_dir)
+        logger.info(f"album settled: {album_dir}")
+        self.queue.put(album_dir)
+
+    def _settle(self):
+        interval = min(max(self.settle_time / 4.0, 0.1), 5.0)
+        while not self.stopped.wait(interval):
+            for album_dir in self.settled():
+                self.enqueue(album_dir)
+
+    def _work(self):
+        while True:
+            album_dir = self.queue.get()
+            if album_dir is None:
+                break
+            with self.lock:
+                self.queued.discard(album_dir)
+            try:
+                self.process(album_dir)
+            except Exception as e:
+                logger.error(f"error processing {album_dir}: {e}")
+
+    def start(self):
+        for target in (self._settle, self._work):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """ stops watching, the albums already queued are processed """
+        self.stopped.set()
+        self.queue.put(None)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
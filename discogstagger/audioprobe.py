@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import logging
+from collections import namedtuple
+from functools import lru_cache
+
+from mutagen.mp3 import MPEGInfo
+
+logger = logging
+
+AudioInfo = namedtuple(
+    "AudioInfo", "type samplerate bitdepth channels bitrate length")
+
+
+class ProbeError(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _skip_id3(f):
+    """ positions the file behind an ID3v2 tag (if there is one), without
+        reading the tag
+    """
+    f.seek(0)
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = 0
+        for byte in header[6:10]:
+            size = (size << 7) | (byte & 0x7f)
+        # the footer flag adds another 10 bytes
+        footer = 10 if header[5] & 0x10 else 0
+        f.seek(10 + size + footer)
+    else:
+        f.seek(0)
+    return f.tell()
+
+
+def probe_flac(f, size):
+    """ reads the STREAMINFO block and skips all other metadata blocks (tags,
+        pictures) using their headers only
+    """
+    _skip_id3(f)
+    if f.read(4) != b"fLaC":
+        raise ProbeError("not a flac file")
+
+    info = None
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            raise ProbeError("truncated metadata block")
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7f
+        length = int.from_bytes(header[1:4], "big")
+        if block_type == 0:
+            data = f.read(length)
+            if len(data) < 18:
+                raise ProbeError("truncated stream info")
+            sample_bits = int.from_bytes(data[10:18], "big")
+            samplerate = sample_bits >> 44
+            channels = ((sample_bits >> 41) & 0x07) + 1
+            bitdepth = ((sample_bits >> 36) & 0x1f) + 1
+            total_samples = sample_bits & 0xfffffffff
+            info = (samplerate, channels, bitdepth, total_samples)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+    if info is None:
+        raise ProbeError("stream info block not found")
+
+    samplerate, channels, bitdepth, total_samples = info
+    length = float(total_samples) / samplerate if samplerate else 0.0
+    bitrate = int(float(size - f.tell()) * 8 / length) if length else 0
+    return AudioInfo("flac", samplerate, bitdepth, channels, bitrate, length)
+
+
+def probe_mp3(f, size):
+    """ skips the ID3v2 tag and reads the first frame (with the Xing, VBRI or
+        LAME header, if there is one)
+    """
+    offset = _skip_id3(f)
+    try:
+        info = MPEGInfo(f, offset)
+    except Exception as e:
+        raise ProbeError(str(e))
+    return AudioInfo("mp3", info.sample_rate, 0, info.channels, info.bitrate,
+                     info.length)
+
+
+def probe_wav(f, size):
+    """ reads the fmt chunk and the size of the data chunk """
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ProbeError("not a wav file")
+
+    fmt = None
+    data_size = None
+    while fmt is None or data_size is None:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            data_size = chunk_size
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    if fmt is None:
+        raise ProbeError("fmt chunk not found")
+
+    _, channels, samplerate, _, block_align, bitdepth = fmt
+    length = 0.0
+    if data_size and block_align and samplerate:
+        length = float(data_size // block_align) / samplerate
+    bitrate = channels * bitdepth * samplerate
+    return AudioInfo("wav", samplerate, bitdepth, channels, bitrate, length)
+
+
+PROBES = {
+    ".flac": probe_flac,
+    ".mp3": probe_mp3,
+    ".wav": probe_wav,
+}
+
+
+def can_probe(path):
+    return os.path.splitext(path)[1].lower() in PROBES
+
+
+@lru_cache(maxsize=4096)
+def _probe(path, size, mtime):
+    probe_format = PROBES[os.path.splitext(path)[1].lower()]
+    with open(path, "rb") as f:
+        return probe_format(f, size)
+
+
+def probe(path):
+    """ returns the technical properties (AudioInfo) of the given audio file,
+        reading the stream headers only, tags and embedded pictures are
+        skipped. The results are cached by path, size and mtime. Raises a
+        ProbeError for files which cannot be probed (see can_probe).
+    """
+    if not can_probe(path):
+        raise ProbeError(f"unable to probe {path}")
+    stat = os.stat(path)
+    return _probe(path, stat.st_size, stat.st_mtime)
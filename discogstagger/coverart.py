@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import io
+import hashlib
+import logging
+from collections import namedtuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging
+
+# the keys of the metadata in the info of Pillow images (jpeg and png)
+METADATA = ("exif", "icc_profile", "xmp", "XML:com.adobe.xmp", "photoshop")
+
+PreparedCoverArt = namedtuple("PreparedCoverArt", "data digest width height")
+
+
+def prepare_coverart(imgdata, max_size=0, quality=90):
+    """ prepares the cover art once per album, before it is embedded into
+        every track: the image is decoded, scaled down to max_size pixels
+        (the longer side, 0 keeps the size), recompressed as jpeg with the
+        given quality and stripped of its metadata (exif, icc profiles, ...)
+        and hashed (sha1, digest). The original data is kept, if the
+        recompressed image is not smaller and the original carries no
+        metadata, or if Pillow is not installed.
+    """
+    prepared = None
+    if Image is None:
+        logger.debug("Pillow is not installed, embedding the cover art as it is")
+    else:
+        try:
+            prepared = _recompress(imgdata, max_size, quality)
+        except Exception as e:
+            logger.warn(f"unable to prepare the cover art, embedding it as it is ({e})")
+
+    if prepared is None or (len(prepared[0]) >= len(imgdata) and not prepared[3]):
+        data, width, height = imgdata, None, None
+    else:
+        # smaller, or at least without the metadata of the original
+        data, width, height = prepared[:3]
+        logger.info("cover art prepared: %d -> %d bytes (%dx%d)" % (
+            len(imgdata), len(data), width, height))
+
+    return PreparedCoverArt(data, hashlib.sha1(data).hexdigest(), width, height)
+
+
+def _recompress(imgdata, max_size, quality):
+    image = Image.open(io.BytesIO(imgdata))
+    image.load()
+    has_metadata = any(key in image.info for key in METADATA)
+
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    # the metadata (exif, icc profile) is not passed on, so it is dropped
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue(), image.size[0], image.size[1], has_metadata
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from discogstagger.audioprobe import ProbeError, probe
+
+logger = logging
+
+# a cue sheet counts in cd frames (mm:ss:ff)
+FRAMES_PER_SECOND = 75
+
+# images the flac tool reads itself, other formats are split by shntool
+SPLIT_FORMATS = (".flac", ".wav")
+
+
+def index_frames(index):
+    """ the position of a cue index (mm:ss:ff) in cd frames """
+    minutes, seconds, frames = [int(v) for v in index.split(":")]
+    return (minutes * 60 + seconds) * FRAMES_PER_SECOND + frames
+
+
+def track_start(track):
+    """ the position of INDEX 01 (the start of the track, the pregap before
+        belongs to the previous track) in cd frames
+    """
+    for number, index in track.indexes:
+        if int(number) == 1:
+            return index_frames(index)
+    if track.indexes:
+        return index_frames(track.indexes[0][1])
+    return None
+
+
+def cue_tracks(cue):
+    """ the tracks of the cue sheet (the first entry only holds the lines
+        before the first track)
+    """
+    return [track for track in cue.tracks if track.number is not None]
+
+
+def track_ranges(cue, samplerate):
+    """ the first and the last (exclusive, None up to the end of the image)
+        sample of every track
+    """
+    tracks = cue_tracks(cue)
+    starts = [track_start(track) * samplerate // FRAMES_PER_SECOND
+              for track in tracks]
+    ends = starts[1:] + [None]
+    return list(zip(tracks, starts, ends))
+
+
+def track_file_name(cue, track):
+    return cue.output_format.replace("%n", str(track.number).zfill(2)) + ".flac"
+
+
+def track_tags(cue, track):
+    """ the tags of a track, taken from the cue sheet, the performer of the
+        track (compilations) takes precedence over the one of the sheet
+    """
+    tags = [
+        ("TITLE", track.title),
+        ("ARTIST", track.performer or cue.performer),
+        ("TRACKNUMBER", str(track.number)),
+        ("ALBUM", cue.title),
+        ("ISRC", track.isrc),
+        ("GENRE", cue.genre),
+        ("DATE", cue.date),
+        ("DISCID", cue.discid),
+        ("COMMENT", cue.comment),
+        ("DISCNUMBER", cue.discnumber),
+        ("DISCTOTAL", cue.disctotal),
+        ("TRACKTOTAL", str(len(cue_tracks(cue)))),
+    ]
+    return [(name, value) for name, value in tags if value is not None]
+
+
+class CueSplitter(object):
+    """ splits cue images with the flac tool: every track is cut out of the
+        image at its INDEX 01 (sample accurate) and encoded by its own flac
+        process, with the tags of the cue sheet given to the encoder, so
+        that the files are not opened again for tagging. The tracks of all
+        images (discs) of an album are encoded in parallel, workers at the
+        same time (0 uses every core). flac images are only decoded in the
+        ranges of the tracks, wav images are read directly.
+    """
+
+    def __init__(self, workers=0, compression=5, flac="flac"):
+        self.workers = workers or os.cpu_count() or 1
+        self.compression = compression
+        self.flac = shutil.which(flac)
+
+    def can_split(self, cues):
+        """ whether the flac tool is available and can read all the images """
+        if self.flac is None:
+            return False
+        for cue in cues:
+            image = cue.image_file_name
+            if image is None or \
+                    os.path.splitext(image)[1].lower() not in SPLIT_FORMATS:
+                return False
+            tracks = cue_tracks(cue)
+            if not tracks or any(track_start(t) is None for t in tracks):
+                return False
+        return True
+
+    def commands(self, cue, destination):
+        """ the commands encoding the tracks of the cue sheet, a list of
+            (commands, target file), the commands are run as a pipe
+        """
+        image = cue.image_file_name
+        samplerate = probe(image).samplerate
+        is_flac = image.lower().endswith(".flac")
+
+        jobs = []
+        for track, start, end in track_ranges(cue, samplerate):
+            target = os.path.join(destination, track_file_name(cue, track))
+            cut = ["--skip=%d" % start]
+            if end is not None:
+                cut.append("--until=%d" % end)
+            encode = [self.flac, "--silent", "--force",
+                      "-%d" % self.compression]
+            for name, value in track_tags(cue, track):
+                encode.extend(["-T", f"{name}={value}"])
+            encode.extend(["-o", target + ".part"])
+
+            if is_flac:
+                decode = [self.flac, "--silent", "--decode", "--stdout"] + \
+                    cut + [image]
+                jobs.append(([decode, encode + ["-"]], target))
+            else:
+                jobs.append(([encode + cut + [image]], target))
+        return jobs
+
+    def split(self, cues):
+        """ splits the images of the given cue sheets (a list of cue and
+            destination directory), returns whether all tracks were encoded
+        """
+        jobs = []
+        try:
+            for cue, destination in cues:
+                jobs.extend(self.commands(cue, destination))
+        except (ProbeError, OSError) as e:
+            logger.error(f"unable to read the cue image: {e}")
+            return False
+
+        logger.info(f"splitting {len(cues)} cue images into {len(jobs)} tracks")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(_encode, jobs))
+        return all(results)
+
+
+def _encode(job):
+    commands, target = job
+    logger.debug("encoding {}: {}".format(
+        target, " | ".join(" ".join(command) for command in commands)))
+
+    processes = []
+    stdin = None
+    try:
+        for i, command in enumerate(commands):
+            last = i == len(commands) - 1
+            process = subprocess.Popen(
+                command, stdin=stdin,
+                stdout=subprocess.DEVNULL if last else subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            if stdin is not None:
+                # the next process owns the pipe now
+                stdin.close()
+            stdin = process.stdout
+            processes.append(process)
+
+        errors = [processes[-1].communicate()[1]]
+        for process in processes[:-1]:
+            errors.append(process.stderr.read())
+            process.stderr.close()
+            process.wait()
+        failed = [p for p in processes if p.returncode != 0]
+    except OSError as e:
+        errors, failed = [str(e)], processes or [None]
+
+    if failed:
+        logger.error(f"unable to encode {target}: {errors}")
+        if os.path.exists(target + ".part"):
+            os.remove(target + ".part")
+        return False
+
+    os.replace(target + ".part", target)
+    return True
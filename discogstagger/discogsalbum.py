@@ -1,4 +1,12 @@
 from discogstagger.album import Album, Disc, Track
+from discogstagger.releasecache import ReleaseCache
+from discogstagger.imagecache import ImageCache
+from discogstagger.dumpindex import DumpIndex, DumpFetcher
+from discogstagger.signatureindex import SignatureIndex, duration_seconds
+from discogstagger.scanner import scan
+from discogstagger.audioprobe import AudioInfo
+from discogstagger.ratelimit import RateLimitedFetcher, shared_rate_limiter
+from discogstagger.httpsession import build_session, download
 import json
 import discogs_client as discogs
 import time
@@ -10,10 +18,16 @@ import re
 import os
 import urllib
 import urllib.request
+import requests
 import string
 import pycountry
 import contextlib
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import pprint
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -40,10 +54,6 @@ class AlbumError(Exception):
         return repr(self.value)
 
 
-class RateLimit(object):
-    pass
-
-
 class DiscogsConnector(object):
     """ central class to connect to the discogs api server.
         this should be a singleton, to allow the usage of authentication and rate-limiting
@@ -57,15 +67,31 @@ class DiscogsConnector(object):
         self.tracklength_tolerance = self.config.getfloat(
             "batch", "tracklength_tolerance")
         self.discogs_auth = False
-        self.rate_limit_pool = {}
-        self.release_cache = {}
+        self.rate_limiter = shared_rate_limiter(self.config)
+        self.session = build_session(self.config)
+        self.timeout = self.config.getfloat("http", "timeout")
+        self.release_cache = ReleaseCache.from_config(self.config)
+        self.image_cache = ImageCache.from_config(self.config)
+        self.signature_index = SignatureIndex.from_config(self.config)
 
         skip_auth = self.config.get("discogs", "skip_auth")
 
+        # releases are searched and fetched from the local dump index, there
+        # is no need for authentication or caching the releases
+        if self.config.get("source", "name") == "dump":
+            self.discogs_client._fetcher = DumpFetcher(
+                DumpIndex.from_config(self.config))
+            self.release_cache = None
+            skip_auth = "True"
+
         if skip_auth != "True":
             self.initialize_auth()
             self.authenticate()
 
+        # all requests of the client have to pass the (shared) rate limiter
+        RateLimitedFetcher.install(self.discogs_client, self.rate_limiter,
+                                   self.session, self.timeout)
+
     def initialize_auth(self):
         """ initializes the authentication against the discogs api
             this method checks for the consumer_key and consumer_secret in the config
@@ -101,23 +127,60 @@ class DiscogsConnector(object):
         """
         logger.info("fetching release with id %s" % release_id)
 
+        cached = self.cached_release_data(release_id)
+        if cached is not None:
+            return discogs.Release(self.discogs_client, cached)
+
         if not self.discogs_auth:
             logger.error(
                 'You are not authenticated, cannot download image metadata')
 
-        rate_limit_type = 'metadata'
+        release = self.discogs_client.release(int(release_id))
+        # load the release right away, so that it can be stored in the cache
+        release.refresh()
+        self.cache_release(release)
 
-        if rate_limit_type in self.rate_limit_pool:
-            if self.rate_limit_pool[rate_limit_type].lastcall >= time.time() - 5:
-                logger.warn('Waiting one second to allow rate limiting...')
-                time.sleep(5)
+        return release
 
-        rl = RateLimit()
-        rl.lastcall = time.time()
+    def cached_release_data(self, release_id):
+        """ returns the cached data of the given release or None, if there is
+            no release cache or the release is not (or no longer) cached
+        """
+        if self.release_cache is None:
+            return None
 
-        self.rate_limit_pool[rate_limit_type] = rl
+        data = self.release_cache.get(release_id)
+        if data is not None:
+            logger.debug("release %s read from cache" % release_id)
+        return data
 
-        return self.discogs_client.release(int(release_id))
+    def cache_release(self, release):
+        """ stores the (completely fetched) release in the release cache and
+            adds its track durations to the signature index
+        """
+        if 'tracklist' not in release.data:
+            return
+        if self.release_cache is not None:
+            self.release_cache.put(release.id, release.data)
+        if self.signature_index is not None:
+            self.signature_index.add(release.id, release.data['tracklist'])
+
+    def read_through(self, release):
+        """ completes a partial release (e.g. from a search result or the
+            versions of a master) from the release cache, fetches it from
+            the api and caches it otherwise
+        """
+        if type(release).__name__ != 'Release' or 'tracklist' in release.data:
+            return release
+
+        cached = self.cached_release_data(release.id)
+        if cached is not None:
+            release.data.update(cached)
+        else:
+            release.refresh()
+            self.cache_release(release)
+
+        return release
 
     def authenticate(self):
         """ Authenticates the user on the discogs api via oauth 1.0a
@@ -179,44 +242,50 @@ class DiscogsConnector(object):
             There is a need for authentication here, therefor before every call the authenticate method will
             be called, to make sure, that the user is authenticated already. Furthermore, discogs restricts the
             download of images to 1000 per day. This can be very low on huge volume collections ;-(
+            Therefor images already in the image cache are taken from there.
         """
-        self._rateLimit('image')
-        # rate_limit_type = 'image'
+        if self.image_cache is not None:
+            try:
+                if self.image_cache.fetch(image_url, image_dir):
+                    return
+            except Exception as e:
+                logger.warn(
+                    "Unable to use cached image '%s' (%s)" % (image_url, e))
 
         if not self.discogs_auth:
             logger.error(
                 'You are not authenticated, cannot download image - skipping')
             return
 
-        # if rate_limit_type in self.rate_limit_pool:
-        #     if self.rate_limit_pool[rate_limit_type].lastcall >= time.time() - 5:
-        #         logger.warn('Waiting one second to allow rate limiting...')
-        #         time.sleep(5)
-        #
-        # rl = RateLimit()
-        # rl.lastcall = time.time()
-
-        try:
-            urllib.request.urlretrieve(image_url,  image_dir)
-            # urllib.urlretrieve(image_url,  image_dir)
-
-            # self.rate_limit_pool[rate_limit_type] = rl
-        except Exception as e:
-            logger.error(
-                "Unable to download image '%s', skipping. (%s)" % (image_url, e))
-
-    def _rateLimit(self, type='metadata'):
-        rate_limit_type = type
-
-        if rate_limit_type in self.rate_limit_pool:
-            if self.rate_limit_pool[rate_limit_type].lastcall >= time.time() - 5:
-                logger.warn('Waiting two seconds to allow rate limiting...')
-                time.sleep(5)
-
-        rl = RateLimit()
-        rl.lastcall = time.time()
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire('image')
+            try:
+                response = download(self.session, image_url, image_dir,
+                                     self.timeout)
+                self.rate_limiter.update('image', response.headers)
+                break
+            except requests.HTTPError as e:
+                if e.response.status_code == 429 and \
+                        attempt < self.rate_limiter.max_retries:
+                    self.rate_limiter.retry_after(
+                        'image', e.response.headers, attempt)
+                    attempt += 1
+                    continue
+                logger.error(
+                    "Unable to download image '%s', skipping. (%s)" % (image_url, e))
+                return
+            except Exception as e:
+                logger.error(
+                    "Unable to download image '%s', skipping. (%s)" % (image_url, e))
+                return
 
-        self.rate_limit_pool[rate_limit_type] = rl
+        if self.image_cache is not None:
+            try:
+                self.image_cache.store(image_url, image_dir)
+            except Exception as e:
+                logger.warn(
+                    "Unable to add image '%s' to the cache (%s)" % (image_url, e))
 
 
 class DummyResponse(object):
@@ -249,8 +318,15 @@ class LocalDiscogsConnector(object):
         pass
 
     def fetch_release(self, release_id, source_dir):
-        """ fetches the metadata for the given release_id from a local file
+        """ fetches the metadata for the given release_id from a local file,
+            if there is no such file, the release is read through the release
+            cache of the delegate (and fetched from discogs, if not cached)
         """
+        json_file_path = os.path.join(source_dir, "%s.json" % release_id)
+        if not os.path.exists(json_file_path):
+            logger.info("no local json file for release %s, using discogs" % release_id)
+            return self.delegate.fetch_release(release_id)
+
         dummy_response = DummyResponse(release_id, source_dir)
 
         # we need a dummy client here ;-(
@@ -258,7 +334,7 @@ class LocalDiscogsConnector(object):
 
         self.content = self.convert(json.loads(dummy_response.content))
 
-        logger.debug('*** content: %s (%d)' % self.content, len(self.content))
+        logger.debug('*** content: %s (%d)' % (self.content, len(self.content)))
 
         release = discogs.Release(client, self.content)
 
@@ -277,7 +353,7 @@ class LocalDiscogsConnector(object):
         """ This is an exact copy of a method in _common_test, please refactor
         """
         if isinstance(input, dict):
-            return {self.convert(key): self.convert(value) for key, value in input.iteritems()}
+            return {self.convert(key): self.convert(value) for key, value in input.items()}
         elif isinstance(input, list):
             return [self.convert(element) for element in input]
         # elif isinstance(input, unicode):
@@ -790,7 +866,7 @@ class DiscogsSearch(DiscogsConnector):
         else:
             return []
 
-    def getSearchParams(self, source_dir):
+    def getSearchParams(self, source_dir, inventory=None):
         """ get search parameters from exiting tags to find release on discogs.
             Minimum tags = artist, album title, disc, tracknumber and date is also helpful.
             If track numbers are not present they are guessed by their index.
@@ -800,7 +876,9 @@ class DiscogsSearch(DiscogsConnector):
         self.search_params = {}
         self.candidates = {}
 
-        files = self._getMusicFiles(source_dir)
+        if inventory is None:
+            inventory = scan(source_dir)
+        files = self._getMusicFiles(source_dir, inventory)
         files.sort()
         subdirectories = self._fetchSubdirectories(source_dir, files)
         searchParams = self.search_params
@@ -826,7 +904,7 @@ class DiscogsSearch(DiscogsConnector):
                 searchParams['disc'] = metadata.disc
             elif metadata.disc is None and len(set(subdirectories)) > 1:
                 trackdisc = re.search(
-                    r'^(?i)(cd|disc)\s?(?P<discnumber>[0-9]{1,2})', subdirectories[i])
+                    r'(?i)^(cd|disc)\s?(?P<discnumber>[0-9]{1,2})', subdirectories[i])
                 searchParams['disc'] = int(trackdisc.group('discnumber'))
             # print(searchParams)
             if 'disc' in searchParams.keys() and searchParams['disc'] != discnumber:
@@ -842,7 +920,7 @@ class DiscogsSearch(DiscogsConnector):
 
             # print(searchParams)
             trackInfo = {}
-            if re.search(r'^(?i)[a-z]', str(metadata.track)):
+            if re.search(r'(?i)^[a-z]', str(metadata.track)):
                 trackInfo['real_tracknumber'] = metadata.track
             trackInfo['position'] = tracknumber
             trackInfo['duration'] = str(
@@ -850,6 +928,8 @@ class DiscogsSearch(DiscogsConnector):
             trackInfo['title'] = metadata.title
             trackInfo['artist'] = metadata.artist  # useful for compilations
             searchParams['tracks'].append(trackInfo)
+
+            self._keepMetadata(inventory, file, metadata)
         searchParams['artists'] = list(dict.fromkeys(searchParams['artists']))
         searchParams['artist'] = ', '.join(searchParams['artists'])
 
@@ -861,6 +941,26 @@ class DiscogsSearch(DiscogsConnector):
             searchParams = None
             return None
 
+    def _keepMetadata(self, inventory, file, metadata):
+        """ keeps the metadata read from the file in the album inventory, the
+            later stages (mapping, audio properties) use it instead of
+            opening the file again
+        """
+        entry = inventory.entry(file)
+        if entry is None:
+            return
+        entry.metadata = {
+            'artist': metadata.artist,
+            'album': metadata.album,
+            'disc': metadata.disc,
+            'track': metadata.track,
+            'title': metadata.title,
+            'length': metadata.length,
+        }
+        entry.audio_info = AudioInfo(
+            metadata.type, metadata.samplerate, metadata.bitdepth,
+            metadata.channels, metadata.bitrate, metadata.length)
+
     def metadataFromFileNaming(self, source_dir, files):
         """ Fall back method to retrieve release information from directories
             and filenames
@@ -912,17 +1012,12 @@ class DiscogsSearch(DiscogsConnector):
     def u2s(self, string):
         return re.sub(r'[_]', ' ', string)
 
-    def _getMusicFiles(self, source_dir):
+    def _getMusicFiles(self, source_dir, inventory=None):
         """ Get album data
         """
-        extf = (self.cue_done_dir)
-        found = []
-        for dirpath, dirs, files in os.walk(source_dir):
-            dirs[:] = [d for d in dirs if d not in extf]
-            for file in files:
-                if file.endswith(('.flac', '.mp3')):
-                    found.append(os.path.join(dirpath, file))
-        return found
+        if inventory is None:
+            inventory = scan(source_dir)
+        return inventory.audio_paths(('.flac', '.mp3'), skip=(self.cue_done_dir,))
 
     def normalize(self, string):
         ''' Remove stopwords and other problem words from search strings
@@ -943,7 +1038,6 @@ class DiscogsSearch(DiscogsConnector):
             return release
 
     def search_artist_title(self, type):
-        self._rateLimit()
         searchParams = self.search_params
         candidates = self.candidates
         s = self.search_params['search']
@@ -972,7 +1066,6 @@ class DiscogsSearch(DiscogsConnector):
                     candidates[master.id] = master
 
     def search_artist(self):
-        self._rateLimit()
         searchParams = self.search_params
         candidates = self.candidates
 
@@ -1004,7 +1097,6 @@ class DiscogsSearch(DiscogsConnector):
             for ri, release in enumerate(releases):
                 if len(candidates) > 0 or ri > 25:  # give up after 25 iterations
                     return
-                self._rateLimit()
                 r = release.title.lower()
                 s = searchParams['album'].lower()
 
@@ -1090,7 +1182,6 @@ class DiscogsSearch(DiscogsConnector):
         """ Take the search parameters and look for a release, the searching &
             matching is done by various subroutines.
         """
-        self._rateLimit()
         logger.info('Searching discogs...')
 
         searchParams = self.search_params
@@ -1099,7 +1190,23 @@ class DiscogsSearch(DiscogsConnector):
         candidates = self.candidates
 
         self.search_strings()
-        self.search_switcher()
+
+        signature_candidates = {}
+        if self.signature_index is not None:
+            signature_candidates = self.search_signature()
+
+        if len(signature_candidates) == 1 and \
+                self._matchesSearch(list(signature_candidates.values())[0]):
+            candidates.update(signature_candidates)
+        elif len(signature_candidates) == 1:
+            # short releases collide easily, the durations alone are no proof
+            logger.info('the release matching the track durations matches '
+                        'neither artist nor title, searching')
+            self.search_switcher()
+        elif len(signature_candidates) > 1:
+            self._breakTies(signature_candidates)
+        else:
+            self.search_switcher()
 
         if len(candidates) == 1:
             return list(candidates.values())[0]
@@ -1163,16 +1270,116 @@ class DiscogsSearch(DiscogsConnector):
         else:
             return None
 
+    def search_signature(self):
+        """ Look up the track durations in the signature index, returns the
+            matching releases as candidates (see _siftReleases) without any
+            search on discogs.
+        """
+        found = {}
+        tracks = self.search_params['tracks']
+        durations = self._trackSeconds(tracks)
+        if None in durations:
+            return found
+
+        logger.info('Searching by track durations')
+        matches = self.signature_index.lookup(durations)
+        if len(matches) == 0:
+            return found
+
+        differences = self._scoreTrackLengths(
+            tracks, [[{'seconds': s} for s in seconds] for release_id, seconds in matches])
+
+        for (release_id, seconds), difference in zip(matches, differences):
+            if difference < self.tracklength_tolerance:
+                logger.info(
+                    'track durations match release {} ({})'.format(release_id, difference))
+                try:
+                    release = self.fetch_release(release_id)
+                except Exception as e:
+                    logger.warning(
+                        'Unable to fetch release {} ({})'.format(release_id, e))
+                    continue
+                while difference in found.keys():
+                    difference = difference + 0.001
+                found[difference] = release
+
+        return found
+
+    def _matches(self, search, name):
+        """ whether the (normalized) search string and name contain each
+            other
+        """
+        search = search.lower()
+        name = self.normalize(re.sub(r'\s+\(\d+\)$', '', name or '')).lower()
+        return search != '' and name != '' and \
+            (search == name or name in search or search in name)
+
+    def _matchesSearch(self, release):
+        """ whether the title or one of the artists of the release matches
+            the search strings
+        """
+        search = self.search_params['search']
+        if self._matches(search['release'], release.title):
+            return True
+        return any(self._matches(search['artist'], artist.name)
+                   for artist in getattr(release, 'artists', None) or [])
+
+    def _breakTies(self, signature_candidates):
+        """ Several releases match the track durations, prefer those with a
+            matching title, ask the discogs search only if that does not help.
+        """
+        candidates = self.candidates
+
+        titled = {}
+        for difference, release in signature_candidates.items():
+            if self._matches(self.search_params['search']['release'], release.title):
+                titled[difference] = release
+
+        if len(titled) == 1:
+            candidates.update(titled)
+            return
+
+        self.search_switcher()
+        ids = set(release.id for release in signature_candidates.values())
+        found = {k: v for k, v in candidates.items() if v.id in ids}
+
+        candidates.clear()
+        candidates.update(found or titled or signature_candidates)
+
     def _siftReleases(self, releases):
         """ Return candidates in a dict, keys are the quality match value.  Because
             we cannot have duplicate keys for those that match equally well, we will
             give the quality value a slight increase to keep them grouped together.
+            All releases with the same number of tracks are scored at once.
         """
         candidates = self.candidates
-        temp = {}
+        searchParams = self.search_params
+        tracktotal = len(searchParams['tracks'])
+
+        comparable = []
         for release in releases:
-            difference = self._compareRelease(release)
-            if difference is not None and difference is not False:
+            trackInfo = self._getTrackInfo(release)
+            if len(trackInfo) == 0:
+                logger.info(
+                    'Release rejected because there is no track duration information - id [{}]'.format(release.id))
+            elif len(trackInfo) != tracktotal:
+                logger.info('Number of tracks does not match between source {} and release {}'.format(
+                    tracktotal, len(trackInfo)))
+            else:
+                comparable.append((release, trackInfo))
+
+        if len(comparable) == 0:
+            return
+
+        differences = self._scoreTrackLengths(
+            searchParams['tracks'], [trackInfo for release, trackInfo in comparable])
+
+        for (release, trackInfo), difference in zip(comparable, differences):
+            logger.debug(
+                'tracklength tolerance for release {}:  {}'.format(release.id, difference))
+            if difference < self.tracklength_tolerance:
+                logger.info(
+                    'adding relid to the list of candidates: {}'.format(release.id))
                 while difference in candidates.keys():
                     difference = difference + 0.001
                 candidates[difference] = release
@@ -1201,76 +1408,75 @@ class DiscogsSearch(DiscogsConnector):
                 len(searchParams['tracks']), len(trackInfo)))
             return False
 
-    def _paddedHMS(self, string):
-        ''' Returns a time string formatted "hh:mm:ss" cmpatible with
-            strptime. If a Discogs track is over 60 minutes it is formatted
-            as 63:00, we need to recalculate this as hh:mm:ss.
+    def _durationSeconds(self, string):
+        ''' Returns the duration ("h:mm:ss", "mm:ss", also "63:00" for tracks
+            over 60 minutes) in seconds, or None if there is no (valid) duration
         '''
-        dur = 0
-        a = [int(s) for s in string.split(':')]
-        while len(a) < 3:
-            a.insert(0, 0)
-        # recalculate: discogs tracks over 60 mins (i.e 61+ minutes)
-        dur = (a[0] * 3600) + (a[1] * 60) + a[2]
-        t = str(timedelta(seconds=dur))
-        b = [int(s) for s in t.split(':')]
-        while len(b) < 3:
-            b.insert(0, 0)
-        c = ['{:0>2}'.format(d) for d in b]
-        return ':'.join(c)
+        return duration_seconds(string)
+
+    def _trackSeconds(self, tracks):
+        ''' Returns the durations of the given tracks in seconds, parsed only
+            once for each track
+        '''
+        seconds = []
+        for track in tracks:
+            if 'seconds' not in track:
+                track['seconds'] = self._durationSeconds(track['duration'])
+            seconds.append(track['seconds'])
+        return seconds
 
     def _compareTrackLengths(self, current, imported):
         """ Compare original tracklist against discogs tracklist, by comparing
             the track lengths. Some releases have tracks in different order,
             so we need to filter those out.  Returns the highest time discrepancy.
         """
-        tolerance = 0.0
-
-        # try averaging the tracklength variation out by the number of tracks
-        tracktotal = len(current)
-        for ti, track in enumerate(current):
-            """ some tracks have alphanumerical identifiers,
-                e.g. vinyl, cassettes
-            """
-            difference = self._compareTimeDifference(
-                track['duration'], imported[ti]['duration'])
-            if difference.total_seconds() > tolerance:
-                tolerance = tolerance + difference.total_seconds()
-
-        logger.info(
-            f'tracklength tolerance before averaging out by the number of tracks:  {tolerance}')
-        tolerance = tolerance / tracktotal
-        logger.debug(
-            'tracklength tolerance for release (change if there are any matching issues):  {}'.format(tolerance))
+        tolerance = self._scoreTrackLengths(current, [imported])[0]
         logger.info(
             'tracklength tolerance for release (change if there are any matching issues):  {}'.format(tolerance))
         return tolerance
 
-    def _compareTimeDifference(self, current, imported):
-        """ Compare the tracklengths between the gathered audio data and the
-            Discogs tracklengths. Expect variation.  If no tracklengths return
-            999
+    def _scoreTrackLengths(self, current, releases):
+        """ Scores the track lengths of several releases (with the same number
+            of tracks as the original tracklist) at once, see _compareTrackLengths.
+            A track difference is only added if it is bigger than the sum of
+            the differences so far, the sum is averaged out by the number of
+            tracks. Tracks without duration count as 999 seconds difference.
         """
-        if current is not None and current != '' and imported is not None and imported != '':
-            try:
-                a = self._paddedHMS(current)
-                b = self._paddedHMS(imported)
-                timea = datetime.strptime(a, '%H:%M:%S')
-                timeb = datetime.strptime(b, '%H:%M:%S')
-                return timea - timeb if timea > timeb else timeb - timea
-            except Exception as e:
-                print(e)
-        else:
-            return timedelta(seconds=999)
+        tracktotal = len(current)
+        local = self._trackSeconds(current)
+        durations = [self._trackSeconds(imported) for imported in releases]
+
+        if numpy is None:
+            scores = []
+            for seconds in durations:
+                tolerance = 0.0
+                for a, b in zip(local, seconds):
+                    difference = abs(a - b) if a is not None and b is not None else 999
+                    if difference > tolerance:
+                        tolerance = tolerance + difference
+                scores.append(tolerance / tracktotal)
+            return scores
+
+        # one row per release, one column per track, missing durations are nan
+        local = numpy.array(local, dtype=float)
+        matrix = numpy.array(durations, dtype=float)
+        differences = numpy.abs(matrix - local)
+        differences[numpy.isnan(differences)] = 999
+
+        tolerance = numpy.zeros(len(releases))
+        for ti in range(tracktotal):
+            column = differences[:, ti]
+            tolerance = numpy.where(column > tolerance, tolerance + column, tolerance)
+
+        return (tolerance / tracktotal).tolist()
 
     def _getTrackInfo(self, version):
         """ Get the track values from the release, so that we can compare them
             to what we have got.  Remove extra info appearing with empty track
             number, e.g. Bonus tracks, or section titles.
         """
-        self._rateLimit()
         trackinfo = []
-        discogs_tracks = version.tracklist
+        discogs_tracks = self.read_through(version).tracklist
         exclude = ("Video", "video", "DVD")
 
         for track in discogs_tracks:
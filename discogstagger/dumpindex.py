@@ -0,0 +1,603 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import gzip
+import json
+import sqlite3
+import threading
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit, parse_qs
+
+from discogs_client.fetchers import Fetcher
+
+logger = logging
+
+BASE_URL = "https://api.discogs.com"
+
+
+def _text(elem, tag):
+    child = elem.find(tag)
+    if child is None or child.text is None:
+        return ""
+    return child.text.strip()
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _texts(elem, path):
+    return [e.text.strip() for e in elem.iterfind(path) if e.text]
+
+
+def _artists(elem, tag):
+    artists = []
+    for a in elem.iterfind(tag + "/artist"):
+        artist_id = _int(_text(a, "id"))
+        artists.append({
+            "id": artist_id,
+            "name": _text(a, "name"),
+            "anv": _text(a, "anv"),
+            "join": _text(a, "join"),
+            "role": _text(a, "role"),
+            "tracks": _text(a, "tracks"),
+            "resource_url": f"{BASE_URL}/artists/{artist_id}",
+        })
+    return artists
+
+
+def _track(elem):
+    track = {
+        "position": _text(elem, "position"),
+        "title": _text(elem, "title"),
+        "duration": _text(elem, "duration"),
+    }
+
+    artists = _artists(elem, "artists")
+    if artists:
+        track["artists"] = artists
+    extraartists = _artists(elem, "extraartists")
+    if extraartists:
+        track["extraartists"] = extraartists
+
+    sub_tracks = [_track(t) for t in elem.iterfind("sub_tracks/track")]
+    # the dumps do not contain the type of the track, the api does
+    if sub_tracks:
+        track["type_"] = "index"
+        track["sub_tracks"] = sub_tracks
+    elif track["position"] == "" and track["duration"] == "":
+        track["type_"] = "heading"
+    else:
+        track["type_"] = "track"
+
+    return track
+
+
+def _display_artist(artists):
+    name = ""
+    for artist in artists:
+        name += artist["anv"] or re.sub(r"\s+\(\d+\)$", "", artist["name"])
+        join = artist["join"]
+        if join:
+            name += join if join == "," else " " + join
+        name += " "
+    return re.sub(r"\s+,", ",", name).strip()
+
+
+def release_from_xml(elem):
+    """ converts a release element of the releases dump into the data of
+        the corresponding api answer (/releases/{id})
+    """
+    release_id = _int(elem.get("id"))
+    released = _text(elem, "released")
+
+    data = {
+        "id": release_id,
+        "status": elem.get("status", ""),
+        "title": _text(elem, "title"),
+        "artists": _artists(elem, "artists"),
+        "extraartists": _artists(elem, "extraartists"),
+        "labels": [{"id": _int(l.get("id")), "name": l.get("name", ""),
+                    "catno": l.get("catno", "")}
+                   for l in elem.iterfind("labels/label")],
+        "companies": [{"id": _int(_text(c, "id")), "name": _text(c, "name"),
+                       "catno": _text(c, "catno"),
+                       "entity_type": _text(c, "entity_type"),
+                       "entity_type_name": _text(c, "entity_type_name")}
+                      for c in elem.iterfind("companies/company")],
+        "formats": [{"name": f.get("name", ""), "qty": f.get("qty", "1"),
+                     "text": f.get("text", ""),
+                     "descriptions": _texts(f, "descriptions/description")}
+                    for f in elem.iterfind("formats/format")],
+        "genres": _texts(elem, "genres/genre"),
+        "styles": _texts(elem, "styles/style"),
+        "country": _text(elem, "country"),
+        "released": released,
+        "year": _int(released[:4], 0),
+        "notes": _text(elem, "notes"),
+        "data_quality": _text(elem, "data_quality"),
+        "tracklist": [_track(t) for t in elem.iterfind("tracklist/track")],
+        "identifiers": [{"type": i.get("type", ""), "value": i.get("value", ""),
+                         "description": i.get("description", "")}
+                        for i in elem.iterfind("identifiers/identifier")],
+        "videos": [{"uri": v.get("src", ""),
+                    "duration": _int(v.get("duration"), 0),
+                    "embed": v.get("embed") == "true",
+                    "title": _text(v, "title"),
+                    "description": _text(v, "description")}
+                   for v in elem.iterfind("videos/video")],
+        "images": [{"type": i.get("type", ""), "uri": i.get("uri", ""),
+                    "uri150": i.get("uri150", ""),
+                    "width": _int(i.get("width"), 0),
+                    "height": _int(i.get("height"), 0)}
+                   for i in elem.iterfind("images/image") if i.get("uri")],
+        "uri": f"https://www.discogs.com/release/{release_id}",
+    }
+
+    data["format_quantity"] = sum(_int(f["qty"], 0) for f in data["formats"])
+
+    master_id = _int(_text(elem, "master_id"))
+    if master_id:
+        data["master_id"] = master_id
+        data["master_url"] = f"{BASE_URL}/masters/{master_id}"
+
+    if not data["images"]:
+        del data["images"]
+
+    return data
+
+
+def master_from_xml(elem):
+    """ converts a master element of the masters dump into the data of the
+        corresponding api answer (/masters/{id})
+    """
+    master_id = _int(elem.get("id"))
+
+    return {
+        "id": master_id,
+        "main_release": _int(_text(elem, "main_release")),
+        "title": _text(elem, "title"),
+        "year": _int(_text(elem, "year"), 0),
+        "artists": _artists(elem, "artists"),
+        "genres": _texts(elem, "genres/genre"),
+        "styles": _texts(elem, "styles/style"),
+        "data_quality": _text(elem, "data_quality"),
+        "versions_url": f"{BASE_URL}/masters/{master_id}/versions",
+        "uri": f"https://www.discogs.com/master/{master_id}",
+    }
+
+
+def artist_from_xml(elem):
+    """ converts an artist element of the artists dump into the data of the
+        corresponding api answer (/artists/{id})
+    """
+    artist_id = _int(_text(elem, "id"))
+
+    return {
+        "id": artist_id,
+        "name": _text(elem, "name"),
+        "realname": _text(elem, "realname"),
+        "profile": _text(elem, "profile"),
+        "data_quality": _text(elem, "data_quality"),
+        "urls": _texts(elem, "urls/url"),
+        "namevariations": _texts(elem, "namevariations/name"),
+        "releases_url": f"{BASE_URL}/artists/{artist_id}/releases",
+        "uri": f"https://www.discogs.com/artist/{artist_id}",
+    }
+
+
+class DumpIndex(object):
+    """ local index of the monthly discogs data dumps (releases, masters and
+        artists, see https://data.discogs.com), stored in a sqlite database.
+        The data of each release, master and artist is stored the way the
+        api returns it, full-text indexes allow searching similar to the
+        database search of the api.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS releases (
+            id INTEGER PRIMARY KEY,
+            master_id INTEGER,
+            summary TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS releases_master ON releases (master_id);
+        CREATE TABLE IF NOT EXISTS masters (
+            id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS artists (
+            id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS artist_credits (
+            artist_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            ref INTEGER NOT NULL,
+            PRIMARY KEY (artist_id, type, ref)
+        ) WITHOUT ROWID;
+        CREATE VIRTUAL TABLE IF NOT EXISTS release_search USING fts5(
+            text, tokenize='unicode61 remove_diacritics 2');
+        CREATE VIRTUAL TABLE IF NOT EXISTS master_search USING fts5(
+            text, tokenize='unicode61 remove_diacritics 2');
+        CREATE VIRTUAL TABLE IF NOT EXISTS artist_search USING fts5(
+            text, tokenize='unicode61 remove_diacritics 2');
+    """
+
+    TYPES = ("release", "master", "artist")
+
+    def __init__(self, path):
+        self.path = path
+
+        if path != ":memory:":
+            index_dir = os.path.dirname(path)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        path = os.path.expanduser(tagger_config.get("dump", "index_file"))
+
+        logger.debug(f"using dump index {path}")
+        return cls(path)
+
+    # importing
+
+    def import_dump(self, dump_file, batch_size=1000):
+        """ streams the given (optionally gzipped) dump file into the index,
+            the type of the dump is taken from its elements. Returns the
+            number of imported entries.
+        """
+        opener = gzip.open if dump_file.endswith(".gz") else open
+        converters = {
+            "release": (release_from_xml, self._add_releases),
+            "master": (master_from_xml, self._add_masters),
+            "artist": (artist_from_xml, self._add_artists),
+        }
+
+        count = 0
+        with opener(dump_file, "rb") as fh:
+            root = None
+            depth = 0
+            convert = add = None
+            batch = []
+            for event, elem in ET.iterparse(fh, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if root is None:
+                        root = elem
+                    continue
+
+                depth -= 1
+                if depth != 1:
+                    continue
+
+                if convert is None:
+                    if elem.tag not in converters:
+                        raise ValueError(
+                            f"{dump_file} is not a discogs data dump ({elem.tag})")
+                    convert, add = converters[elem.tag]
+                    logger.info(f"importing {elem.tag}s from {dump_file}")
+
+                try:
+                    batch.append(convert(elem))
+                except Exception as e:
+                    logger.warn(f"skipping broken {elem.tag} {elem.get('id')} ({e})")
+
+                # only the current element is needed, keep the memory flat
+                root.clear()
+
+                if len(batch) >= batch_size:
+                    add(batch)
+                    count += len(batch)
+                    batch = []
+                    if count % (batch_size * 100) == 0:
+                        logger.info(f"imported {count} entries")
+
+            if batch:
+                add(batch)
+                count += len(batch)
+
+        logger.info(f"imported {count} entries from {dump_file}")
+        return count
+
+    def _search_title(self, data):
+        return f"{_display_artist(data['artists'])} - {data['title']}"
+
+    def _add_releases(self, releases):
+        rows = []
+        search = []
+        credits = []
+        for data in releases:
+            summary = {
+                "id": data["id"],
+                "type": "release",
+                "title": self._search_title(data),
+                "artist": _display_artist(data["artists"]),
+                "year": str(data["year"]) if data["year"] else "",
+                "country": data["country"],
+                "format": [f["name"] for f in data["formats"]],
+                "label": [l["name"] for l in data["labels"]],
+                "catno": ", ".join(l["catno"] for l in data["labels"]),
+                "genre": data["genres"],
+                "style": data["styles"],
+                "master_id": data.get("master_id", 0),
+                "status": data["status"],
+                "released": data["released"],
+                "resource_url": f"{BASE_URL}/releases/{data['id']}",
+            }
+            rows.append((data["id"], data.get("master_id"),
+                         json.dumps(summary), json.dumps(data)))
+            search.append((data["id"], " ".join(
+                [summary["title"]] +
+                [l["catno"] for l in data["labels"]])))
+            for artist in data["artists"]:
+                if artist["id"] is not None:
+                    credits.append((artist["id"], "release", data["id"]))
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO releases (id, master_id, summary, data) VALUES (?, ?, ?, ?)", rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO release_search (rowid, text) VALUES (?, ?)", search)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO artist_credits (artist_id, type, ref) VALUES (?, ?, ?)", credits)
+
+    def _add_masters(self, masters):
+        rows = []
+        search = []
+        credits = []
+        for data in masters:
+            summary = {
+                "id": data["id"],
+                "type": "master",
+                "title": self._search_title(data),
+                "artist": _display_artist(data["artists"]),
+                "year": str(data["year"]) if data["year"] else "",
+                "genre": data["genres"],
+                "style": data["styles"],
+                "master_id": data["id"],
+                "main_release": data["main_release"],
+                "resource_url": f"{BASE_URL}/masters/{data['id']}",
+            }
+            rows.append((data["id"], json.dumps(summary), json.dumps(data)))
+            search.append((data["id"], summary["title"]))
+            for artist in data["artists"]:
+                if artist["id"] is not None:
+                    credits.append((artist["id"], "master", data["id"]))
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO masters (id, summary, data) VALUES (?, ?, ?)", rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO master_search (rowid, text) VALUES (?, ?)", search)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO artist_credits (artist_id, type, ref) VALUES (?, ?, ?)", credits)
+
+    def _add_artists(self, artists):
+        rows = []
+        search = []
+        for data in artists:
+            summary = {
+                "id": data["id"],
+                "type": "artist",
+                "title": data["name"],
+                "resource_url": f"{BASE_URL}/artists/{data['id']}",
+            }
+            rows.append((data["id"], json.dumps(summary), json.dumps(data)))
+            search.append((data["id"], " ".join(
+                [data["name"]] + data["namevariations"])))
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO artists (id, summary, data) VALUES (?, ?, ?)", rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO artist_search (rowid, text) VALUES (?, ?)", search)
+
+    # lookups
+
+    def _get(self, table, id):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT data FROM {table}s WHERE id = ?", (int(id),)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def release(self, release_id):
+        return self._get("release", release_id)
+
+    def master(self, master_id):
+        return self._get("master", master_id)
+
+    def artist(self, artist_id):
+        return self._get("artist", artist_id)
+
+    def releases(self, batch_size=1000):
+        """ iterates over the data of all releases in the index """
+        last_id = -1
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, data FROM releases WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[1])
+            last_id = rows[-1][0]
+
+    def versions(self, master_id, offset=0, limit=50):
+        """ returns the number of releases of the given master and the
+            summaries of the requested page
+        """
+        with self.lock:
+            count = self.connection.execute(
+                "SELECT COUNT(*) FROM releases WHERE master_id = ?",
+                (int(master_id),)).fetchone()[0]
+            rows = self.connection.execute(
+                "SELECT summary FROM releases WHERE master_id = ? ORDER BY id LIMIT ? OFFSET ?",
+                (int(master_id), limit, offset)).fetchall()
+
+        versions = []
+        for row in rows:
+            summary = json.loads(row[0])
+            summary["label"] = ", ".join(summary["label"])
+            summary["format"] = ", ".join(summary["format"])
+            versions.append(summary)
+        return count, versions
+
+    def artist_releases(self, artist_id, offset=0, limit=50):
+        """ returns the number of masters and releases (without master) of
+            the given artist and the summaries of the requested page
+        """
+        query = """
+            SELECT m.summary FROM artist_credits c JOIN masters m ON m.id = c.ref
+            WHERE c.artist_id = ? AND c.type = 'master'
+            UNION ALL
+            SELECT r.summary FROM artist_credits c JOIN releases r ON r.id = c.ref
+            WHERE c.artist_id = ? AND c.type = 'release' AND r.master_id IS NULL
+        """
+        with self.lock:
+            count = self.connection.execute(
+                f"SELECT COUNT(*) FROM ({query})",
+                (int(artist_id), int(artist_id))).fetchone()[0]
+            rows = self.connection.execute(
+                f"{query} LIMIT ? OFFSET ?",
+                (int(artist_id), int(artist_id), limit, offset)).fetchall()
+
+        releases = []
+        for row in rows:
+            summary = json.loads(row[0])
+            # the titles of the releases of an artist do not contain the artist
+            summary["title"] = summary["title"][len(summary["artist"]) + 3:]
+            summary["role"] = "Main"
+            releases.append(summary)
+        return count, releases
+
+    def match_expression(self, query):
+        """ converts a search string into a fts5 query matching all words """
+        words = re.findall(r"\w+", query.lower())
+        return " ".join('"%s"' % w for w in words)
+
+    def search(self, query, type=None, offset=0, limit=50):
+        """ searches the index like the database search of the api, returns
+            the number of results and the summaries of the requested page.
+            Types other than release, master and artist search everything.
+        """
+        expression = self.match_expression(query)
+        if expression == "":
+            return 0, []
+
+        types = (type,) if type in self.TYPES else self.TYPES
+        union = " UNION ALL ".join(
+            f"SELECT '{t}' AS type, rowid AS ref, rank FROM {t}_search WHERE {t}_search MATCH :q"
+            for t in types)
+
+        with self.lock:
+            count = self.connection.execute(
+                f"SELECT COUNT(*) FROM ({union})", {"q": expression}).fetchone()[0]
+            hits = self.connection.execute(
+                f"SELECT type, ref FROM ({union}) ORDER BY rank LIMIT :limit OFFSET :offset",
+                {"q": expression, "limit": limit, "offset": offset}).fetchall()
+
+            results = []
+            for t, ref in hits:
+                row = self.connection.execute(
+                    f"SELECT summary FROM {t}s WHERE id = ?", (ref,)).fetchone()
+                if row is not None:
+                    results.append(json.loads(row[0]))
+
+        return count, results
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class DumpFetcher(Fetcher):
+    """ answers the requests of the discogs client from the dump index
+        instead of the api, so that releases can be searched and fetched
+        without any network access. Only the requests used by the tagger
+        are supported (releases, masters with their versions, artists with
+        their releases and the database search).
+    """
+
+    def __init__(self, dump_index):
+        self.dump_index = dump_index
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        body = None
+        if method == "GET":
+            body = self._answer(url)
+
+        if body is None:
+            logger.debug(f"not found in the dump index: {method} {url}")
+            return b'{"message": "The requested resource was not found."}', 404
+
+        return _json_bytes(body), 200
+
+    def _answer(self, url):
+        parts = urlsplit(url)
+        path = [p for p in parts.path.split("/") if p]
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+        page = max(_int(params.get("page"), 1), 1)
+        per_page = max(_int(params.get("per_page"), 50), 1)
+        offset = (page - 1) * per_page
+
+        if path == ["database", "search"]:
+            count, results = self.dump_index.search(
+                params.get("q", ""), params.get("type"), offset, per_page)
+            return self._page("results", results, count, page, per_page)
+
+        if len(path) == 2 and path[0] == "releases":
+            return self.dump_index.release(path[1])
+        if len(path) == 2 and path[0] == "masters":
+            return self.dump_index.master(path[1])
+        if len(path) == 2 and path[0] == "artists":
+            return self.dump_index.artist(path[1])
+
+        if len(path) == 3 and path[0] == "masters" and path[2] == "versions":
+            count, versions = self.dump_index.versions(
+                path[1], offset, per_page)
+            return self._page("versions", versions, count, page, per_page)
+        if len(path) == 3 and path[0] == "artists" and path[2] == "releases":
+            count, releases = self.dump_index.artist_releases(
+                path[1], offset, per_page)
+            return self._page("releases", releases, count, page, per_page)
+
+        return None
+
+    def _page(self, key, items, count, page, per_page):
+        return {
+            "pagination": {
+                "page": page,
+                "per_page": per_page,
+                "items": count,
+                "pages": max((count + per_page - 1) // per_page, 1),
+                "urls": {},
+            },
+            key: items,
+        }
+
+
+def _json_bytes(body):
+    return json.dumps(body).encode("utf8")
@@ -3,9 +3,14 @@ import pprint
 import os
 from pathlib import Path
 import shutil
+import subprocess
 from mutagen.flac import FLAC
 import re
-from ext.cue import CUE, Track
+from configparser import RawConfigParser
+from ext.cue import CUE, Track, ImageIndex
+from discogstagger.scanner import scan
+from discogstagger.scanindex import ScanIndex
+from discogstagger.cuesplit import CueSplitter
 
 import logging
 logger = logging
@@ -20,6 +25,11 @@ class FileUtils(object):
         self.cue_done_dir = self.config.get('cue', 'cue_done_dir')
         self.done_file = self.config.get("details", "done_file")
         self.forceUpdate = options.forceUpdate
+        self.inventories = {}
+        self.scan_index = ScanIndex.from_config(tagger_config)
+        self.cue_splitter = CueSplitter(
+            self.config.getint('cue', 'split_workers'),
+            self.config.getint('cue', 'split_compression'))
 
     def read_id_file(self, dir, file_name, options):
         # read tags from batch file if available
@@ -36,8 +46,49 @@ class FileUtils(object):
 
         return releaseid
 
+    def peek_id_file(self, dir, file_name):
+        """ reads the release id from the id file in the given directory,
+            without merging the id file into the configuration (as
+            read_id_file does)
+        """
+        idfile = os.path.join(dir, file_name)
+        if not os.path.exists(idfile):
+            return None
+
+        id_config = RawConfigParser(strict=False)
+        id_config.read_dict({"source": dict(self.config.items("source"))})
+        id_config.read(idfile)
+
+        source_type = id_config.get("source", "name")
+        id_name = id_config.get("source", source_type)
+
+        return id_config.get("source", id_name, fallback=None)
+
+    def read_release_ids(self, source_dirs, file_name):
+        """ returns the release ids found in the id files of the given source
+            directories (in the same order), albums which are already done
+            are skipped, unless forceUpdate is given
+        """
+        release_ids = []
+        for source_dir in source_dirs:
+            if not self.forceUpdate and \
+                    os.path.exists(os.path.join(source_dir, self.done_file)):
+                continue
+            releaseid = self.peek_id_file(source_dir, file_name)
+            if releaseid:
+                release_ids.append(releaseid)
+
+        return release_ids
+
     def walk_dir_tree(self, start_dir, id_file):
         source_dirs = []
+        if self.scan_index is not None:
+            for root, has_id_file in self._walk_scan_index(start_dir, id_file):
+                if has_id_file:
+                    logger.debug(f"found {id_file} in {root}")
+                    source_dirs.append(root)
+            return source_dirs
+
         for root, _, files in os.walk(start_dir):
             if id_file in files:
                 logger.debug(f"found {id_file} in {root}")
@@ -47,6 +98,14 @@ class FileUtils(object):
 
     def walk_dir_base_tree(self, start_dir):
         source_dirs = []
+        if self.scan_index is not None:
+            id_file = self.config.get("batch", "id_file")
+            for root, _ in self._walk_scan_index(start_dir, id_file):
+                if root != os.path.abspath(start_dir):
+                    logger.debug(f"found {root}")
+                    source_dirs.append(root)
+            return source_dirs
+
         for root, dirs, _ in os.walk(start_dir):
             for dir in dirs:
                 logger.debug(f"found {dir} in {root}")
@@ -54,60 +113,82 @@ class FileUtils(object):
 
         return source_dirs
 
+    def _walk_scan_index(self, start_dir, id_file):
+        """ walks the directories using the scan index, albums which are
+            already done are skipped, unless forceUpdate is given
+        """
+        return self.scan_index.walk(start_dir, id_file, self.done_file,
+                                    include_done=self.forceUpdate)
+
+    def mark_done(self, source_dir):
+        """ records the tagged album in the scan index (if used) """
+        if self.scan_index is not None:
+            self.scan_index.mark_done(source_dir)
+
     def get_audio_dirs(self, start_dir):
         """ Returns a list of directories with audio track to be processed.
-            Any CUE files encountered will be split automatically
+            Any CUE files encountered will be split automatically.
+            Every directory is listed once, the inventories of the found
+            directories are kept for the later stages (see album_inventory).
         """
         parse_cue_files = self.config.getboolean('cue', 'parse_cue_files')
         extf = (self.cue_done_dir)
+        codecs = ('.flac', '.mp3', '.ape', '.wav', '.wv')
         source_dirs = []
 
-        for root, dirs, files in os.walk(start_dir, topdown=True):
-            dirs[:] = [d for d in dirs if d not in extf]
-            done = []
-            cue_files = []
-            audio_files = []
-            unwalk = []
-            for dir in dirs:
-                if os.path.exists(os.path.join(root, dir, self.done_file)):
-                    done.append(dir)
+        stack = [scan(start_dir)]
+        while stack:
+            inventory = stack.pop()
+            root = inventory.path
+            dirs = [d for d in inventory.dirs if d not in extf]
+            done = [d for d in dirs if inventory.child(d).has(self.done_file)]
             if len(done) > 0:
-                dirs[:] = [d for d in dirs if d not in done]
+                dirs = [d for d in dirs if d not in done]
+
+            cue_files = list(inventory.cue_files)
+            audio_files = inventory.audio_files(codecs)
+            unwalk = inventory.disc_dirs(done)
+            for dir in unwalk:
+                logger.debug('Directory has cd/disc subdirectories')
+                disc = inventory.child(dir)
+                cue_files.extend(os.path.join(disc.path, f) for f in disc.cue_files)
+                audio_files.extend(os.path.join(disc.path, f) for f in disc.audio_files(codecs))
+            dirs = [d for d in dirs if d not in unwalk]
 
-            for file in files:
-                if file.endswith('.cue'):
-                    cue_files.append(file)
-                elif file.endswith(('.flac', '.mp3', '.ape', '.wav', '.wv')):
-                    audio_files.append(file)
-            for dir in dirs:
-                if re.search('^(?i)(cd|disc)\s*\d+', dir):
-                    logger.debug('Directory has cd/disc subdirectories')
-                    unwalk.append(dir)
-                    d = Path(os.path.join(root, dir))
-                    for file in d.iterdir():
-                        if str(file).endswith('.cue'):
-                            cue_files.append(str(file))
-                        if str(file).endswith(('.flac', '.mp3', '.ape', '.wav', '.wv')):
-                            audio_files.append(str(file))
-            dirs[:] = [d for d in dirs if d not in unwalk]
             if parse_cue_files == True and len(cue_files) > 0 and len(cue_files) == len(audio_files):
                 result = self._processCueFiles(root, cue_files)
                 if result == 0:
+                    # the directory changed, it is scanned again when needed
                     source_dirs.append(root + '/')
-            elif len(audio_files) > 0 and self.done_file not in files:
+            elif len(audio_files) > 0 and not inventory.has(self.done_file):
                 source_dirs.append(root + '/')
-                logger.debug('found %s in %s' % (file, root + '/'))
+                self.inventories[os.path.normpath(root)] = inventory
+                logger.debug('found %s in %s' % (audio_files[-1], root + '/'))
+
+            stack.extend(inventory.child(d) for d in reversed(dirs))
 
         return source_dirs
 
+    def album_inventory(self, source_dir):
+        """ returns the inventory of the given album directory, taken from
+            the scan of get_audio_dirs if possible
+        """
+        inventory = self.inventories.pop(os.path.normpath(source_dir), None)
+        if inventory is None:
+            inventory = scan(source_dir)
+        return inventory
+
     def _processCueFiles(self, dir, files):
         """ Process CUE files.  Work out multi-disc sets
         """
         logger.debug('processing cue files found')
         files.sort()
+        cues = []
+        # the directories are listed once for all cue files
+        image_index = ImageIndex()
         for idx, file in enumerate(files):
             cue_in = os.path.join(dir, file)
-            cue = CUE(cue_in)
+            cue = CUE(cue_in, image_index)
             if cue.title is not None:
                 cue.title = re.sub('(?i)\s+(cd|disc)\s*\d+$', '', cue.title)
             cue.output_format = str(idx + 1) + \
@@ -115,6 +196,19 @@ class FileUtils(object):
             if len(files) > 1:
                 cue.discnumber = str(idx + 1)
                 cue.disctotal = str(len(files))
+            cues.append(cue)
+
+        if self.cue_splitter.can_split(cues):
+            # all discs at once, tagged while encoding
+            destinations = [self._cueDestination(cue) for cue in cues]
+            if not self.cue_splitter.split(list(zip(cues, destinations))):
+                logger.debug('Problem processing cue files in directory' + dir)
+                return 1
+            for cue, destination in zip(cues, destinations):
+                self._cleanupCueFile(cue, destination)
+            return 0
+
+        for cue in cues:
             result = self._splitCueFile(cue)
             if result != 0:
                 logger.debug('Problem processing cue files in directory' + dir)
@@ -161,8 +255,9 @@ class FileUtils(object):
                 audio.pprint()
                 audio.save()
 
-    def _splitCueFile(self, cue):
-        """ Handles the splitting and tidy up of cue files and associated audio
+    def _cueDestination(self, cue):
+        """ the directory of the split files, a subdirectory per disc on
+            multi-disc sets
         """
         destination = cue.image_file_directory
         if cue.disctotal is not None and int(cue.disctotal) > 1:
@@ -171,15 +266,22 @@ class FileUtils(object):
         p = Path(destination)
         if not p.exists():
             p.mkdir()
+        return destination
 
-        logger.debug('splitting cue files')
-        cmd = "shntool split -f {0} {1} -t {2} -o flac -d {3}".format(
-            self._escape_string(cue.file_name),
-            self._escape_string(cue.image_file_name),
-            cue.output_format,
-            self._escape_string(destination))
+    def _splitCueFile(self, cue):
+        """ Handles the splitting (with shntool, for images the flac tool
+            cannot read) and tidy up of cue files and associated audio
+        """
+        destination = self._cueDestination(cue)
 
-        return_code = os.system(cmd)
+        logger.debug('splitting cue files')
+        cmd = ['shntool', 'split', '-f', cue.file_name, cue.image_file_name,
+               '-t', cue.output_format, '-o', 'flac', '-d', destination]
+        try:
+            return_code = subprocess.run(cmd).returncode
+        except OSError as e:
+            logger.error('Unable to run shntool: {}'.format(e))
+            return_code = 1
 
         """ Tag the files with metadata present in cue file
         """
@@ -190,37 +292,22 @@ class FileUtils(object):
             logger.debug(return_code)
             return 1
 
+        self._cleanupCueFile(cue, destination)
+        return 0
+
+    def _cleanupCueFile(self, cue, destination):
         """ Cleanup directory so that only the split files are present
             Also remove any 00.flac files
         """
-        if return_code == 0:
-            logger.debug('cleaning up cue files, and associated audio files')
-            done_dir = os.path.join(
-                cue.image_file_directory, self.cue_done_dir)
-            p = Path(done_dir)
-            if not p.exists():
-                p.mkdir()
-
-            for file in (cue.file_name, cue.image_file_name):
-                shutil.move(str(file), str(done_dir))
-            d = Path(destination)
-            for file in d.glob('*00.flac'):
-                deletion = os.remove(str(file))
-            return 0
+        logger.debug('cleaning up cue files, and associated audio files')
+        done_dir = os.path.join(
+            cue.image_file_directory, self.cue_done_dir)
+        p = Path(done_dir)
+        if not p.exists():
+            p.mkdir()
 
-    def _escape_string(self, string):
-        return '%s' % (
-            string
-            .replace('\\', '\\\\')
-            .replace(' ', '\\ ')
-            .replace('(', '\(')
-            .replace(')', '\)')
-            .replace(',', '\,')
-            .replace('"', '\"')
-            .replace('$', '\$')
-            .replace(';', '\;')
-            .replace('&', '\&')
-            .replace('!', '\!')
-            .replace('`', '\`')
-            .replace("'", "\\'")
-        )
+        for file in (cue.file_name, cue.image_file_name):
+            shutil.move(str(file), str(done_dir))
+        d = Path(destination)
+        for file in d.glob('*00.flac'):
+            deletion = os.remove(str(file))
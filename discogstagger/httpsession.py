@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging
+
+# the umask can only be read by setting it, this is done once here (and not
+# in the download threads)
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def build_session(tagger_config):
+    """ creates a requests session keeping a pool of keep-alive connections
+        per host, failed GET requests (connection errors and 5xx answers)
+        are retried with a backoff as configured in [http]. Answers with
+        status 429 are left to the rate limiter.
+    """
+    pool_size = tagger_config.getint("http", "pool_size")
+    retries = Retry(total=tagger_config.getint("http", "retries"),
+                    backoff_factor=tagger_config.getfloat("http", "backoff"),
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=("GET", "HEAD"),
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size, max_retries=retries)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = tagger_config.get("common", "user_agent")
+
+    return session
+
+
+def download(session, url, target_file, timeout=None, chunk_size=65536):
+    """ streams the given url into a temporary file next to the target file,
+        which is renamed to the target file once the download is complete,
+        so that an interrupted download never leaves a truncated file behind.
+        Returns the response (e.g. to read the headers).
+    """
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+
+        fd, temp_file = tempfile.mkstemp(
+            prefix=".", suffix=".part", dir=os.path.dirname(target_file))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    fh.write(chunk)
+            # mkstemp creates the file with mode 0600
+            os.chmod(temp_file, 0o666 & ~UMASK)
+            os.replace(temp_file, target_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    return response
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import os
+import errno
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+
+from discogstagger.transfer import FileTransfer
+
+logger = logging
+
+_link = FileTransfer("hardlink")
+
+
+def link_file(source, target):
+    """ places source at target without copying the data if possible, tries
+        a hardlink, then a reflink and copies the file as a last resort. An
+        existing target is replaced. Returns the method used.
+    """
+    return _link.transfer(source, target)
+
+
+def file_hash(path, chunk_size=65536):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCache(object):
+    """ content-addressed store for the images downloaded from discogs, the
+        images are stored once by the sha256 of their content (in
+        objects/<2 chars>/<hash>) and a sqlite index maps the image urls
+        to the content. Images shared between releases (e.g. reissues) or
+        downloaded again (re-tagging) are linked into the target directory
+        without asking discogs again.
+
+        As the images are hardlinked if possible, image files in the target
+        directories must be replaced, never modified in place.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            url TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS images_hash ON images (hash);
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.objects_dir):
+            os.makedirs(self.objects_dir)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(directory, "images.db"), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the image cache as configured in the [cache] section,
+            returns None if the cache is disabled
+        """
+        if not tagger_config.getboolean("cache", "image_cache"):
+            return None
+
+        directory = os.path.expanduser(
+            tagger_config.get("cache", "image_cache_dir"))
+
+        logger.debug(f"using image cache {directory}")
+        return cls(directory)
+
+    def object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash)
+
+    def lookup(self, url):
+        """ returns the path of the cached image for the given url or None """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT hash FROM images WHERE url = ?", (url,)).fetchone()
+
+        if row is not None:
+            path = self.object_path(row[0])
+            if os.path.exists(path):
+                self.hits += 1
+                return path
+            logger.debug(f"cached image for {url} is gone")
+
+        self.misses += 1
+        return None
+
+    def fetch(self, url, target_file):
+        """ links the cached image for the given url to target_file, returns
+            False if the image is not cached
+        """
+        path = self.lookup(url)
+        if path is None:
+            return False
+
+        method = link_file(path, target_file)
+        logger.debug(f"using cached image for {url} ({method})")
+        return True
+
+    def store(self, url, source_file):
+        """ adds the (downloaded) image source_file to the store and
+            remembers it for the given url, returns the content hash
+        """
+        content_hash = file_hash(source_file)
+        path = self.object_path(content_hash)
+
+        if not os.path.exists(path):
+            object_dir = os.path.dirname(path)
+            try:
+                os.makedirs(object_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            link_file(source_file, path)
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (url, hash, size, stored) VALUES (?, ?, ?, ?)",
+                (url, content_hash, os.path.getsize(path), time.time()))
+
+        return content_hash
+
+    def __contains__(self, url):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM images WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(DISTINCT hash) FROM images").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import logging
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from discogstagger.httpsession import UMASK
+
+logger = logging
+
+# the fastest hash available, xxhash if installed, blake2b otherwise
+ALGORITHM = "xxh64" if xxhash is not None else "blake2b"
+
+
+def new_digest(algorithm=ALGORITHM):
+    if algorithm == "xxh64":
+        if xxhash is None:
+            raise ValueError("xxhash is not installed")
+        return xxhash.xxh64()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    raise ValueError(f"unknown checksum algorithm: {algorithm}")
+
+
+def file_digest(path, algorithm=ALGORITHM, chunk_size=1048576):
+    digest = new_digest(algorithm)
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _state(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+class Manifest(object):
+    """ records the files placed in an album directory (by their path relative
+        to the directory): the source file with its size and mtime, and the
+        size, mtime and checksum of the file written. Later runs skip files,
+        whose source and target did not change since, and transfer those
+        again which differ (truncated or stale copies). The library can be
+        verified against the manifests without reading the sources.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(path)
+        self.algorithm = ALGORITHM
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as fh:
+                    data = json.load(fh)
+                self.algorithm = data["algorithm"]
+                self.entries = data["files"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warn(f"unable to read manifest {path}, ignored ({e})")
+
+        if self.algorithm != ALGORITHM:
+            try:
+                new_digest(self.algorithm)
+            except ValueError:
+                # written with another hash, the checksums are recomputed
+                logger.info(f"{path} uses {self.algorithm}, switching to {ALGORITHM}")
+                self.algorithm = ALGORITHM
+                for entry in self.entries.values():
+                    entry["hash"] = None
+
+    def name(self, target):
+        return os.path.relpath(target, self.base_dir)
+
+    def record(self, source, target, checksum=None):
+        """ records the transfer of source to target, checksum is the
+            checksum of the data written (computed while transferring), it is
+            computed when saving, if None
+        """
+        size, mtime = _state(target)
+        try:
+            source_size, source_mtime = _state(source)
+        except OSError:
+            # moved, a rename keeps the size and mtime
+            source_size, source_mtime = size, mtime
+        with self.lock:
+            self.entries[self.name(target)] = {
+                "source": source,
+                "source_size": source_size,
+                "source_mtime": source_mtime,
+                "size": size,
+                "mtime": mtime,
+                "hash": checksum,
+            }
+
+    def unchanged(self, source, target):
+        """ whether target is still the recorded (complete) copy of source.
+            Returns None, if the target is not in the manifest.
+        """
+        entry = self.entries.get(self.name(target))
+        if entry is None:
+            return None
+        try:
+            if os.path.exists(source) and \
+                    (entry["source_size"], entry["source_mtime"]) != _state(source):
+                return False
+            return (entry["size"], entry["mtime"]) == _state(target)
+        except OSError:
+            return False
+
+    def save(self):
+        """ writes the manifest, the files changed since their transfer (the
+            tracks, after tagging) are recorded with their current size, mtime
+            and checksum
+        """
+        for name, entry in list(self.entries.items()):
+            target = os.path.join(self.base_dir, name)
+            try:
+                state = _state(target)
+            except OSError:
+                del self.entries[name]
+                continue
+            if (entry["size"], entry["mtime"]) != state or entry["hash"] is None:
+                entry["hash"] = file_digest(target, self.algorithm)
+                entry["size"], entry["mtime"] = state
+
+        fd, temp_file = tempfile.mkstemp(
+            prefix=".", suffix=".part", dir=self.base_dir)
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump({"algorithm": self.algorithm, "files": self.entries},
+                          fh, indent=1, sort_keys=True)
+            # mkstemp creates the file with mode 0600
+            os.chmod(temp_file, 0o666 & ~UMASK)
+            os.replace(temp_file, self.path)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def verify(self):
+        """ compares the files with their recorded checksums, returns the
+            names of the missing and differing files
+        """
+        failed = []
+        for name, entry in sorted(self.entries.items()):
+            target = os.path.join(self.base_dir, name)
+            try:
+                if os.path.getsize(target) != entry["size"] or \
+                        file_digest(target, self.algorithm) != entry["hash"]:
+                    failed.append(name)
+            except OSError:
+                failed.append(name)
+        return failed
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging
+
+
+class ReleasePrefetcher(object):
+    """ fetches releases ahead of the tagging loop on a bounded pool of
+        worker threads, so that the network is busy while the files of the
+        current album are tagged and copied. The workers use the connector
+        (and therefor its rate limiter and release cache) as usual, at most
+        depth releases are kept ahead of the tagging loop.
+    """
+
+    def __init__(self, connector, workers=4, depth=16):
+        self.connector = connector
+        self.depth = max(depth, workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.futures = OrderedDict()
+
+    def start(self, release_ids):
+        """ queues the given release ids (in the order they will be tagged) """
+        with self.lock:
+            for release_id in release_ids:
+                self.pending.append(str(release_id))
+            self._fill()
+
+        logger.info(f"prefetching {len(self.pending) + len(self.futures)} releases")
+
+    def _fill(self):
+        """ submits queued releases until depth releases are in flight,
+            needs to be called with the lock held
+        """
+        while self.pending and len(self.futures) < self.depth:
+            release_id = self.pending.popleft()
+            if release_id not in self.futures:
+                self.futures[release_id] = self.executor.submit(
+                    self.connector.fetch_release, release_id)
+
+    def fetch_release(self, release_id):
+        """ returns the prefetched release, releases which are not prefetched
+            (or could not be prefetched) are fetched directly
+        """
+        release_id = str(release_id)
+        future = None
+
+        with self.lock:
+            if release_id in self.futures:
+                # releases queued before this one were skipped by the tagging
+                # loop, there is no need to keep them any longer
+                while self.futures:
+                    queued_id, queued = self.futures.popitem(last=False)
+                    if queued_id == release_id:
+                        future = queued
+                        break
+                    queued.cancel()
+            elif release_id in self.pending:
+                # all releases in flight were skipped, as well as the queued
+                # releases before this one, which is fetched directly
+                for queued in self.futures.values():
+                    queued.cancel()
+                self.futures.clear()
+                while self.pending.popleft() != release_id:
+                    pass
+            self._fill()
+
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                logger.warn(f"prefetching release {release_id} failed ({e}), retrying")
+
+        return self.connector.fetch_release(release_id)
+
+    def shutdown(self):
+        with self.lock:
+            self.pending.clear()
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import logging
+
+import requests
+from discogs_client.fetchers import OAuth2Fetcher, RequestsFetcher, \
+    UserTokenRequestsFetcher
+
+logger = logging
+
+
+class TokenBucket(object):
+    """ a token bucket allowing rate requests per period seconds, the
+        bucket holds at most rate tokens (requests may burst up to that)
+    """
+
+    def __init__(self, name, rate, period=60.0):
+        self.name = name
+        self.period = period
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def reserve(self):
+        """ takes a token out of the bucket and returns the number of seconds
+            the caller has to wait before the request may be sent. The token
+            is reserved right away, so that concurrent callers queue up.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.fill_rate)
+        return wait
+
+    def learn(self, limit, remaining):
+        """ adopts the limits discogs reports in the response headers """
+        if limit and limit != self.capacity:
+            logger.debug(f"rate limit for {self.name} is {limit} per {self.period}s")
+            self.capacity = float(limit)
+            self.fill_rate = limit / self.period
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+    def pause(self, seconds):
+        """ blocks the bucket for the given number of seconds """
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until,
+                                 time.monotonic() + seconds)
+
+
+class RateLimiter(object):
+    """ rate limiter shared by all connections to discogs, with a separate
+        token bucket for each type of request (metadata, search, image).
+        The buckets learn the real limits from the X-Discogs-Ratelimit
+        headers, answers with status 429 are retried after the time given
+        in the Retry-After header or using an exponential backoff.
+    """
+
+    TYPES = ("metadata", "search", "image")
+
+    def __init__(self, rates, period=60.0, max_retries=5, backoff=2.0):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        for name, rate in rates.items():
+            self.buckets[name] = TokenBucket(name, rate, period)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.requests = 0
+        self.waited = 0.0
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        rates = {}
+        for name in cls.TYPES:
+            rates[name] = tagger_config.getint("ratelimit", name)
+
+        return cls(rates,
+                   max_retries=tagger_config.getint("ratelimit", "max_retries"),
+                   backoff=tagger_config.getfloat("ratelimit", "backoff"))
+
+    def acquire(self, type="metadata"):
+        """ blocks until a request of the given type may be sent """
+        with self.lock:
+            wait = self.buckets[type].reserve()
+            self.requests += 1
+            self.waited += wait
+
+        if wait > 0:
+            logger.debug(f"waiting {wait:.2f}s to allow rate limiting ({type})...")
+            time.sleep(wait)
+
+        return wait
+
+    def update(self, type, headers):
+        """ adjusts the bucket of the given type using the response headers """
+        limit = self._header_int(headers, "X-Discogs-Ratelimit")
+        remaining = self._header_int(headers, "X-Discogs-Ratelimit-Remaining")
+
+        if limit is not None or remaining is not None:
+            with self.lock:
+                self.buckets[type].learn(limit, remaining)
+
+    def retry_after(self, type, headers, attempt):
+        """ blocks the bucket of the given type after a 429 answer for the
+            number of seconds (returned) to wait before the request is retried
+        """
+        seconds = self._header_int(headers, "Retry-After")
+        if seconds is None:
+            seconds = self.backoff ** (attempt + 1)
+
+        logger.warn(f"rate limit exceeded ({type}), retrying in {seconds}s")
+        with self.lock:
+            self.buckets[type].pause(seconds)
+
+        return seconds
+
+    def _header_int(self, headers, name):
+        try:
+            return int(headers[name])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+_shared_rate_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter(tagger_config):
+    """ returns the rate limiter shared by all connectors of this process """
+    global _shared_rate_limiter
+
+    with _shared_lock:
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = RateLimiter.from_config(tagger_config)
+
+    return _shared_rate_limiter
+
+
+class RateLimitedFetcher(object):
+    """ wraps the fetcher of a discogs client, so that every request made by
+        the client goes through the rate limiter and the rate limit headers
+        of the response can be read (the fetchers of discogs_client only
+        return the content and the status code)
+    """
+
+    WRAPPED_FETCHERS = (RequestsFetcher, OAuth2Fetcher,
+                        UserTokenRequestsFetcher)
+
+    def __init__(self, fetcher, rate_limiter, session=None, timeout=None):
+        self.fetcher = fetcher
+        self.rate_limiter = rate_limiter
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+
+    @classmethod
+    def install(cls, client, rate_limiter, session=None, timeout=None):
+        """ wraps the fetcher of the given discogs client, fetchers not
+            talking to the discogs api (e.g. in tests) are left alone
+        """
+        if isinstance(client._fetcher, cls.WRAPPED_FETCHERS):
+            client._fetcher = cls(client._fetcher, rate_limiter,
+                                  session, timeout)
+        return client._fetcher
+
+    def __getattr__(self, name):
+        # token handling et al. is done by the wrapped fetcher
+        return getattr(self.fetcher, name)
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        type = "search" if "/database/search" in url else "metadata"
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(type)
+            response = self._request(method, url, data, headers)
+            self.rate_limiter.update(type, response.headers)
+
+            if response.status_code != 429 or attempt >= self.rate_limiter.max_retries:
+                return response.content, response.status_code
+
+            # the next acquire waits until the bucket is unblocked again
+            self.rate_limiter.retry_after(type, response.headers, attempt)
+            attempt += 1
+
+    def _request(self, method, url, data, headers):
+        params = None
+        body = data
+
+        if isinstance(self.fetcher, OAuth2Fetcher):
+            url, headers, body = self.fetcher.client.sign(
+                url, http_method=method, body=data, headers=headers)
+        elif isinstance(self.fetcher, UserTokenRequestsFetcher):
+            params = {"token": self.fetcher.user_token}
+
+        return self.session.request(method, url, params=params, data=body,
+                                    headers=headers, timeout=self.timeout)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging
+
+
+class ReleaseCache(object):
+    """ persistent cache for the release data fetched from the discogs api,
+        keyed by the release id and stored in a sqlite database.
+
+        Entries older than ttl seconds are treated as missing (0 keeps them
+        forever), and if more than max_entries releases are stored, the
+        least recently used ones are evicted (0 means no limit).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS releases (
+            id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS releases_accessed ON releases (accessed);
+    """
+
+    def __init__(self, path, ttl=0, max_entries=0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if path != ":memory:":
+            cache_dir = os.path.dirname(path)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+        # the cache is shared between threads, sqlite access is serialized
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the release cache as configured in the [cache] section,
+            returns None if the cache is disabled
+        """
+        if not tagger_config.getboolean("cache", "release_cache"):
+            return None
+
+        path = os.path.expanduser(
+            tagger_config.get("cache", "release_cache_file"))
+        ttl = tagger_config.getint("cache", "release_cache_ttl")
+        max_entries = tagger_config.getint("cache", "release_cache_size")
+
+        logger.debug(f"using release cache {path}")
+        return cls(path, ttl, max_entries)
+
+    def get(self, release_id):
+        """ returns the cached release data (dict) for the given release id
+            or None, if the release is not cached or the entry has expired
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT data, fetched FROM releases WHERE id = ?",
+                (int(release_id),)).fetchone()
+
+            if row is None or (self.ttl > 0 and row[1] < now - self.ttl):
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE releases SET accessed = ? WHERE id = ?",
+                (now, int(release_id)))
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, release_id, data):
+        """ stores the release data (dict) for the given release id, evicting
+            the least recently used releases if the cache is full
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO releases (id, data, fetched, accessed) VALUES (?, ?, ?, ?)",
+                (int(release_id), json.dumps(data), now, now))
+            self._evict()
+
+    def releases(self, batch_size=1000):
+        """ iterates over the data of all cached releases """
+        last_id = -1
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, data FROM releases WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[1])
+            last_id = rows[-1][0]
+
+    def __contains__(self, release_id):
+        return self.get(release_id) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    def _evict(self):
+        """ removes expired entries and, if still too many entries are stored,
+            the least recently used ones. Needs to be called with the lock held.
+        """
+        if self.ttl > 0:
+            self.connection.execute(
+                "DELETE FROM releases WHERE fetched < ?", (time.time() - self.ttl,))
+
+        if self.max_entries > 0:
+            count = self.connection.execute(
+                "SELECT COUNT(*) FROM releases").fetchone()[0]
+            if count > self.max_entries:
+                logger.debug(
+                    f"evicting {count - self.max_entries} releases from cache")
+                self.connection.execute(
+                    "DELETE FROM releases WHERE id IN (SELECT id FROM releases ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
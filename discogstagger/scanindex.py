@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging
+
+PENDING = "pending"
+DONE = "done"
+
+
+class ScanIndex(object):
+    """ persistent index of the directories of the library (stored in a
+        sqlite database) for recursive runs. For every directory the mtime,
+        the inode, the number of files, whether it contains an id file and
+        its tagging status are stored.
+
+        A rescan stats every directory, but only lists the directories whose
+        mtime (or inode) changed, the subdirectories of unchanged directories
+        are taken from the index. Albums known to be done are skipped (unless
+        done albums are requested, e.g. with --force) as long as their
+        directory did not change, a removed done file or new files make them
+        show up again. Their subdirectories are walked as any other.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime REAL NOT NULL,
+            inode INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            has_id_file INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            scanned REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.listed = 0
+        self.unchanged = 0
+        self.skipped = 0
+
+        if path != ":memory:":
+            index_dir = os.path.dirname(path)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the scan index as configured in the [cache] section,
+            returns None if the index is disabled
+        """
+        if not tagger_config.getboolean("cache", "scan_index"):
+            return None
+
+        path = os.path.expanduser(tagger_config.get("cache", "scan_index_file"))
+
+        logger.debug(f"using scan index {path}")
+        return cls(path)
+
+    def walk(self, start_dir, id_file, done_file, include_done=False):
+        """ returns the directories below (and including) start_dir, which
+            are not done (or all, if include_done is given), as a list of
+            (path, has_id_file) tuples, top down
+        """
+        start_dir = os.path.abspath(start_dir)
+        self.listed = self.unchanged = self.skipped = 0
+
+        found = []
+        stack = [(start_dir, os.path.dirname(start_dir))]
+        with self.lock, self.connection:
+            while stack:
+                path, parent = stack.pop()
+                row = self.connection.execute(
+                    "SELECT mtime, inode, has_id_file, status FROM directories WHERE path = ?",
+                    (path,)).fetchone()
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self._forget(path)
+                    continue
+
+                if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_ino:
+                    self.unchanged += 1
+                    has_id_file, status = bool(row[2]), row[3]
+                    children = [r[0] for r in self.connection.execute(
+                        "SELECT path FROM directories WHERE parent = ?", (path,))]
+                else:
+                    self.listed += 1
+                    has_id_file, status, children = self._scan(
+                        path, parent, stat, id_file, done_file)
+
+                if status != DONE or include_done:
+                    found.append((path, has_id_file))
+                else:
+                    self.skipped += 1
+
+                stack.extend((child, path) for child in sorted(children, reverse=True))
+
+        logger.info(f"scanned {start_dir}: {self.listed} directories listed, "
+                    f"{self.unchanged} unchanged, {self.skipped} done albums skipped")
+
+        return found
+
+    def _scan(self, path, parent, stat, id_file, done_file):
+        """ lists the given directory and updates the index, needs to be
+            called with the lock held
+        """
+        children = []
+        files = 0
+        names = set()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        children.append(entry.path)
+                    else:
+                        files += 1
+                        names.add(entry.name)
+        except OSError as e:
+            logger.warn(f"unable to list {path} ({e})")
+
+        has_id_file = id_file in names
+        status = DONE if done_file in names else PENDING
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO directories "
+            "(path, parent, mtime, inode, files, has_id_file, status, scanned) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, parent, stat.st_mtime, stat.st_ino, files, has_id_file,
+             status, time.time()))
+
+        # subdirectories which are gone
+        known = [r[0] for r in self.connection.execute(
+            "SELECT path FROM directories WHERE parent = ?", (path,))]
+        for child in set(known) - set(children):
+            self._forget(child)
+
+        return has_id_file, status, children
+
+    def _forget(self, path):
+        """ removes the directory and everything below from the index, needs
+            to be called with the lock held
+        """
+        self.connection.execute(
+            "DELETE FROM directories WHERE path = ? OR (path > ? AND path < ?)",
+            (path, path + "/", path + "0"))
+
+    def mark_done(self, path):
+        """ records that the album in the given directory was tagged """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        with self.lock, self.connection:
+            updated = self.connection.execute(
+                "UPDATE directories SET status = ?, mtime = ?, inode = ?, scanned = ? WHERE path = ?",
+                (DONE, stat.st_mtime, stat.st_ino, time.time(), path)).rowcount
+            if updated == 0:
+                # not scanned yet, the next scan skips the directory anyway
+                self.connection.execute(
+                    "INSERT INTO directories "
+                    "(path, parent, mtime, inode, files, has_id_file, status, scanned) "
+                    "VALUES (?, ?, 0, 0, 0, 0, ?, ?)",
+                    (path, os.path.dirname(path), DONE, time.time()))
+
+    def status(self, path):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status FROM directories WHERE path = ?",
+                (os.path.abspath(path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import logging
+
+logger = logging
+
+AUDIO_EXTENSIONS = ('.flac', '.mp3', '.ape', '.wav', '.wv', '.ogg')
+
+DISC_DIR = re.compile(r'^(cd|disc)\s*\d+', re.IGNORECASE)
+
+
+class FileEntry(object):
+    """ a file found by the scanner, the stat data is taken from the
+        directory listing (and only stat'ed if the filesystem does not
+        deliver it with the listing). The metadata (tags) and the audio
+        properties read by an earlier stage (the search) are kept with the
+        file, so that later stages do not have to open it again.
+    """
+
+    def __init__(self, entry):
+        self.name = entry.name
+        self.path = entry.path
+        self.extension = os.path.splitext(entry.name)[1].lower()
+        self.metadata = None
+        self.audio_info = None
+        self._entry = entry
+        self._stat = None
+
+    @property
+    def stat(self):
+        if self._stat is None:
+            self._stat = self._entry.stat()
+        return self._stat
+
+    @property
+    def size(self):
+        return self.stat.st_size
+
+    @property
+    def mtime(self):
+        return self.stat.st_mtime
+
+    def __repr__(self):
+        return "<FileEntry %s>" % self.path
+
+
+class DirectoryInventory(object):
+    """ the contents of a single directory, read with one os.scandir call:
+        the subdirectories, the audio files by codec (extension), the cue
+        files and all other files. Subdirectories are scanned on first access
+        only and kept, so that every directory is listed at most once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.files = {}
+        self.dirs = []
+        self.audio = {}
+        self.cue_files = []
+        self.other_files = []
+        self._children = {}
+
+        self.scan()
+
+    def scan(self):
+        self.files = {}
+        self.dirs = []
+        self.audio = {}
+        self.cue_files = []
+        self.other_files = []
+        self._children = {}
+
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.dirs.append(entry.name)
+                    continue
+                file = FileEntry(entry)
+                self.files[file.name] = file
+                if file.extension in AUDIO_EXTENSIONS:
+                    self.audio.setdefault(file.extension, []).append(file.name)
+                elif file.extension == '.cue':
+                    self.cue_files.append(file.name)
+                else:
+                    self.other_files.append(file.name)
+
+        self.dirs.sort()
+        for names in self.audio.values():
+            names.sort()
+        self.cue_files.sort()
+        self.other_files.sort()
+
+    @property
+    def names(self):
+        """ all file and directory names, sorted (like a sorted os.listdir) """
+        return sorted(list(self.files) + self.dirs)
+
+    def has(self, name):
+        return name in self.files
+
+    def child(self, name):
+        """ the inventory of the given subdirectory """
+        if name not in self._children:
+            self._children[name] = DirectoryInventory(
+                os.path.join(self.path, name))
+        return self._children[name]
+
+    def entry(self, path):
+        """ the FileEntry of the given file (somewhere below this directory),
+            None if it is not known
+        """
+        relative = os.path.relpath(path, self.path)
+        if relative.startswith(os.pardir):
+            return None
+
+        names = relative.split(os.sep)
+        inventory = self
+        for name in names[:-1]:
+            if name not in inventory.dirs:
+                return None
+            inventory = inventory.child(name)
+        return inventory.files.get(names[-1])
+
+    def children(self, skip=()):
+        return [self.child(d) for d in self.dirs if d not in skip]
+
+    def disc_dirs(self, skip=()):
+        """ the names of the subdirectories which look like discs (cd1, disc 2) """
+        return [d for d in self.dirs if d not in skip and DISC_DIR.search(d)]
+
+    def audio_files(self, extensions=AUDIO_EXTENSIONS):
+        """ the names of the audio files with the given extensions, sorted """
+        found = []
+        for extension in extensions:
+            found.extend(self.audio.get(extension, []))
+        found.sort()
+        return found
+
+    def has_audio(self, extensions=AUDIO_EXTENSIONS):
+        return any(extension in self.audio for extension in extensions)
+
+    def audio_paths(self, extensions=AUDIO_EXTENSIONS, skip=()):
+        """ the full paths of the audio files with the given extensions in this
+            directory and all subdirectories (except those in skip)
+        """
+        found = [os.path.join(self.path, f) for f in self.audio_files(extensions)]
+        for child in self.children(skip):
+            found.extend(child.audio_paths(extensions, skip))
+        return found
+
+    def walk(self, prune=None):
+        """ yields the inventories of this directory and all subdirectories
+            (top down, like os.walk), prune is called with every inventory and
+            returns the names of the subdirectories not to descend into
+        """
+        stack = [self]
+        while stack:
+            inventory = stack.pop()
+            yield inventory
+            skip = prune(inventory) if prune is not None else ()
+            stack.extend(reversed(inventory.children(skip)))
+
+    def __repr__(self):
+        return "<DirectoryInventory %s>" % self.path
+
+
+def scan(path):
+    """ returns the inventory of the given directory """
+    return DirectoryInventory(path)
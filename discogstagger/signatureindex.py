@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+import itertools
+import logging
+
+logger = logging
+
+VIDEO_POSITIONS = ("Video", "video", "DVD")
+
+
+def duration_seconds(string):
+    """ returns the duration ("h:mm:ss", "mm:ss", also "63:00" for tracks
+        over 60 minutes) in seconds, or None if there is no (valid) duration
+    """
+    if string is None or string == "":
+        return None
+    try:
+        seconds = 0
+        for part in str(string).strip().split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def track_durations(tracklist):
+    """ returns the durations (seconds) of the tracks of a release (as in the
+        api data), the tracks are filtered the same way the search does
+        (no headings, video tracks or tracks without duration)
+    """
+    durations = []
+    for track in tracklist:
+        if track.get("type_") == "heading":
+            continue
+        position = track.get("position", "")
+        if position.startswith(VIDEO_POSITIONS) or position.endswith(VIDEO_POSITIONS):
+            continue
+        seconds = duration_seconds(track.get("duration"))
+        if seconds is None:
+            continue
+        durations.append(seconds)
+    return durations
+
+
+class SignatureIndex(object):
+    """ index of the track durations of releases, used to identify a release
+        by the durations of the audio files alone (similar to a CDDB lookup
+        using the TOC of a CD).
+
+        The durations are quantized (quantum seconds) and split into bands of
+        band_size tracks, each band is stored under a key made from the number
+        of tracks, the position of the band and the quantized durations
+        (locality-sensitive hashing). A lookup probes the neighbouring
+        quantization steps as well, so that small differences between the
+        audio files and discogs still hit the same keys. Releases sharing at
+        least one band with the lookup are returned with their durations,
+        ordered by the number of shared bands.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS signatures (
+            release_id INTEGER PRIMARY KEY,
+            durations TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS bands (
+            key TEXT NOT NULL,
+            release_id INTEGER NOT NULL,
+            PRIMARY KEY (key, release_id)
+        ) WITHOUT ROWID;
+    """
+
+    # releases with less tracks do not have a meaningful signature
+    MIN_TRACKS = 3
+
+    def __init__(self, path, quantum=5, band_size=2):
+        self.path = path
+        self.quantum = quantum
+        self.band_size = band_size
+
+        if path != ":memory:":
+            index_dir = os.path.dirname(path)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the signature index as configured in the [cache] section,
+            returns None if the index is disabled
+        """
+        if not tagger_config.getboolean("cache", "signature_index"):
+            return None
+
+        path = os.path.expanduser(
+            tagger_config.get("cache", "signature_index_file"))
+        quantum = tagger_config.getint("cache", "signature_quantum")
+
+        logger.debug(f"using signature index {path}")
+        return cls(path, quantum)
+
+    def _bands(self, durations):
+        quantized = [int(round(d / self.quantum)) for d in durations]
+        for start in range(0, len(quantized), self.band_size):
+            yield start // self.band_size, quantized[start:start + self.band_size]
+
+    def _key(self, tracks, band, values):
+        return "%d:%d:%s" % (tracks, band, ",".join(str(v) for v in values))
+
+    def keys(self, durations):
+        """ the keys a release with the given durations is stored under """
+        return [self._key(len(durations), band, values)
+                for band, values in self._bands(durations)]
+
+    def probes(self, durations):
+        """ the keys to look up for the given durations, including the
+            neighbouring quantization steps of every duration
+        """
+        probes = []
+        for band, values in self._bands(durations):
+            for offsets in itertools.product((0, -1, 1), repeat=len(values)):
+                probes.append(self._key(
+                    len(durations), band,
+                    [v + o for v, o in zip(values, offsets)]))
+        return probes
+
+    def add(self, release_id, tracklist):
+        """ adds the release with the given tracklist (api data) to the index """
+        self.add_releases([{"id": release_id, "tracklist": tracklist}])
+
+    def add_releases(self, releases):
+        """ adds the given releases (api data), returns the number of releases
+            with a signature
+        """
+        signatures = []
+        bands = []
+        for data in releases:
+            durations = track_durations(data.get("tracklist", []))
+            if len(durations) < self.MIN_TRACKS:
+                continue
+            release_id = int(data["id"])
+            signatures.append(
+                (release_id, ",".join(str(d) for d in durations)))
+            bands.extend((key, release_id) for key in self.keys(durations))
+
+        if signatures:
+            with self.lock, self.connection:
+                # a release could have been changed since it was added
+                stale = []
+                for release_id, signature in signatures:
+                    row = self.connection.execute(
+                        "SELECT durations FROM signatures WHERE release_id = ?",
+                        (release_id,)).fetchone()
+                    if row is not None and row[0] != signature:
+                        old = [int(d) for d in row[0].split(",")]
+                        stale.extend((key, release_id) for key in self.keys(old))
+                self.connection.executemany(
+                    "DELETE FROM bands WHERE key = ? AND release_id = ?", stale)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO signatures (release_id, durations) VALUES (?, ?)",
+                    signatures)
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO bands (key, release_id) VALUES (?, ?)",
+                    bands)
+
+        return len(signatures)
+
+    def lookup(self, durations, limit=100):
+        """ returns the ids and durations of the releases sharing at least one
+            band with the given durations, best matching releases first
+        """
+        if len(durations) < self.MIN_TRACKS:
+            return []
+
+        probes = self.probes(durations)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT release_id, COUNT(*) AS votes FROM bands WHERE key IN (%s) "
+                "GROUP BY release_id ORDER BY votes DESC LIMIT ?"
+                % ",".join("?" * len(probes)), probes + [limit]).fetchall()
+
+            ids = [row[0] for row in rows]
+            signatures = dict(self.connection.execute(
+                "SELECT release_id, durations FROM signatures WHERE release_id IN (%s)"
+                % ",".join("?" * len(ids)), ids).fetchall())
+
+        return [(release_id, [int(d) for d in signatures[release_id].split(",")])
+                for release_id in ids if release_id in signatures]
+
+    def __contains__(self, release_id):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM signatures WHERE release_id = ?",
+                (int(release_id),)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
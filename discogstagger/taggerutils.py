@@ -4,6 +4,12 @@ from ext.mediafile import MediaFile
 from discogstagger.stringformatting import StringFormatting
 from discogstagger.album import Album, Disc, Track
 from discogstagger.discogsalbum import DiscogsAlbum
+from discogstagger.scanner import scan
+from discogstagger.tracksession import track_session, PaddingPolicy
+from discogstagger.coverart import prepare_coverart
+from discogstagger.audioprobe import AudioInfo, ProbeError, can_probe, probe
+from discogstagger.transfer import FileTransfer
+from discogstagger.manifest import Manifest, file_digest
 from mako.lookup import TemplateLookup
 from mako.template import Template
 from unicodedata import normalize
@@ -13,9 +19,12 @@ import re
 import sys
 import logging
 import shutil
+import subprocess
 from shutil import copy2, copystat, Error, ignore_patterns
 import imghdr
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, \
+    as_completed
 # import subprocess
 
 import pprint
@@ -60,9 +69,10 @@ class TagHandler(object):
         self.releasecountry_formatted = self.config.get(
             "details", "releasecountry_formatted")
 
-    def tag_album(self):
+    def tag_album(self, save=True):
         """ tags all tracks in an album, the filenames are determined using
-            the given properties on the tracks
+            the given properties on the tracks. Without save, the tags are
+            only set in the track sessions (see FileHandler.save_tracks)
         """
 
         logger.debug(f'tag_album discs :: {len(self.album.discs)}')
@@ -70,13 +80,15 @@ class TagHandler(object):
             logger.debug(f'tag_album tracks :: {len(disc.tracks)}')
             for track in disc.tracks:
                 path, file = os.path.split(track.full_path)
-                self.tag_single_track(path, track)
+                self.tag_single_track(path, track, save)
 
-    def tag_single_track(self, target_folder, track):
+    def tag_single_track(self, target_folder, track, save=True):
         # load metadata information
         logger.debug("target_folder: %s" % target_folder)
 
-        metadata = MediaFile(os.path.join(target_folder, track.orig_file))
+        session = track_session(
+            track, os.path.join(target_folder, track.orig_file))
+        metadata = session.metadata
 
         # read already existing (and still wanted) properties
         keepTags = {}
@@ -86,8 +98,8 @@ class TagHandler(object):
                 if getattr(metadata, name):
                     keepTags[name] = getattr(metadata, name)
 
-        # remove current metadata
-        metadata.delete()
+        # remove current metadata (in memory, written with the new tags)
+        session.clear()
 
         self.album.codec = metadata.type
 
@@ -170,10 +182,10 @@ class TagHandler(object):
         metadata.tracktotal = len(self.album.disc(track.discnumber).tracks)
 
         if keepTags is not None:
-            for name in keepTags:
-                setattr(metadata, name, keepTags[name])
+            session.update(keepTags)
 
-        metadata.save()
+        if save:
+            session.save()
 
 
 class FileHandler(object):
@@ -191,6 +203,25 @@ class FileHandler(object):
         self.cue_done_dir = self.config.get('cue', 'cue_done_dir')
         self.rg_process = self.config.getboolean('replaygain', 'add_tags')
         self.rg_application = self.config.get('replaygain', 'application')
+        self.download_workers = self.config.getint(
+            'details', 'download_workers')
+        self.padding = PaddingPolicy(
+            self.config.getint('details', 'tag_padding'))
+        # files written in place vs. files rewritten completely
+        self.in_place_writes = 0
+        self.rewrites = 0
+        self.keep_original = self.config.getboolean('details', 'keep_original')
+        self.transfer = FileTransfer(
+            self.config.get('details', 'transfer_mode') or 'auto',
+            self.config.getint('details', 'copy_workers'),
+            self.config.getint('details', 'copy_buffer_size'))
+        self.manifest_file = self.config.get('details', 'manifest_file')
+        self.manifest = None
+        self.skip_unchanged_hash = self.config.getboolean(
+            'details', 'skip_unchanged_hash')
+        if self.transfer.mode in ('move', 'hardlink') and self.keep_original:
+            logger.warn(f"transfer_mode {self.transfer.mode} is not used for "
+                        "the audio files, since keep_original is set")
 
     def mkdir_p(self, path):
         try:
@@ -201,6 +232,106 @@ class FileHandler(object):
             else:
                 raise
 
+    def transfer_mode(self, tagged=False):
+        """ the configured transfer mode (see details:transfer_mode). Tagged
+            files (the tracks) are written after the transfer, a move or
+            hardlink would change the original files, so that these are only
+            used for them if the originals are not kept.
+        """
+        mode = self.transfer.mode
+        if self.keep_original and (mode == 'move' or
+                                   (mode == 'hardlink' and tagged)):
+            mode = 'auto'
+        return mode
+
+    def transfer_file(self, source_file, target_file, tagged=False):
+        """ places source_file at target_file, returns the method used """
+        return self.transfer.transfer(
+            source_file, target_file, self.transfer_mode(tagged))
+
+    def transfer_files(self, jobs, tagged=False, skipped=0):
+        """ places the given files (pairs of source and target) with up to
+            details:copy_workers files at the same time, returns the methods
+            used. The other files (not tagged) keep the mode and times of the
+            source files (as with copy2), failures are only counted for them.
+            The checksums of the tagged files are only computed, when the
+            manifest is saved after tagging.
+        """
+        mode = self.transfer_mode(tagged)
+        methods, stats = self.transfer.transfer_all(
+            [(source_file, target_file, mode) for source_file, target_file in jobs],
+            ignore_errors=not tagged, compute_checksum=not tagged)
+        stats.skipped = skipped
+        self.transfer.stats.skipped += skipped
+        if jobs or skipped:
+            logger.info(f"transferred {stats}")
+
+        for (source_file, target_file), method in zip(jobs, methods):
+            if method is None:
+                continue
+            if not tagged and method != 'move':
+                # as copy2 did: mode, times and flags of the source
+                copystat(source_file, target_file)
+            if self.manifest is not None:
+                self.manifest.record(source_file, target_file,
+                                     self.transfer.checksums.pop(target_file, None))
+        return methods
+
+    def open_manifest(self):
+        """ opens the manifest of the album directory (see
+            details:manifest_file), the checksums of the other files are
+            computed while they are transferred, those of the tracks when
+            the manifest is saved
+        """
+        if self.manifest_file and self.manifest is None:
+            self.manifest = Manifest(
+                os.path.join(self.album.target_dir, self.manifest_file))
+            self.transfer.checksum = self.manifest.algorithm
+        return self.manifest
+
+    def save_manifest(self):
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def other_file_unchanged(self, source_file, target_file):
+        """ whether target_file is already the copy of source_file: as
+            recorded in the manifest, or with the same size and mtime (or,
+            with details:skip_unchanged_hash, the same size and checksum)
+        """
+        if not os.path.exists(target_file):
+            return False
+        if self.manifest is not None:
+            unchanged = self.manifest.unchanged(source_file, target_file)
+            if unchanged is not None:
+                return unchanged
+
+        source_stat = os.stat(source_file)
+        target_stat = os.stat(target_file)
+        if source_stat.st_size != target_stat.st_size:
+            return False
+        # filesystems with a coarse resolution (fat, smb) round the mtime
+        if abs(source_stat.st_mtime - target_stat.st_mtime) < 1:
+            return True
+        if self.skip_unchanged_hash and \
+                file_digest(source_file) == file_digest(target_file):
+            os.utime(target_file, ns=(source_stat.st_atime_ns,
+                                      source_stat.st_mtime_ns))
+            return True
+        return False
+
+    def needs_transfer(self, source_file, target_file):
+        """ whether target_file has to be (re)placed: it does not exist or
+            the manifest shows, that it is not the copy of source_file
+            anymore (truncated or stale, or a changed source)
+        """
+        if not os.path.exists(target_file):
+            return True
+        if self.manifest is not None and \
+                self.manifest.unchanged(source_file, target_file) is False:
+            logger.info(f"{target_file} differs from the manifest, transferring again")
+            return True
+        return False
+
     def create_done_file(self):
         # could be, that the directory does not exist anymore ;-)
         if os.path.exists(self.album.sourcedir):
@@ -220,6 +351,9 @@ class FileHandler(object):
         logger.debug("album sourcedir: %s" % self.album.sourcedir)
         logger.debug("album targetdir: %s" % self.album.target_dir)
 
+        self.open_manifest()
+
+        tracks = []
         for disc in self.album.discs:
             try:
 
@@ -261,15 +395,23 @@ class FileHandler(object):
                 source_file = os.path.join(source_folder, track.orig_file)
                 target_file = os.path.join(target_folder, track.new_file)
 
-                if copy_needed and not os.path.exists(target_file):
+                if copy_needed and self.needs_transfer(source_file, target_file):
                     if not os.path.exists(source_file):
                         logger.error("Source does not exists")
                         # throw error
                     logger.debug("copying files (%s/%s)",
                                  source_folder, track.orig_file)
-
-                    shutil.copyfile(os.path.join(source_folder, track.orig_file),
-                                    os.path.join(target_folder, track.new_file))
+                    tracks.append((track, source_file, target_file))
+
+        methods = self.transfer_files(
+            [(source_file, target_file)
+             for track, source_file, target_file in tracks], tagged=True)
+        for (track, source_file, target_file), method in zip(tracks, methods):
+            if method == 'move':
+                # the track is read from its new place from now on
+                track.full_path = target_file
+                track.orig_file = track.new_file
+                track.session = None
 
     def remove_source_dir(self):
         """
@@ -293,6 +435,17 @@ class FileHandler(object):
         if copy_other_files:
             logger.info("copying files from source directory")
 
+            # the directories are created right away, the files are collected
+            # and transferred together, unchanged files are skipped
+            jobs = []
+            skipped = []
+
+            def add_job(source_file, target_file):
+                if self.other_file_unchanged(source_file, target_file):
+                    skipped.append(target_file)
+                else:
+                    jobs.append((source_file, target_file))
+
             if not os.path.exists(self.album.target_dir):
                 self.mkdir_p(self.album.target_dir)
 
@@ -306,9 +459,10 @@ class FileHandler(object):
                 for fname in copy_files:
                     if os.path.isdir(os.path.join(self.album.sourcedir, fname)):
                         copytree_multi(os.path.join(self.album.sourcedir, fname), os.path.join(
-                            self.album.target_dir, fname))
+                            self.album.target_dir, fname),
+                            copy_function=add_job)
                     else:
-                        shutil.copyfile(os.path.join(self.album.sourcedir, fname), os.path.join(
+                        add_job(os.path.join(self.album.sourcedir, fname), os.path.join(
                             self.album.target_dir, fname))
 
             for disc in self.album.discs:
@@ -345,12 +499,15 @@ class FileHandler(object):
                         if os.path.isdir(os.path.join(source_path, fname)):
                             copytree_multi(os.path.join(
                                 source_path, fname),
-                                os.path.join(target_path, fname))
+                                os.path.join(target_path, fname),
+                                copy_function=add_job)
                         else:
-                            shutil.copyfile(os.path.join(
+                            add_job(os.path.join(
                                 source_path, fname),
                                 os.path.join(target_path, fname))
 
+            self.transfer_files(jobs, skipped=len(skipped))
+
     def get_images(self, conn_mgr):
         """
             Download and store any available images
@@ -377,31 +534,50 @@ class FileHandler(object):
 
             self.create_album_dir()
 
+            downloads = []
             no = 0
             for i, image_url in enumerate(images, 0):
-                logger.debug("Downloading image '%s'" % image_url)
-                try:
-                    picture_name = ""
-                    if i == 0 and use_folder_jpg:
-                        picture_name = "folder.jpg"
-                    else:
-                        no = no + 1
-                        picture_name = image_format + "-%.2d.jpg" % no
-
-                    conn_mgr.fetch_image(os.path.join(
-                        self.album.target_dir, picture_name), image_url)
-
-                    if i == 0 and download_only_cover:
-                        break
-
-                except Exception as e:
-                    logger.error(
-                        "Unable to download image '%s', skipping." % image_url)
-                    print(e)
+                picture_name = ""
+                if i == 0 and use_folder_jpg:
+                    picture_name = "folder.jpg"
+                else:
+                    no = no + 1
+                    picture_name = image_format + "-%.2d.jpg" % no
+
+                downloads.append((os.path.join(
+                    self.album.target_dir, picture_name), image_url))
+
+                if i == 0 and download_only_cover:
+                    break
+
+            # the connector shares its pooled session between the workers
+            with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+                futures = {executor.submit(conn_mgr.fetch_image, picture_file, image_url): image_url
+                           for picture_file, image_url in downloads}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(
+                            "Unable to download image '%s', skipping." % futures[future])
+                        print(e)
+
+    def embed_coverart_album(self, save=True):
+        """
+            Embed cover art into all album files (without save, the cover art
+            is only set in the track sessions, see save_tracks)
+        """
+        imgdata = self.coverart_data()
+        if imgdata is not None:
+            logger.info("Embedding album art...")
+            for disc in self.album.discs:
+                for track in disc.tracks:
+                    self.embed_coverart_track(disc, track, imgdata, save)
 
-    def embed_coverart_album(self):
+    def coverart_data(self):
         """
-            Embed cover art into all album files
+            The cover art to embed (on request), None if there is none. The
+            image is prepared (scaled, recompressed) once for all tracks.
         """
         embed_coverart = self.config.getboolean("details", "embed_coverart")
         image_format = self.config.get("file-formatting", "image")
@@ -423,29 +599,124 @@ class FileHandler(object):
                 imgtype = imghdr.what(image_file)
 
                 if imgtype in ("jpeg", "png"):
-                    logger.info("Embedding album art...")
-                    for disc in self.album.discs:
-                        for track in disc.tracks:
-                            self.embed_coverart_track(disc, track, imgdata)
-
-    def embed_coverart_track(self, disc, track, imgdata):
-        """
-            Embed cover art into a single file
-        """
-
+                    prepared = prepare_coverart(
+                        imgdata,
+                        self.config.getint("details", "embed_coverart_max_size"),
+                        self.config.getint("details", "embed_coverart_quality"))
+                    logger.debug(f"embedding cover art {prepared.digest}")
+                    return prepared.data
+        return None
+
+    def _track_file(self, disc, track):
         if disc.target_dir != None:
             track_dir = os.path.join(self.album.target_dir, disc.target_dir)
         else:
             track_dir = self.album.target_dir
 
-        track_file = os.path.join(track_dir, track.new_file)
-        metadata = MediaFile(track_file)
+        return os.path.join(track_dir, track.new_file)
+
+    def embed_coverart_track(self, disc, track, imgdata, save=True):
+        """
+            Embed cover art into a single file
+        """
+
+        track_file = self._track_file(disc, track)
         try:
-            metadata.art = imgdata
-            metadata.save()
+            session = track_session(track, track_file)
+            session.update({'art': imgdata})
+            if save:
+                self._save_track(session, track_file)
         except Exception as e:
-            logger.error("Unable to embed image '{}'".format(track_file))
-            print(e)
+            logger.error("Unable to embed image '%s': %s", track_file, e)
+
+    def _save_track(self, session, track_file):
+        """ writes the session into the target file, if the file was copied,
+            otherwise into the file the session was opened with
+        """
+        if os.path.exists(track_file) and session.path != track_file:
+            saved = session.save(track_file, self.padding)
+        else:
+            saved = session.save(padding=self.padding)
+        if saved:
+            self._count_write(session.rewritten)
+        return saved
+
+    def _count_write(self, rewritten):
+        if rewritten is True:
+            self.rewrites = self.rewrites + 1
+        elif rewritten is False:
+            self.in_place_writes = self.in_place_writes + 1
+
+    def _log_writes(self, saved):
+        logger.info("saved %d files (%d in place, %d rewritten)" % (
+            saved, self.in_place_writes, self.rewrites))
+
+    def save_tracks(self):
+        """
+            Writes the collected changes (tags, replaygain, cover art) of all
+            tracks, each file is written once
+        """
+        saved = 0
+        for disc in self.album.discs:
+            for track in disc.tracks:
+                if track.session is None:
+                    continue
+                try:
+                    if self._write_track(disc, track):
+                        saved = saved + 1
+                except Exception as e:
+                    logger.error("Unable to save '%s': %s",
+                                 self._track_file(disc, track), e)
+
+        self._log_writes(saved)
+        return saved
+
+    def _write_track(self, disc, track):
+        """ adds the replaygain values (if computed) and saves the track """
+        if track.replaygain:
+            track.session.update(track.replaygain)
+        return self._save_track(track.session, self._track_file(disc, track))
+
+    def write_tracks(self, tag_handler, jobs=1):
+        """
+            Tags all tracks, embeds the cover art and writes the tracks. With
+            more than one job, the tracks are tagged and written in a pool of
+            worker processes, the album is sent once to every worker.
+        """
+        if jobs <= 1:
+            tag_handler.tag_album(save=False)
+            self.embed_coverart_album(save=False)
+            return self.save_tracks()
+
+        tracks = [(disc.discnumber, track.tracknumber)
+                  for disc in self.album.discs for track in disc.tracks]
+        imgdata = self.coverart_data()
+        if imgdata is not None:
+            logger.info("Embedding album art...")
+
+        saved = 0
+        done = 0
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_track_writer,
+                                 initargs=(self.album, self.config, imgdata)) as executor:
+            futures = {executor.submit(_write_track, dn, tn): (dn, tn)
+                       for dn, tn in tracks}
+            for future in as_completed(futures):
+                dn, tn = futures[future]
+                track = self.album.disc(dn).track(tn)
+                done = done + 1
+                try:
+                    track_saved, rewritten = future.result()
+                    if track_saved:
+                        saved = saved + 1
+                        self._count_write(rewritten)
+                    logger.debug("written %d/%d: %s" % (
+                        done, len(tracks), track.new_file))
+                except Exception as e:
+                    logger.error("Unable to tag '{}': {}".format(
+                        self._track_file(self.album.disc(dn), track), e))
+
+        self._log_writes(saved)
+        return saved
 
     def add_replay_gain_tags(self):
         """
@@ -458,53 +729,121 @@ class FileHandler(object):
         if self.rg_process == False:
             return
 
-        codecs = ['.flac', '.ogg', '.mp3', '.ape']
         lg_options = {
             '.flac': '-a -k -s e',
             '.mp3': '-I 4 -S -L -a -k -s e'
         }
-        albumdir = self.album.target_dir
-        # work out if this is a multidisc set.  Note that not all
-        #  subdirectories have music files, e.g. scans, covers, etc.
-        root_dir, subdirs, files = next(os.walk(albumdir))
-        multidisc = 0
-        singledisc = 0
-        matched = set()
-        files.sort()
-
-        for f in files:
-            if list(filter(f.endswith, codecs)) != []:
-                singledisc += 1
-                matched.add(list(filter(f.endswith, codecs))[0])
-        for dir in subdirs:
-            subfiles = next(os.walk(os.path.join(albumdir, dir)))[2]
-            for f in subfiles:
-                if list(filter(f.endswith, codecs)) != []:
-                    multidisc += 1
-                    matched.add(list(filter(f.endswith, codecs))[0])
-
-        for match in list(matched):
-            pattern = os.path.join(
-                albumdir, '**', '*' + match) if multidisc > 0 else os.path.join(albumdir, '*' + match)
+        matched = {}
+        for match, tracks in self._replay_gain_tracks().items():
+            matched[match] = [self._track_file(disc, track)
+                              for disc, track in tracks]
+
+        for match, files in matched.items():
+            file_list = ' '.join(self._escape_string(f) for f in files)
             return_code = None
 
-            logger.debug('Adding replaygain to files: {}'.format(pattern))
+            logger.debug('Adding replaygain to files: {}'.format(file_list))
 
             if self.rg_application == 'metaflac':
-                cmd = 'metaflac --add-replay-gain {}'.format(
-                    self._escape_string(pattern))
+                cmd = 'metaflac --add-replay-gain {}'.format(file_list)
                 return_code = os.system(cmd)
             elif self.rg_application == 'loudgain':
                 options = lg_options[match] if match in lg_options.keys(
                 ) else ''
-                cmd = 'loudgain {} {}'.format(
-                    options, self._escape_string(pattern))
+                cmd = 'loudgain {} {}'.format(options, file_list)
                 return_code = os.system(cmd)
             else:
                 return_code = -1
 
             logging.debug("Replaygain return code %s" % str(return_code))
 
+    def _replay_gain_tracks(self):
+        """ the tracks of the album (with their disc) by codec, the files are
+            known from the album tracks, there is no need to list the target
+            directories again (all discs form one album)
+        """
+        codecs = ['.flac', '.ogg', '.mp3', '.ape']
+        matched = {}
+        for disc in self.album.discs:
+            for track in disc.tracks:
+                match = os.path.splitext(track.new_file)[1].lower()
+                if match in codecs:
+                    matched.setdefault(match, []).append((disc, track))
+        return matched
+
+    def compute_replay_gain(self):
+        """
+            Computes the replaygain values using loudgain (scan only, the
+            files are not touched) and keeps them with the tracks, so that
+            they are written together with the tags (see save_tracks).
+
+            Returns False, if the values could not be computed this way
+            (metaflac always writes the files itself), add_replay_gain_tags
+            has to be called after the tracks are saved then.
+        """
+        if self.rg_process == False:
+            return True
+
+        if self.rg_application != 'loudgain':
+            return False
+
+        for match, tracks in self._replay_gain_tracks().items():
+            by_path = {}
+            for disc, track in tracks:
+                by_path[track.full_path] = track
+
+            cmd = ['loudgain', '-a', '-k', '-s', 's', '-O'] + list(by_path)
+            logger.debug('Computing replaygain: {}'.format(' '.join(cmd)))
+            try:
+                output = subprocess.run(
+                    cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    universal_newlines=True, check=True).stdout
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.error("Unable to compute replaygain: {}".format(e))
+                continue
+
+            values, album = self._loudgain_values(output)
+            for path, track in by_path.items():
+                replaygain = {}
+                if path in values:
+                    gain, peak = values[path]
+                    replaygain.update({'rg_track_gain': gain,
+                                       'rg_track_peak': peak})
+                if album is not None:
+                    gain, peak = album
+                    replaygain.update({'rg_album_gain': gain,
+                                       'rg_album_peak': peak})
+                track.replaygain = replaygain
+
+        return True
+
+    def _loudgain_values(self, output):
+        """ parses the (tab delimited, -O) output of loudgain, returns the
+            gain and peak by file and those of the album (if given)
+        """
+        values = {}
+        album = None
+        columns = None
+        for line in output.splitlines():
+            fields = line.split('\t')
+            if columns is None:
+                if fields[0] == 'File':
+                    columns = fields
+                continue
+            if len(fields) != len(columns):
+                continue
+            row = dict(zip(columns, fields))
+            try:
+                gain = float(row['Gain'].split()[0])
+                peak = float(row['New_Peak'].split()[0])
+            except (KeyError, ValueError):
+                continue
+            if row['File'] == 'Album':
+                album = (gain, peak)
+            else:
+                values[row['File']] = (gain, peak)
+        return values, album
+
     def _escape_string(self, string):
         return '%s' % (
             string
@@ -525,6 +864,38 @@ class FileHandler(object):
         )
 
 
+# the state of a worker process of FileHandler.write_tracks
+_track_writer = {}
+
+
+def _init_track_writer(album, tagger_config, imgdata):
+    _track_writer['tag_handler'] = TagHandler(album, tagger_config)
+    _track_writer['file_handler'] = FileHandler(album, tagger_config)
+    _track_writer['imgdata'] = imgdata
+
+
+def _write_track(discnumber, tracknumber):
+    """ tags, embeds the cover art and writes a single track, runs in a
+        worker process, returns whether the track was saved and rewritten
+    """
+    tag_handler = _track_writer['tag_handler']
+    file_handler = _track_writer['file_handler']
+    imgdata = _track_writer['imgdata']
+
+    disc = tag_handler.album.disc(discnumber)
+    track = disc.track(tracknumber)
+    path, file = os.path.split(track.full_path)
+    tag_handler.tag_single_track(path, track, save=False)
+    if imgdata is not None:
+        track.session.update({'art': imgdata})
+    try:
+        saved = file_handler._write_track(disc, track)
+        return saved, track.session.rewritten
+    finally:
+        # the session is not needed anymore
+        track.session = None
+
+
 class TaggerUtils(object):
     """ Accepts a destination directory name and discogs release id.
         TaggerUtils returns a the corresponding metadata information, in which
@@ -727,11 +1098,12 @@ class TaggerUtils(object):
             dn = disc.discnumber
             for track in disc.tracks:
                 tn = track.tracknumber
-                metadata = MediaFile(track.full_path)
+                metadata = self._audio_info(track)
                 # for field in metadata.readable_fields():
                 #     print('fieldname: {}: '.format(field)) #, getattr(metadata, field)
 
                 self.album.disc(dn).track(tn).codec = metadata.type
+                self.album.codec = metadata.type
                 codec = metadata.type
                 lossless = ('flac', 'alac', 'wma', 'ape', 'wav')
                 encod = 'lossless' if codec.lower() in lossless else 'lossy'
@@ -754,14 +1126,58 @@ class TaggerUtils(object):
                     timedelta(seconds=round(length_seconds_fp, 4)))
                 self.album.disc(dn).track(tn).length_ex = length_ex_str[:-2]
 
-    def _directory_has_audio_files(self, dir):
+    def _audio_info(self, track):
+        """ the technical properties of the track, as read by the search (see
+            the album inventory), otherwise read from the stream headers only
+            if the format allows it, or from the session of the tagging (the
+            file is not opened again then)
+        """
+        entry = self._inventory_entry(track.full_path)
+        if entry is not None and entry.audio_info is not None:
+            return entry.audio_info
+
+        if can_probe(track.full_path):
+            try:
+                return probe(track.full_path)
+            except ProbeError as e:
+                logger.warn(f"unable to probe {track.full_path}: {e}")
+
+        metadata = track_session(track, track.full_path).metadata
+        return AudioInfo(metadata.type, metadata.samplerate, metadata.bitdepth,
+                         metadata.channels, metadata.bitrate, metadata.length)
+
+    def _inventory_entry(self, path):
+        if self.album.inventory is None:
+            return None
+        return self.album.inventory.entry(path)
+
+    def _order_by_tracknumber(self, target_list, inventory):
+        """ orders the files of a disc by the track numbers read from their
+            tags during the search (see the album inventory), if these number
+            the files 1..n. Otherwise (or without search) the files are
+            mapped to the tracks in their sorted order.
+        """
+        numbers = []
+        for filename in target_list:
+            entry = inventory.files.get(os.path.basename(filename))
+            if entry is None or entry.metadata is None:
+                return target_list
+            try:
+                numbers.append(int(entry.metadata['track']))
+            except (TypeError, ValueError):
+                return target_list
+
+        if sorted(numbers) != list(range(1, len(target_list) + 1)):
+            return target_list
+
+        ordered = [filename for _, filename in sorted(zip(numbers, target_list))]
+        if ordered != target_list:
+            logger.info("files ordered by their track numbers")
+        return ordered
+
+    def _directory_has_audio_files(self, inventory):
         codecs = ('.flac', '.ogg', '.mp3')
-        files = next(os.walk(dir))[2]
-        found = 0
-        for f in files:
-            if list(filter(f.endswith, codecs)) != []:
-                found += 1
-        return False if found == 0 else True
+        return inventory.has_audio(codecs)
 
     def _directory_prune_unwanted(self, dir_list):
         """ Remove directories without audio files / in ignore list
@@ -770,16 +1186,15 @@ class TaggerUtils(object):
         dir_list[:] = [d for d in dir_list if d not in extf]
         # return dir_list
 
-    def _audio_files_in_subdirs(self, dir_list):
+    def _audio_files_in_subdirs(self, dir_list, inventory):
         """ Are files in subdirectories rather than root dirs?
         """
         codecs = ('.flac', '.ogg', '.mp3')
-        sourcedir = self.album.sourcedir
         for x in dir_list:
             if x.endswith(codecs):
                 return False
-            elif os.path.isdir(os.path.join(sourcedir, x)) and \
-                    self._directory_has_audio_files(os.path.join(sourcedir, x)):
+            elif x in inventory.dirs and \
+                    self._directory_has_audio_files(inventory.child(x)):
                 return True
         return False
 
@@ -788,6 +1203,8 @@ class TaggerUtils(object):
             fetches a list of files with the defined file_type
             in the self.sourcedir location as target_list, other
             files in the sourcedir are returned in the copy_files list.
+            The directories are taken from the album inventory (see
+            scanner), if the album does not have one yet, it is scanned.
         """
         copy_files = []
         target_list = []
@@ -799,20 +1216,23 @@ class TaggerUtils(object):
         logger.debug("sourcedir: %s" % sourcedir)
 
         try:
-            dir_list = os.listdir(sourcedir)
-            dir_list.sort()
+            if self.album.inventory is None:
+                self.album.inventory = scan(sourcedir)
+            inventory = self.album.inventory
+
+            dir_list = inventory.names
             self._directory_prune_unwanted(dir_list)
             filetype = ""
             self.album.copy_files = []
 
             logger.debug(f"flagged mult-disc: {self.album.has_multi_disc}")
-            if self.album.has_multi_disc or self._audio_files_in_subdirs(dir_list) is True:
+            if self.album.has_multi_disc or self._audio_files_in_subdirs(dir_list, inventory) is True:
                 logger.debug(">>> is multi disc album, looping discs")
                 dirno = 0
                 for y in dir_list:
                     logger.debug("is it a dir? %s" % y)
-                    if os.path.isdir(os.path.join(sourcedir, y)):
-                        if self._directory_has_audio_files(os.path.join(sourcedir, y)):
+                    if y in inventory.dirs:
+                        if self._directory_has_audio_files(inventory.child(y)):
                             logger.debug(
                                 "Setting disc(%s) sourcedir to: %s" % (dirno, y))
                             self.album.discs[dirno].sourcedir = y
@@ -833,22 +1253,25 @@ class TaggerUtils(object):
                 if hasattr(disc, 'sourcedir') and disc.sourcedir is not None:
                     disc_source_dir = os.path.join(
                         self.album.sourcedir, disc.sourcedir)
+                    disc_inventory = inventory.child(disc.sourcedir)
                 else:
                     disc_source_dir = self.album.sourcedir
+                    disc_inventory = inventory
 
                 logger.debug("discn inst ..: %d" % dn)
                 logger.debug("discno ......: %d" % disc.discnumber)
                 logger.debug("sourcedir ...: %s" % disc_source_dir)
 
                 # strip unwanted files
-                disc_list = os.listdir(disc_source_dir)
-                disc_list.sort()
+                disc_list = disc_inventory.names
 
                 disc.copy_files = [x for x in disc_list
                                    if not x.lower().endswith(TaggerUtils.FILE_TYPE)]
 
                 target_list = [os.path.join(disc_source_dir, x) for x in disc_list
                                if x.lower().endswith(TaggerUtils.FILE_TYPE)]
+                target_list = self._order_by_tracknumber(
+                    target_list, disc_inventory)
 
                 # bug here for multi-disc
                 # targetlist holds all tracks combined across discs, but
@@ -1000,7 +1423,7 @@ def write_file(filecontents, filename):
     return True
 
 
-def copytree_multi(src, dst, symlinks=False, ignore=None):
+def copytree_multi(src, dst, symlinks=False, ignore=None, copy_function=copy2):
     names = os.listdir(src)
     if ignore is not None:
         ignored_names = ignore(src, names)
@@ -1024,9 +1447,10 @@ def copytree_multi(src, dst, symlinks=False, ignore=None):
                 linkto = os.readlink(srcname)
                 os.symlink(linkto, dstname)
             elif os.path.isdir(srcname):
-                copytree_multi(srcname, dstname, symlinks, ignore)
+                copytree_multi(srcname, dstname, symlinks, ignore,
+                               copy_function)
             else:
-                copy2(srcname, dstname)
+                copy_function(srcname, dstname)
         except (IOError, os.error) as why:
             errors.append((srcname, dstname, str(why)))
         except Error as err:
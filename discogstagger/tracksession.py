@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+
+from ext.mediafile import MediaFile
+
+logger = logging
+
+
+def _digest(value):
+    """ a comparable form of a tag value, binary data (e.g. embedded images)
+        is compared by its hash
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return ("sha1", hashlib.sha1(value).hexdigest())
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_digest(v) for v in value)
+    if hasattr(value, "__dict__"):
+        # flac pictures read from the file know their block code as well
+        return (type(value).__name__,) + tuple(
+            sorted((k, _digest(v)) for k, v in vars(value).items()
+                   if k != "code"))
+    return repr(value)
+
+
+def tag_snapshot(mgfile):
+    """ the tags (and the pictures of flac files) of the given mutagen file
+        in a comparable form, independent of the order of the tags
+    """
+    tags = mgfile.tags
+    items = []
+    if tags is not None:
+        # vorbis comments are a list of pairs, others (id3, mp4) are dicts
+        pairs = list(tags) if isinstance(tags, list) else list(tags.items())
+        items = sorted(((str(k), _digest(v)) for k, v in pairs), key=repr)
+    pictures = _digest(list(getattr(mgfile, "pictures", None) or []))
+    return tuple(items), pictures
+
+
+class PaddingPolicy(object):
+    """ decides the padding left after the tags, when a file is saved (see
+        the padding argument of mutagen): as long as the new tags fit into
+        the existing padding, it is used as it is and the tags are written in
+        place. Otherwise the whole file has to be rewritten anyway, and
+        padding bytes are reserved for later changes, plus the size of the
+        embedded cover art (so that it can be replaced without a rewrite).
+    """
+
+    def __init__(self, padding=65536):
+        self.padding = padding
+
+    def __call__(self, info, reserve=0):
+        if info.padding >= 0:
+            return info.padding
+        return self.padding + reserve
+
+
+class TrackSession(object):
+    """ the metadata of a single track, read once and kept for all stages of
+        the tagging (tags, audio properties, replaygain values, cover art).
+        All changes are collected in memory and written with a single save,
+        which matters for flac files, where every save could mean rewriting
+        the whole file. The file is only written, if the tags differ from
+        those already in the file (re-runs over a tagged library only read).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.metadata = MediaFile(path)
+        self.original = tag_snapshot(self.metadata.mgfile)
+        self.changed = False
+        self.art_size = 0
+        # whether the last save had to rewrite the whole file (None if the
+        # format does not tell)
+        self.rewritten = None
+
+    @property
+    def type(self):
+        return self.metadata.type
+
+    def clear(self):
+        """ removes all current tags, the file is not touched (the removal is
+            written with the next save)
+        """
+        tags = self.metadata.mgfile.tags
+        if tags is not None:
+            tags.clear()
+        self.changed = True
+
+    def update(self, values):
+        """ sets the given tags (a dict name -> value) """
+        for name, value in values.items():
+            setattr(self.metadata, name, value)
+        if values.get("art") is not None:
+            self.art_size = len(values["art"])
+        self.changed = True
+
+    def save(self, path=None, padding=None):
+        """ writes the collected changes into the file (or into path, which
+            has to be a copy of the file the session was opened with), returns
+            False if there was nothing to write. padding is a PaddingPolicy
+            (mutagens default is used without)
+        """
+        self.rewritten = None
+        if not self.changed:
+            return False
+        self.changed = False
+
+        if path is None or path == self.path:
+            original = self.original
+        else:
+            # the copy could have been tagged already (e.g. by an earlier run)
+            original = tag_snapshot(MediaFile(path).mgfile)
+
+        current = tag_snapshot(self.metadata.mgfile)
+        if current == original:
+            logger.debug(f"tags of {path or self.path} unchanged, not saving")
+            return False
+
+        def choose_padding(info):
+            if padding is not None:
+                new_padding = padding(info, self.art_size)
+            else:
+                new_padding = info.get_default_padding()
+            self.rewritten = new_padding != info.padding
+            return new_padding
+
+        logger.debug(f"saving {path or self.path}")
+        self.metadata.save(path, padding=choose_padding)
+        if path is None or path == self.path:
+            self.original = current
+        return True
+
+
+def track_session(track, path):
+    """ returns the session of the track, the file at path is opened on first
+        use, later calls reuse the session
+    """
+    if track.session is None:
+        track.session = TrackSession(path)
+    return track.session
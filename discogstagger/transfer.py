@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import os
+import errno
+import fcntl
+import shutil
+import tempfile
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from discogstagger.manifest import new_digest, file_digest
+
+logger = logging
+
+# ioctl to clone a file on copy-on-write filesystems (btrfs, xfs), see
+# ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# the methods tried for every mode, in this order, the first one supported by
+# the source/target pair is used
+FALLBACKS = {
+    "auto": ("reflink", "copy_file_range", "copy"),
+    "move": ("move", "reflink", "copy_file_range", "copy"),
+    "hardlink": ("hardlink", "reflink", "copy_file_range", "copy"),
+    "reflink": ("reflink", "copy_file_range", "copy"),
+    "copy_file_range": ("copy_file_range", "copy"),
+    "copy": ("copy",),
+}
+
+# errors meaning "not supported here" (other filesystem, filesystem without
+# the feature, ...), any other error is raised
+UNSUPPORTED = set([errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS,
+                   errno.EINVAL, errno.EPERM, errno.EMLINK, errno.ENOTTY])
+
+
+def reflink(source, target):
+    """ creates target as a copy-on-write clone of source, raises an OSError
+        if the filesystem does not support this
+    """
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def copy_file_range(source, target):
+    """ copies source to target within the kernel (see copy_file_range(2)),
+        which lets network and copy-on-write filesystems copy on the server
+        or share the extents. Raises an OSError if this is not supported.
+    """
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                # some filesystems (and kernels) return 0 instead of an
+                # error, the copy would be truncated
+                raise OSError(errno.ENOTSUP,
+                              "copy_file_range copied nothing", source)
+            remaining -= copied
+
+
+def copy_file(source, target, buffer_size=0, digest=None):
+    """ a plain copy, read and written in chunks of buffer_size bytes (the
+        default of shutil, which uses sendfile where available, with 0). The
+        data copied is added to digest (a hashlib like object) on the way.
+    """
+    if digest is None and not buffer_size:
+        shutil.copyfile(source, target)
+        return
+
+    buffer_size = buffer_size or 1048576
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        for chunk in iter(lambda: src.read(buffer_size), b""):
+            if digest is not None:
+                digest.update(chunk)
+            dst.write(chunk)
+
+
+def _place(method, source, target, buffer_size=0, digest=None):
+    if method == "move":
+        # a rename replaces the target atomically, no temporary file needed
+        os.rename(source, target)
+        return
+
+    target_dir = os.path.dirname(target) or "."
+    fd, temp_file = tempfile.mkstemp(prefix=".", suffix=".part", dir=target_dir)
+    os.close(fd)
+
+    try:
+        if method == "hardlink":
+            os.remove(temp_file)
+            os.link(source, temp_file)
+        elif method == "reflink":
+            reflink(source, temp_file)
+        elif method == "copy_file_range":
+            copy_file_range(source, temp_file)
+        else:
+            copy_file(source, temp_file, buffer_size, digest)
+        if method != "hardlink":
+            # the temporary file is created with mode 0600
+            shutil.copymode(source, temp_file)
+        os.replace(temp_file, target)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+class TransferStats(object):
+    """ the number of files and bytes transferred, the time it took and the
+        methods used, as well as the files skipped (unchanged) and failed
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.methods = {}
+        self.skipped = 0
+        self.failed = 0
+
+    def add(self, method, size):
+        self.files += 1
+        self.bytes += size
+        self.methods[method] = self.methods.get(method, 0) + 1
+
+    @property
+    def rate(self):
+        """ MB/s """
+        if not self.elapsed:
+            return 0.0
+        return self.bytes / self.elapsed / 1000000.0
+
+    def __str__(self):
+        methods = ", ".join(f"{method} {count}" for method, count in
+                            sorted(self.methods.items()))
+        text = "%d files, %.1f MB in %.1fs (%.1f MB/s; %s)" % (
+            self.files, self.bytes / 1000000.0, self.elapsed, self.rate,
+            methods or "-")
+        if self.skipped or self.failed:
+            text += ", %d skipped, %d failed" % (self.skipped, self.failed)
+        return text
+
+
+class FileTransfer(object):
+    """ places files at their target without copying the data, wherever the
+        source and target allow this: a move (rename) or hardlink, if
+        configured, a reflink on copy-on-write filesystems, copy_file_range
+        (server side copies on network filesystems) and a plain copy as the
+        last resort. The methods not supported by a pair of filesystems are
+        remembered, so that they are not tried for every file again. An
+        existing target is replaced. With checksum (see manifest.ALGORITHM),
+        the checksum of every file is computed while it is copied (files not
+        copied are read once) and kept in checksums (by target). Files
+        rewritten after the transfer (the tracks, when tagged) are better
+        transferred without (compute_checksum), their checksum would be
+        outdated anyway.
+    """
+
+    def __init__(self, mode="auto", workers=1, buffer_size=0, checksum=None):
+        if mode not in FALLBACKS:
+            raise ValueError(f"unknown transfer mode: {mode}")
+        self.mode = mode
+        self.workers = max(workers, 1)
+        self.buffer_size = buffer_size
+        self.unsupported = {}
+        self.checksum = checksum
+        self.checksums = {}
+        self.lock = threading.Lock()
+        # all files transferred so far
+        self.stats = TransferStats()
+
+    def transfer(self, source, target, mode=None, compute_checksum=True):
+        """ transfers source to target, returns the method used """
+        mode = mode or self.mode
+        if mode not in FALLBACKS:
+            raise ValueError(f"unknown transfer mode: {mode}")
+
+        stat = os.stat(source)
+        devices = (stat.st_dev, os.stat(os.path.dirname(target) or ".").st_dev)
+        with self.lock:
+            unsupported = self.unsupported.setdefault(devices, set())
+            methods = [m for m in FALLBACKS[mode] if m not in unsupported]
+
+        checksum = self.checksum if compute_checksum else None
+        for method in methods:
+            digest = new_digest(checksum) if checksum else None
+            try:
+                _place(method, source, target, self.buffer_size, digest)
+                break
+            except OSError as e:
+                if method == "copy" or e.errno not in UNSUPPORTED:
+                    raise
+                logger.debug(f"{method} not supported for {target} ({e})")
+                with self.lock:
+                    unsupported.add(method)
+
+        logger.debug(f"{method}: {source} -> {target}")
+        if checksum:
+            if method == "copy":
+                checksum = digest.hexdigest()
+            else:
+                # the data did not pass through, it is read once
+                checksum = file_digest(target, checksum)
+            with self.lock:
+                self.checksums[target] = checksum
+        with self.lock:
+            self.stats.add(method, stat.st_size)
+        return method
+
+    def transfer_all(self, jobs, ignore_errors=False, batch_size=16,
+                     compute_checksum=True):
+        """ transfers the given files (a list of source, target and mode, None
+            for the default mode) with up to workers files at the same time,
+            returns the methods used (in the order of the jobs) and the stats
+            of this batch. The workers take batch_size files at once, which
+            keeps the overhead low for many small files (scans, logs). With
+            ignore_errors, failed files are logged and counted (their method
+            is None) instead of stopping the transfer. Without
+            compute_checksum, no checksums are computed for these files.
+        """
+        batch = TransferStats()
+        start = time.monotonic()
+
+        def transfer_job(job):
+            source, target, mode = job
+            try:
+                method = self.transfer(source, target, mode, compute_checksum)
+            except OSError as e:
+                if not ignore_errors:
+                    raise
+                logger.error(f"unable to transfer {source}: {e}")
+                with self.lock:
+                    batch.failed += 1
+                    self.stats.failed += 1
+                return None
+            size = os.path.getsize(target)
+            with self.lock:
+                batch.add(method, size)
+            return method
+
+        def transfer_batch(jobs):
+            return [transfer_job(job) for job in jobs]
+
+        if self.workers > 1 and len(jobs) > 1:
+            # at least one batch per worker
+            size = max(min(batch_size, len(jobs) // self.workers), 1)
+            batches = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                methods = [method for result in
+                           executor.map(transfer_batch, batches)
+                           for method in result]
+        else:
+            methods = transfer_batch(jobs)
+
+        batch.elapsed = time.monotonic() - start
+        with self.lock:
+            self.stats.elapsed += batch.elapsed
+        return methods, batch
@@ -2,9 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import pprint
-from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
-import time
 import sys
 import logging.config
 import logging
@@ -17,6 +15,8 @@ from discogstagger.taggerutils import TaggerUtils, TagHandler, \
     FileHandler, TaggerError
 from discogstagger.discogsalbum import DiscogsAlbum, DiscogsConnector, \
     LocalDiscogsConnector, AlbumError, DiscogsSearch
+from discogstagger.prefetch import ReleasePrefetcher
+from discogstagger.albumwatcher import AlbumWatcher
 
 
 pp = pprint.PrettyPrinter(indent=4)
@@ -40,11 +40,14 @@ p.add_option("-g", "--replay-gain", action="store_true", dest="replaygain",
              help="Should replaygain tags be added to the album? (metaflac needs to be installed)")
 p.add_option("-w", "--watch", action="store_true", dest="watch",
              help="Watches for changes in the source directory (daemon mode)")
+p.add_option("-j", "--jobs", action="store", type="int", dest="jobs",
+             help="Number of processes tagging and writing the tracks of an album")
 
 p.set_defaults(conffile="conf/discogs_tagger_sh.conf")
 p.set_defaults(recursive=False)
 p.set_defaults(forceUpdate=False)
 p.set_defaults(replaygain=False)
+p.set_defaults(jobs=1)
 
 if len(sys.argv) == 1:
     p.print_help()
@@ -77,183 +80,234 @@ options.searchDiscogs = tagger_config.get('batch', 'searchDiscogs')
 file_utils = FileUtils(tagger_config, options)
 
 
-def getSourceDirs():
+def getSourceDirs(start_dir=None):
+    if start_dir is None:
+        start_dir = options.sourcedir
     source_dirs = None
     if options.recursive:
         logger.debug("determine sourcedirs")
-        source_dirs = file_utils.walk_dir_tree(options.sourcedir, id_file)
+        source_dirs = file_utils.walk_dir_tree(start_dir, id_file)
         if 0 == len(source_dirs):
-            source_dirs = file_utils.walk_dir_base_tree(options.sourcedir)
+            source_dirs = file_utils.walk_dir_base_tree(start_dir)
     elif options.searchDiscogs:
         logger.debug("looking for audio files")
-        source_dirs = file_utils.get_audio_dirs(options.sourcedir)
+        source_dirs = file_utils.get_audio_dirs(start_dir)
     else:
-        logger.debug(f"using sourcedir: {options.sourcedir}")
-        source_dirs = [options.sourcedir]
+        logger.debug(f"using sourcedir: {start_dir}")
+        source_dirs = [start_dir]
     logger.info(
         f'Found {len(source_dirs)} audio source directories to process')
     return source_dirs
 
 
-def processSourceDirs(source_dirs, tagger_config):
+def connect(tagger_config):
+    """ the connectors and the search, shared by all albums of a run (or of
+        the daemon, thus its sessions, caches and rate limit)
+    """
     # initialize connection (could be a problem if using multiple sources...)
     discogs_connector = DiscogsConnector(tagger_config)
     local_discogs_connector = LocalDiscogsConnector(discogs_connector)
     # try to re-use search, may be useful if working with several releases by the same artist
     discogsSearch = DiscogsSearch(tagger_config)
+    return discogs_connector, local_discogs_connector, discogsSearch
 
-    logger.info("start tagging")
-    discs_with_errors = []
-
-    converted_discs = 0
-
-    for source_dir in source_dirs:
-        releaseid = None
-        release = None
-        connector = None
 
-        try:
-            done_file = tagger_config.get("details", "done_file")
-            done_file_path = os.path.join(source_dir, done_file)
+def processSourceDirs(source_dirs, tagger_config, connectors=None):
+    if connectors is None:
+        connectors = connect(tagger_config)
+    discogs_connector, local_discogs_connector, discogsSearch = connectors
 
-            if os.path.exists(done_file_path) and not options.forceUpdate:
-                logger.warn(
-                    f'Not reading {source_dir}, as {done_file} exists and forceUpdate is false')
-                continue
+    # fetch the releases of all albums with an id file ahead of tagging
+    prefetcher = None
+    prefetch_workers = tagger_config.getint("batch", "prefetch_workers")
+    if options.releaseid is None and prefetch_workers > 0 and \
+            tagger_config.get("source", "name") not in ("local", "dump"):
+        prefetcher = ReleasePrefetcher(
+            discogs_connector, prefetch_workers,
+            tagger_config.getint("batch", "prefetch_depth"))
+        prefetcher.start(file_utils.read_release_ids(source_dirs, id_file))
 
-            # reread config to make sure, that the album
-            # specific options are reset for each album
-            tagger_config = TaggerConfig(options.conffile)
-
-            if options.releaseid is not None:
-                releaseid = options.releaseid
-            else:
-                releaseid = file_utils.read_id_file(
-                    source_dir, id_file, options)
-
-            if not releaseid:
-                searchParams = discogsSearch.getSearchParams(source_dir)
-                # release = discogsSearch.search_discogs(searchParams)
-                release = discogsSearch.search_discogs()
-                # reuse the Discogs Release class, it saves re-fetching later
-                if release is not None and type(release).__name__ in ('Release', 'Version'):
-                    releaseid = release.id
-                    connector = discogs_connector
-
-            if not releaseid:
-                logger.warn(f'No releaseid for {source_dir}')
-                continue
+    logger.info("start tagging")
+    discs_with_errors = []
 
-            logger.info(
-                f'Found release ID: {releaseid} for source dir: {source_dir}')
-
-            # read destination directory
-            # !TODO if both are the same, we are not copying anything,
-            # this should be "configurable"
-            if not options.destdir:
-                destdir = source_dir
-            else:
-                destdir = options.destdir
-                logger.debug(f'destdir set to {options.destdir}')
-
-            logger.info(f'Using destination directory: {destdir}')
-            logger.debug("starting tagging...")
-
-            if releaseid is not None and release is None:
-                #! TODO this is dirty, refactor it to be able to reuse it for later enhancements
-                if tagger_config.get("source", "name") == "local":
-                    release = local_discogs_connector.fetch_release(
-                        releaseid, source_dir)
-                    connector = local_discogs_connector
-                else:
-                    release = discogs_connector.fetch_release(releaseid)
-                    connector = discogs_connector
+    converted_discs = 0
 
-            discogs_album = DiscogsAlbum(release)
+    try:
+        for source_dir in source_dirs:
+            releaseid = None
+            release = None
+            connector = None
 
             try:
-                album = discogs_album.map()
-            except AlbumError as ae:
-                msg = f"Error during mapping ({releaseid}), {source_dir}: {ae}"
-                logger.error(msg)
-                discs_with_errors.append(msg)
-                continue
+                done_file = tagger_config.get("details", "done_file")
+                done_file_path = os.path.join(source_dir, done_file)
 
-            logger.info(f'Tagging album "{album.artist} - {album.title}"')
+                if os.path.exists(done_file_path) and not options.forceUpdate:
+                    logger.warn(
+                        f'Not reading {source_dir}, as {done_file} exists and forceUpdate is false')
+                    continue
 
-            tagHandler = TagHandler(album, tagger_config)
+                # reread config to make sure, that the album
+                # specific options are reset for each album
+                tagger_config = TaggerConfig(options.conffile)
 
-            taggerUtils = TaggerUtils(
-                source_dir, destdir, tagger_config, album)
-
-            fileHandler = FileHandler(album, tagger_config)
-
-            try:
-                taggerUtils._get_target_list()
-            except TaggerError as te:
-                msg = f"Error during Tagging ({releaseid}), {source_dir}: {te}"
+                if options.releaseid is not None:
+                    releaseid = options.releaseid
+                else:
+                    releaseid = file_utils.read_id_file(
+                        source_dir, id_file, options)
+
+                # the album directory is listed once, all stages use the inventory
+                inventory = file_utils.album_inventory(source_dir)
+
+                if not releaseid:
+                    searchParams = discogsSearch.getSearchParams(
+                        source_dir, inventory)
+                    # release = discogsSearch.search_discogs(searchParams)
+                    release = discogsSearch.search_discogs()
+                    # reuse the Discogs Release class, it saves re-fetching later
+                    if release is not None and type(release).__name__ in ('Release', 'Version'):
+                        releaseid = release.id
+                        connector = discogs_connector
+
+                if not releaseid:
+                    logger.warn(f'No releaseid for {source_dir}')
+                    continue
+
+                logger.info(
+                    f'Found release ID: {releaseid} for source dir: {source_dir}')
+
+                # read destination directory
+                # !TODO if both are the same, we are not copying anything,
+                # this should be "configurable"
+                if not options.destdir:
+                    destdir = source_dir
+                else:
+                    destdir = options.destdir
+                    logger.debug(f'destdir set to {options.destdir}')
+
+                logger.info(f'Using destination directory: {destdir}')
+                logger.debug("starting tagging...")
+
+                if releaseid is not None and release is None:
+                    #! TODO this is dirty, refactor it to be able to reuse it for later enhancements
+                    if tagger_config.get("source", "name") == "local":
+                        release = local_discogs_connector.fetch_release(
+                            releaseid, source_dir)
+                        connector = local_discogs_connector
+                    elif prefetcher is not None:
+                        release = prefetcher.fetch_release(releaseid)
+                        connector = discogs_connector
+                    else:
+                        release = discogs_connector.fetch_release(releaseid)
+                        connector = discogs_connector
+
+                discogs_album = DiscogsAlbum(release)
+
+                try:
+                    album = discogs_album.map()
+                except AlbumError as ae:
+                    msg = f"Error during mapping ({releaseid}), {source_dir}: {ae}"
+                    logger.error(msg)
+                    discs_with_errors.append(msg)
+                    continue
+
+                album.inventory = inventory
+
+                logger.info(f'Tagging album "{album.artist} - {album.title}"')
+
+                tagHandler = TagHandler(album, tagger_config)
+
+                taggerUtils = TaggerUtils(
+                    source_dir, destdir, tagger_config, album)
+
+                fileHandler = FileHandler(album, tagger_config)
+
+                try:
+                    taggerUtils._get_target_list()
+                except TaggerError as te:
+                    msg = f"Error during Tagging ({releaseid}), {source_dir}: {te}"
+                    logger.error(msg)
+                    discs_with_errors.append(msg)
+                    continue
+
+                taggerUtils.gather_addional_properties()
+                # reset the target directory now that we have discogs metadata and
+                #  filedata - otherwise this is declared too early in the process
+                album.target_dir = taggerUtils.dest_dir_name
+
+                fileHandler.copy_files()
+
+                logger.debug("Tagging files")
+
+                # Do replaygain analysis before copying other files, the directory
+                #  contents are cleaner, less prone to mistakes
+                replaygain_pending = False
+                if options.replaygain:
+                    logger.debug("Compute ReplayGain values (if requested)")
+                    replaygain_pending = not fileHandler.compute_replay_gain()
+
+                logger.debug("Copy other interesting files (on request)")
+                fileHandler.copy_other_files()
+
+                logger.debug("Downloading and storing images")
+                fileHandler.get_images(connector)
+                logger.info(f"album files transferred: {fileHandler.transfer.stats}")
+
+                # every track is opened once, the tags, replaygain values and
+                # the cover art are collected and written with a single save
+                logger.debug("Tagging, embedding Albumart and writing tracks")
+                fileHandler.write_tracks(tagHandler, options.jobs)
+
+                if replaygain_pending:
+                    logger.debug("Add ReplayGain tags (if requested)")
+                    fileHandler.add_replay_gain_tags()
+
+                # after tagging, the manifest records the files as they are now
+                fileHandler.save_manifest()
+
+            # !TODO make this more generic to use different templates and files,
+            # furthermore adopt to reflect multi-disc-albums
+                #logger.debug("Generate m3u")
+                # taggerUtils.create_m3u(album.target_dir)
+
+                #logger.debug("Generate nfo")
+                # taggerUtils.create_nfo(album.target_dir)
+
+                fileHandler.create_done_file()
+                file_utils.mark_done(source_dir)
+            except Exception as ex:
+                if releaseid:
+                    msg = "Error during tagging ({0}), {1}: {2}".format(
+                        releaseid, source_dir, ex)
+                else:
+                    msg = "Error during tagging (no relid) {0}: {1}".format(
+                        source_dir, ex)
                 logger.error(msg)
                 discs_with_errors.append(msg)
                 continue
 
-            tagHandler.tag_album()
-            taggerUtils.gather_addional_properties()
-            # reset the target directory now that we have discogs metadata and
-            #  filedata - otherwise this is declared too early in the process
-            album.target_dir = taggerUtils.dest_dir_name
-
-            fileHandler.copy_files()
-
-            logger.debug("Tagging files")
-
-            # Do replaygain analysis before copying other files, the directory
-            #  contents are cleaner, less prone to mistakes
-            if options.replaygain:
-                logger.debug("Add ReplayGain tags (if requested)")
-                fileHandler.add_replay_gain_tags()
-
-            logger.debug("Copy other interesting files (on request)")
-            fileHandler.copy_other_files()
-
-            logger.debug("Downloading and storing images")
-            fileHandler.get_images(connector)
-
-            logger.debug("Embedding Albumart")
-            fileHandler.embed_coverart_album()
-
-        # !TODO make this more generic to use different templates and files,
-        # furthermore adopt to reflect multi-disc-albums
-            #logger.debug("Generate m3u")
-            # taggerUtils.create_m3u(album.target_dir)
-
-            #logger.debug("Generate nfo")
-            # taggerUtils.create_nfo(album.target_dir)
-
-            fileHandler.create_done_file()
-        except Exception as ex:
-            if releaseid:
-                msg = "Error during tagging ({0}), {1}: {2}".format(
-                    releaseid, source_dir, ex)
-            else:
-                msg = "Error during tagging (no relid) {0}: {1}".format(
-                    source_dir, ex)
-            logger.error(msg)
-            discs_with_errors.append(msg)
-            continue
-
-        # !TODO - make this a check during the taggerutils run
-        # ensure we were able to map the release appropriately.
-        # if not release.tag_map:
-        #    logger.error("Unable to match file list to discogs release '%s'" %
-        #                  releaseid)
-        #    sys.exit()
-        converted_discs = converted_discs + 1
-        logger.info("Converted %d/%d" % (converted_discs, len(source_dirs)))
+            # !TODO - make this a check during the taggerutils run
+            # ensure we were able to map the release appropriately.
+            # if not release.tag_map:
+            #    logger.error("Unable to match file list to discogs release '%s'" %
+            #                  releaseid)
+            #    sys.exit()
+            converted_discs = converted_discs + 1
+            logger.info("Converted %d/%d" % (converted_discs, len(source_dirs)))
+    finally:
+        # the queued fetches are cancelled, even if tagging failed or was
+        # interrupted
+        if prefetcher is not None:
+            prefetcher.shutdown()
 
     logger.info("Tagging complete.")
     logger.info("converted successful: %d" % converted_discs)
     logger.info("converted with Errors %d" % len(discs_with_errors))
     logger.info("releases touched: %s" % len(source_dirs))
+    logger.info("waited for rate limits: %.1fs (%d requests)" % (
+        discogs_connector.rate_limiter.waited,
+        discogs_connector.rate_limiter.requests))
 
     if discs_with_errors:
         logger.error("The following discs could not be converted.")
@@ -261,55 +315,50 @@ def processSourceDirs(source_dirs, tagger_config):
             logger.error(msg)
 
 
-def process():
-    source_dirs = getSourceDirs()
+def process(start_dir=None, connectors=None):
+    source_dirs = getSourceDirs(start_dir)
     if len(source_dirs) > 0:
-        processSourceDirs(source_dirs, tagger_config)
-
-
-class DirectoryWatcher():
-
-    def __init__(self):
-        self.total_size = -1
-
-    def dir_size(self, root_dir):
-        total_size = -1
-        for (dirpath, dirs, files) in os.walk(root_dir):
-            for filename in files:
-                file_size = os.stat(os.path.join(dirpath, filename)).st_size
-                total_size += file_size
-        return total_size
-
-    def watch(self, root_dir):
-        while self.total_size != self.dir_size(root_dir):
-            self.total_size = self.dir_size(root_dir)
-            time.sleep(60)
-        # return 'Finished function'
-
-
-class MyHandler(FileSystemEventHandler):
-    def on_modified(self, event):
-        print(f'event type: {event.event_type}  path : {event.src_path}')
-        waitfor = DirectoryWatcher()
-        waitfor.watch(options.sourcedir)
-        print('Finished')
-        process()
+        processSourceDirs(source_dirs, tagger_config, connectors)
+
+
+def processSettled(album_dir, connectors):
+    """ processes a settled directory of the daemon, a directory directly
+        below the source directory, which may hold the albums further down
+        (artist directories)
+    """
+    source_dirs = getSourceDirs(album_dir)
+    if source_dirs == [album_dir]:
+        # not walked, the albums (with an id file) are looked up below
+        source_dirs = file_utils.walk_dir_tree(album_dir, id_file) or source_dirs
+    if len(source_dirs) > 0:
+        processSourceDirs(source_dirs, tagger_config, connectors)
 
 
 if __name__ == "__main__":
     if options.watch == True:
         logger.info('Daemon mode')
-        event_handler = MyHandler()
+        # albums are processed one by one, as soon as their files settled,
+        # all with the same connectors
+        connectors = connect(tagger_config)
+        watcher = AlbumWatcher(
+            options.sourcedir,
+            lambda album_dir: processSettled(album_dir, connectors),
+            settle_time=tagger_config.getfloat("watch", "settle_time"),
+            done_file=tagger_config.get("details", "done_file"),
+            ignore_dirs=[options.destdir] if options.destdir else [])
         observer = Observer()
-        observer.schedule(
-            event_handler, path=options.sourcedir, recursive=False)
+        observer.schedule(watcher, path=options.sourcedir, recursive=True)
         observer.start()
+        watcher.start()
 
         try:
-            time.sleep(1)
+            while observer.is_alive():
+                observer.join(1)
         except KeyboardInterrupt:
             observer.stop()
+        watcher.stop()
         observer.join()
+        watcher.join()
     else:
         source_dirs = getSourceDirs()
         if len(source_dirs) > 0:
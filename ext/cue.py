@@ -4,6 +4,8 @@
 # CUE-sheet file syntax can be found here:
 # http://digitalx.org/cue-sheet/syntax/
 
+import io
+import re
 import chardet
 import codecs
 import tempfile
@@ -15,6 +17,90 @@ allowed_datatypes = ["AUDIO", "CDG", "MODE1/2048", "MODE1/2352", \
 "MODE2/2336", "MODE2/2352", "CDI/2336", "CDI/2352"]
 allowed_extensions = ('.flac', '.wav', '.ape', '.alac', '.wv')
 
+# byte order marks, utf-32 first, since its little endian mark starts with
+# the one of utf-16
+boms = [(codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16")]
+# chardet only sees a sample of the file, starting at the first non-ascii
+# byte (the ascii commands of the sheet tell nothing about the encoding)
+chardet_sample_size = 4096
+non_ascii_pattern = re.compile(rb'[\x80-\xff]')
+# the answers of chardet below this confidence (its own minimum threshold)
+# are guesses, the few accented titles of a sheet often give no more
+chardet_min_confidence = 0.2
+
+# a command and the rest of the line
+line_pattern = re.compile(r'(\S+)\s*(.*)')
+# the name and the format of a FILE line
+file_pattern = re.compile(r'(.*?)\s*(\S+)$')
+
+def detect_encoding(data):
+    ''' the encoding of the given cue sheet (bytes): a byte order mark,
+        utf-8 if the data decodes as such (ascii included) and chardet on a
+        sample of the data otherwise, starting at the first non-ascii byte
+    '''
+    for bom, encoding in boms:
+        if data.startswith(bom):
+            return encoding
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    match = non_ascii_pattern.search(data)
+    start = match.start() if match else 0
+    result = chardet.detect(data[start:start + chardet_sample_size])
+    encoding = result.get("encoding")
+    # the data is no utf-8, thus no ascii either, the most common encoding
+    # of the ripping tools on windows is taken instead
+    if encoding is None or encoding.lower() == "ascii" or \
+            (result.get("confidence") or 0) < chardet_min_confidence:
+        return "cp1252"
+    return encoding
+
+def unquote(value):
+    if value[:1] == '"': value = value[1:]
+    if value[-1:] == '"': value = value[:-1]
+    return value
+
+class ImageIndex:
+    ''' the audio images of directories by their name without extension,
+        each directory is listed once, the index can be shared by all cue
+        sheets of a directory
+    '''
+    def __init__(self):
+        self.directories = {}
+
+    def images(self, directory):
+        images = self.directories.get(directory)
+        if images is None:
+            images = {}
+            try:
+                names = sorted(entry.name for entry in os.scandir(directory)
+                               if entry.is_file())
+            except OSError:
+                names = []
+            for name in names:
+                if name.endswith(allowed_extensions):
+                    images.setdefault(os.path.splitext(name)[0], []).append(name)
+            self.directories[directory] = images
+        return images
+
+    def locate(self, directory, file_name_value):
+        ''' an image in directory with the name (without extension) of the
+            given file or at least starting with it
+        '''
+        file_name = os.path.splitext(os.path.basename(file_name_value))[0]
+        images = self.images(directory)
+        names = images.get(file_name)
+        if names is None:
+            names = [name for stem, stem_names in sorted(images.items())
+                     if stem.startswith(file_name) for name in stem_names]
+        if names:
+            return os.path.join(directory, names[0])
+        return None
+
 class Track:
     def __init__(self):
         self.flags = []
@@ -29,23 +115,32 @@ class Track:
         self.datatype = None
 
 class CUE:
-    def __init__(self, file_name):
+    def __init__(self, file_name, image_index=None):
         self.file_name = file_name
-        self.file_encoding = self.file_encoding()
+        self.image_index = image_index if image_index is not None else ImageIndex()
+        self.file_encoding = None
         self.content = None
         self.load()
         self.parse()
 
     def __str__(self):
-        return self.content
+        return "".join(self.content)
 
     def load(self):
-        with open(self.file_name, 'r', encoding=self.file_encoding) as f:
-            self.content = f.readlines()
-            self.content = [ x.replace("/","\\") for x in self.content]
+        ''' reads the file once, the encoding is detected on the same data '''
+        with open(self.file_name, 'rb') as f:
+            data = f.read()
+        self.file_encoding = detect_encoding(data)
+        text = data.decode(self.file_encoding, errors="replace")
+        # universal newlines, as reading the file in text mode
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        self.content = io.StringIO(text.replace("/", "\\")).readlines()
 
     def parse(self):
-        scope = 'global'
+        ''' parses all lines in a single pass, each command is handled by its
+            entry in the commands table
+        '''
+        self.scope = 'global'
         # Initilizing attributes
         self.tracks = []
         self.remarks = []
@@ -64,157 +159,130 @@ class CUE:
         self.discid = None
         self.comment = None
         # Leaving first track blank
-        current_track = Track()
-        stripped_content = [l.strip() for l in self.content]
-        # Parsing all posible lines
-        for line in stripped_content:
-            cmd = line.split(" ")[0]
-            if cmd=="CATALOG":
-                self.catalog_number = line.split(" ")[1]
-                if not len(self.catalog_number)==13:
-                    print("WARNING: Catalog number has incorrect length")
-            if cmd=="CDTEXTFILE":
-                value = line.split(" ")[1]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                self.cdtext_file_name = value
-            if cmd=="FILE":
-                file_name_value = line[5:]
-                format_value = file_name_value.split(" ")[-1]
-                self.image_file_format = format_value.upper()
-                z = len(format_value) + 1 # +1 is for space
-                file_name_value = file_name_value[:-z]
-                if file_name_value[0] == '"':
-                    file_name_value = file_name_value[1:]
-                if file_name_value[-1] == '"':
-                    file_name_value = file_name_value[:-1]
-                # Add dirname of CUE file if path to image is relative
-                if os.path.dirname(file_name_value)=="":
-                    file_name_value = os.path.join( \
-                            os.path.dirname(self.file_name), \
-                            file_name_value)
-                self.image_file_directory = os.path.dirname(self.file_name)
-                if os.path.exists(file_name_value):
-                    self.image_file_name = file_name_value
-                else:
-                    self.image_file_name = self.locate_image(file_name_value)
-                if self.image_file_directory is None:
-                    print("WARNING: image file not found: {}".format(file_name_value))
-                if not self.image_file_format in allowed_formats:
-                    print("WARNING: Image format %s is not allowed" % \
-                    self.image_file_format)
-            if cmd=="FLAGS":
-                current_track.flags = [x.upper() for x in line.split(" ")[1:]]
-                for flag in current_track.flags:
-                    if not self.image_file_format in allowed_formats:
-                        print("WARNING: Flag %s is not allowed" % flag)
-            if cmd=="INDEX":
-                current_track.indexes.append(\
-                (line.split(" ")[1], line.split(" ")[2]))
-                if int(line.split(" ")[1])<0 or int(line.split(" ")[1])>99:
-                    print("WARNING: Index number %s is not allowed" % \
-                    line.split(" ")[1])
-            if cmd=="ISRC":
-                current_track.isrc = line.split(" ")[1]
-                if not len(line.split(" ")[1]) == 12:
-                    print("WARNING: ISRC must be 12 characters in length")
-            if cmd=="PERFORMER":
-                value = line[11:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                if scope=="global":
-                    self.performer = value
-                if scope=="track":
-                    current_track.performer = value
-                if len(value)>80:
-                    print("WARNING: Performer name should be limited \
-                    to 80 character or less")
-            if cmd=="POSTGAP":
-                current_track.postgap = line.split(" ")[1]
-            if cmd=="PREGAP":
-                current_track.pregap = line.split(" ")[1]
-            if cmd=="REM":
-                # TODO: Implement custom encoders' tags written as REMs
-                self.remarks.append(line[4:])
-            if line.startswith("REM GENRE"):
-                self.genre = line[10:]
-            if line.startswith("REM DATE"):
-                self.date = line[9:]
-            if line.startswith("REM DISCID"):
-                self.discid = line[11:]
-            if line.startswith("REM COMMENT"):
-                value = line[11:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                self.comment = value
-            if cmd=="SONGWRITER":
-                value = line[11:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                if scope=="global":
-                    self.songwriter = value
-                if scope=="track":
-                    current_track.songwriter = value
-                if len(value)>80:
-                    print("WARNING: Songwriter name should be limited \
-                    to 80 character or less")
-            if cmd=="TITLE":
-                value = line[6:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                if scope=="global":
-                    self.title = value
-                if scope=="track":
-                    current_track.title = value
-                if len(value)>80:
-                    print("WARNING: Title should be limited \
-                    to 80 character or less")
-            if cmd=="DISCID":
-                value = line[7:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                if scope=="global":
-                    self.discid = value
-                if scope=="track":
-                    current_track.discid = value
-            if cmd=="DISCNUMBER":
-                value = line[11:]
-                if value[0] == '"': value = value[1:]
-                if value[-1] == '"': value = value[:-1]
-                if scope=="global":
-                    self.discnumber = value
-                if scope=="track":
-                    current_track.discnumber = value
-            if cmd=="TRACK":
-                scope = "track"
-                self.tracks.append(current_track)
-                current_track = Track()
-                current_track.number = int(line.split(" ")[1])
-                current_track.datatype = line.split(" ")[2].upper()
-                if current_track.number<1 or current_track.number>99:
-                    print("WARNING: Track number must be between 1 and \
-                    99 inclusive")
-                if not current_track.datatype in allowed_datatypes:
-                    print("WARNING: Track datatype %s is not allowed" \
-                    % current_track.datatype)
-        self.tracks.append(current_track)
+        self.current_track = Track()
+        for line in self.content:
+            match = line_pattern.match(line.strip())
+            if match is None:
+                continue
+            cmd, value = match.groups()
+            handler = commands.get(cmd)
+            if handler is not None:
+                handler(self, value)
+        self.tracks.append(self.current_track)
+        del self.current_track
+
+    def _set(self, name, value):
+        ''' sets the value on the sheet or the current track (scope) '''
+        target = self if self.scope == "global" else self.current_track
+        setattr(target, name, value)
+
+    def _catalog(self, value):
+        self.catalog_number = value.split(" ")[0]
+        if not len(self.catalog_number)==13:
+            print("WARNING: Catalog number has incorrect length")
+
+    def _cdtextfile(self, value):
+        self.cdtext_file_name = unquote(value)
+
+    def _file(self, value):
+        match = file_pattern.match(value)
+        file_name_value, format_value = match.groups()
+        self.image_file_format = format_value.upper()
+        file_name_value = unquote(file_name_value)
+        # Add dirname of CUE file if path to image is relative
+        if os.path.dirname(file_name_value)=="":
+            file_name_value = os.path.join( \
+                    os.path.dirname(self.file_name), \
+                    file_name_value)
+        self.image_file_directory = os.path.dirname(self.file_name)
+        if os.path.exists(file_name_value):
+            self.image_file_name = file_name_value
+        else:
+            self.image_file_name = self.locate_image(file_name_value)
+        if self.image_file_name is None:
+            print("WARNING: image file not found: {}".format(file_name_value))
+        if not self.image_file_format in allowed_formats:
+            print("WARNING: Image format %s is not allowed" % \
+            self.image_file_format)
+
+    def _flags(self, value):
+        self.current_track.flags = [x.upper() for x in value.split()]
+        for flag in self.current_track.flags:
+            if not flag in allowed_flags:
+                print("WARNING: Flag %s is not allowed" % flag)
+
+    def _index(self, value):
+        number, index = value.split()[:2]
+        self.current_track.indexes.append((number, index))
+        if int(number)<0 or int(number)>99:
+            print("WARNING: Index number %s is not allowed" % number)
+
+    def _isrc(self, value):
+        self.current_track.isrc = value.split(" ")[0]
+        if not len(self.current_track.isrc) == 12:
+            print("WARNING: ISRC must be 12 characters in length")
+
+    def _performer(self, value):
+        value = unquote(value)
+        self._set("performer", value)
+        if len(value)>80:
+            print("WARNING: Performer name should be limited \
+            to 80 character or less")
+
+    def _songwriter(self, value):
+        value = unquote(value)
+        self._set("songwriter", value)
+        if len(value)>80:
+            print("WARNING: Songwriter name should be limited \
+            to 80 character or less")
+
+    def _title(self, value):
+        value = unquote(value)
+        self._set("title", value)
+        if len(value)>80:
+            print("WARNING: Title should be limited \
+            to 80 character or less")
+
+    def _pregap(self, value):
+        self.current_track.pregap = value.split(" ")[0]
+
+    def _postgap(self, value):
+        self.current_track.postgap = value.split(" ")[0]
+
+    def _rem(self, value):
+        # TODO: Implement custom encoders' tags written as REMs
+        self.remarks.append(value)
+        match = line_pattern.match(value)
+        if match is not None:
+            name = rem_commands.get(match.group(1))
+            if name is not None:
+                setattr(self, name, unquote(match.group(2)))
+
+    def _discid(self, value):
+        self._set("discid", unquote(value))
+
+    def _discnumber(self, value):
+        self._set("discnumber", unquote(value))
+
+    def _track(self, value):
+        self.scope = "track"
+        self.tracks.append(self.current_track)
+        self.current_track = Track()
+        number, datatype = value.split()[:2]
+        self.current_track.number = int(number)
+        self.current_track.datatype = datatype.upper()
+        if self.current_track.number<1 or self.current_track.number>99:
+            print("WARNING: Track number must be between 1 and \
+            99 inclusive")
+        if not self.current_track.datatype in allowed_datatypes:
+            print("WARNING: Track datatype %s is not allowed" \
+            % self.current_track.datatype)
 
     def locate_image(self, file_name_value):
         ''' Sometimes files are compressed after CUE has been created,
             but the FILE details have not been updated
         '''
-        file = os.path.split(file_name_value)[1]
-        file_name = os.path.splitext(file)[0]
-        for r, d, f in os.walk(self.image_file_directory):
-            for file in f:
-                if file.startswith(file_name) and file.endswith(allowed_extensions):
-                    if os.path.exists(os.path.join(self.image_file_directory, file)):
-                        return os.path.join(self.image_file_directory, file)
-
-    def file_encoding(self):
-        with open(self.file_name,'rb') as f:
-            data = f.read()
-            return chardet.detect(data).get("encoding")
+        return self.image_index.locate(self.image_file_directory, file_name_value)
 
     def get_temporary_copy(self):
         (fd, fname) = tempfile.mkstemp(suffix='.cue', prefix='tmp', dir='/tmp', text=True)
@@ -223,3 +291,30 @@ class CUE:
             f.write(line)
         f.close()
         return fname
+
+# the commands of a cue sheet, unknown commands are ignored
+commands = {
+    "CATALOG": CUE._catalog,
+    "CDTEXTFILE": CUE._cdtextfile,
+    "FILE": CUE._file,
+    "FLAGS": CUE._flags,
+    "INDEX": CUE._index,
+    "ISRC": CUE._isrc,
+    "PERFORMER": CUE._performer,
+    "POSTGAP": CUE._postgap,
+    "PREGAP": CUE._pregap,
+    "REM": CUE._rem,
+    "SONGWRITER": CUE._songwriter,
+    "TITLE": CUE._title,
+    "DISCID": CUE._discid,
+    "DISCNUMBER": CUE._discnumber,
+    "TRACK": CUE._track,
+}
+
+# the REM comments kept as attributes of the sheet
+rem_commands = {
+    "GENRE": "genre",
+    "DATE": "date",
+    "DISCID": "discid",
+    "COMMENT": "comment",
+}
@@ -1515,12 +1515,16 @@ class MediaFile(object):
         # Set the ID3v2.3 flag only for MP3s.
         self.id3v23 = id3v23 and self.type == 'mp3'
 
-    def save(self):
-        """Write the object's tags back to the file. May
-        throw `UnreadableFileError`.
+    def save(self, path=None, padding=None):
+        """Write the object's tags back to the file (or to `path`, which
+        has to be a copy of the file). `padding` is passed on to mutagen
+        (a callable deciding the padding left after the tags). May throw
+        `UnreadableFileError`.
         """
         # Possibly save the tags to ID3v2.3.
         kwargs = {}
+        if padding is not None:
+            kwargs['padding'] = padding
         if self.id3v23:
             id3 = self.mgfile
             if hasattr(id3, 'tags'):
@@ -1529,7 +1533,10 @@ class MediaFile(object):
             id3.update_to_v23()
             kwargs['v2_version'] = 3
 
-        mutagen_call('save', self.path, self.mgfile.save, **kwargs)
+        if path is None:
+            mutagen_call('save', self.path, self.mgfile.save, **kwargs)
+        else:
+            mutagen_call('save', path, self.mgfile.save, path, **kwargs)
 
     def delete(self):
         """Remove the current metadata tag from the file. May
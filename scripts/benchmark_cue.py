@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import contextlib
+import io
+import logging
+
+from optparse import OptionParser
+
+import chardet
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from ext.cue import CUE
+
+logging.basicConfig(level=30)
+
+p = OptionParser(version="discogstagger2 3.0 - cue sheet parsing benchmark",
+                 usage="%prog [options] corpus_dir")
+p.add_option("-r", "--rounds", action="store", type="int", dest="rounds",
+             help="number of rounds to run")
+p.set_defaults(rounds=3)
+
+(options, args) = p.parse_args()
+
+if len(args) != 1:
+    p.error("the directory with the cue sheets is missing")
+
+corpus = []
+for root, dirs, files in os.walk(args[0]):
+    corpus.extend(os.path.join(root, f) for f in files
+                  if f.lower().endswith(".cue"))
+corpus.sort()
+
+
+def former_encoding(path):
+    """ the former detection, chardet over the whole file """
+    with open(path, "rb") as f:
+        data = f.read()
+    return chardet.detect(data).get("encoding")
+
+
+def parse(path):
+    # the warnings of the parser are printed
+    with contextlib.redirect_stdout(io.StringIO()):
+        return CUE(path)
+
+
+def former_parse(path):
+    """ the former detection followed by the parsing, the file is read
+        twice as before (the former line by line parsing itself is gone)
+    """
+    former_encoding(path)
+    return parse(path)
+
+
+def run(name, function):
+    best = None
+    for x in range(options.rounds):
+        start = time.perf_counter()
+        results = [function(path) for path in corpus]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<36} {:>10.2f} ms {:>8.3f} ms/sheet'.format(
+        name, best * 1000, best * 1000 / max(len(corpus), 1)))
+    return results
+
+
+print('{} cue sheets, best of {} rounds'.format(len(corpus), options.rounds))
+
+run('former encoding detection only', former_encoding)
+run('former detection, then parsing', former_parse)
+sheets = run('detection, loading and parsing', parse)
+
+encodings = {}
+for sheet in sheets:
+    encodings[sheet.file_encoding] = encodings.get(sheet.file_encoding, 0) + 1
+print('encodings: {}'.format(', '.join(
+    '{} {}'.format(e, c) for e, c in sorted(encodings.items(), key=str))))
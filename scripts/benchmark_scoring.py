@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import random
+import time
+import logging
+from datetime import datetime, timedelta
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger import discogsalbum
+from discogstagger.discogsalbum import DiscogsSearch
+
+logging.basicConfig(level=30)
+
+p = OptionParser(version="discogstagger2 3.0 - candidate scoring benchmark")
+p.add_option("-v", "--versions", action="store", type="int", dest="versions",
+             help="number of versions of the master to score")
+p.add_option("-t", "--tracks", action="store", type="int", dest="tracks",
+             help="number of tracks of the album")
+p.add_option("-r", "--rounds", action="store", type="int", dest="rounds",
+             help="number of rounds to run")
+p.set_defaults(versions=500, tracks=14, rounds=5)
+
+(options, args) = p.parse_args()
+
+
+def padded_hms(string):
+    """ the former per-track parsing (int -> timedelta -> str -> int) """
+    a = [int(s) for s in string.split(':')]
+    while len(a) < 3:
+        a.insert(0, 0)
+    dur = (a[0] * 3600) + (a[1] * 60) + a[2]
+    t = str(timedelta(seconds=dur))
+    b = [int(s) for s in t.split(':')]
+    while len(b) < 3:
+        b.insert(0, 0)
+    return ':'.join(['{:0>2}'.format(d) for d in b])
+
+
+def former_scoring(current, imported):
+    """ the former _compareTrackLengths, one release at a time """
+    tolerance = 0.0
+    for ti, track in enumerate(current):
+        timea = datetime.strptime(padded_hms(track['duration']), '%H:%M:%S')
+        timeb = datetime.strptime(padded_hms(imported[ti]['duration']), '%H:%M:%S')
+        difference = timea - timeb if timea > timeb else timeb - timea
+        if difference.total_seconds() > tolerance:
+            tolerance = tolerance + difference.total_seconds()
+    return tolerance / len(current)
+
+
+def mmss(seconds):
+    return '{}:{:0>2}'.format(seconds // 60, seconds % 60)
+
+
+random.seed(42)
+lengths = [random.randint(120, 600) for x in range(options.tracks)]
+current = [{'duration': str(timedelta(seconds=s))} for s in lengths]
+
+versions = []
+for x in range(options.versions):
+    versions.append([{'duration': mmss(max(s + random.randint(-5, 5), 0))}
+                     for s in lengths])
+
+search = DiscogsSearch.__new__(DiscogsSearch)
+
+
+def fresh(tracks):
+    # the durations are parsed once per fetched release, not per round
+    return [dict(t) for t in tracks]
+
+
+def run(name, score):
+    best = None
+    for x in range(options.rounds):
+        releases = [fresh(v) for v in versions]
+        local = fresh(current)
+        start = time.perf_counter()
+        scores = score(local, releases)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<24} {:>10.2f} ms'.format(name, best * 1000))
+    return scores
+
+
+print('{} versions with {} tracks, best of {} rounds'.format(
+    options.versions, options.tracks, options.rounds))
+
+former = run('former (strptime)', lambda local, releases: [
+    former_scoring(local, imported) for imported in releases])
+
+numpy = discogsalbum.numpy
+discogsalbum.numpy = None
+python = run('parsed once (python)', search._scoreTrackLengths)
+discogsalbum.numpy = numpy
+
+if numpy is not None:
+    vectorized = run('parsed once (numpy)', search._scoreTrackLengths)
+    assert all(abs(a - b) < 1e-9 for a, b in zip(former, vectorized))
+else:
+    print('numpy is not installed')
+
+assert all(abs(a - b) < 1e-9 for a, b in zip(former, python))
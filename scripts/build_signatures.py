@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.releasecache import ReleaseCache
+from discogstagger.dumpindex import DumpIndex
+from discogstagger.signatureindex import SignatureIndex
+
+logging.basicConfig(level=20)
+logger = logging.getLogger(__name__)
+
+p = OptionParser(version="discogstagger2 3.0 - signature index builder")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+p.add_option("-d", "--dump", action="store_true", dest="dump",
+             help="Add the releases of the dump index ([dump] index_file) as well")
+
+p.set_defaults(conffile=os.path.join(parentdir, "conf", "default.conf"),
+               dump=False)
+
+(options, args) = p.parse_args()
+
+tagger_config = TaggerConfig(options.conffile)
+
+signature_index = SignatureIndex(
+    os.path.expanduser(tagger_config.get("cache", "signature_index_file")),
+    tagger_config.getint("cache", "signature_quantum"))
+
+sources = []
+release_cache = ReleaseCache.from_config(tagger_config)
+if release_cache is not None:
+    sources.append(("release cache", release_cache))
+if options.dump:
+    sources.append(("dump index", DumpIndex.from_config(tagger_config)))
+
+
+def batches(releases, size=1000):
+    batch = []
+    for release in releases:
+        batch.append(release)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+for name, source in sources:
+    start = time.time()
+    count = 0
+    for batch in batches(source.releases()):
+        count += signature_index.add_releases(batch)
+    logger.info("%d signatures from the %s in %.1fs" %
+                (count, name, time.time() - start))
+    source.close()
+
+logger.info("%d releases in the signature index" % len(signature_index))
+signature_index.close()
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.dumpindex import DumpIndex
+
+logging.basicConfig(level=20)
+logger = logging.getLogger(__name__)
+
+p = OptionParser(version="discogstagger2 3.0 - dump importer",
+                 usage="%prog [options] DUMP_FILE...")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+p.add_option("-i", "--index", action="store", dest="indexfile",
+             help="The index file to import into (default: [dump] index_file)")
+
+p.set_defaults(conffile=os.path.join(parentdir, "conf", "default.conf"))
+
+(options, args) = p.parse_args()
+
+if not args:
+    p.print_help()
+    sys.exit(1)
+
+tagger_config = TaggerConfig(options.conffile)
+
+if options.indexfile:
+    dump_index = DumpIndex(options.indexfile)
+else:
+    dump_index = DumpIndex.from_config(tagger_config)
+
+# e.g. discogs_20200101_releases.xml.gz, discogs_20200101_masters.xml.gz
+for dump_file in args:
+    start = time.time()
+    count = dump_index.import_dump(dump_file)
+    logger.info("%d entries in %.1fs" % (count, time.time() - start))
+
+dump_index.close()
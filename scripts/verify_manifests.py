@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.manifest import Manifest
+
+logging.basicConfig(level=20)
+logger = logging.getLogger(__name__)
+
+p = OptionParser(version="discogstagger2 3.0 - manifest verification",
+                 usage="%prog [options] library_dir")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(conffile=os.path.join(parentdir, "conf", "default.conf"))
+
+(options, args) = p.parse_args()
+
+if len(args) != 1:
+    p.error("the library directory is missing")
+
+tagger_config = TaggerConfig(options.conffile)
+manifest_file = tagger_config.get("details", "manifest_file")
+if not manifest_file:
+    p.error("no manifest_file configured")
+
+start = time.time()
+albums = files = 0
+failed = []
+for root, dirs, names in os.walk(args[0]):
+    dirs.sort()
+    if manifest_file not in names:
+        continue
+    manifest = Manifest(os.path.join(root, manifest_file))
+    albums += 1
+    files += len(manifest.entries)
+    for name in manifest.verify():
+        logger.error("differs from the manifest: %s" % os.path.join(root, name))
+        failed.append(os.path.join(root, name))
+
+logger.info("%d files in %d albums verified in %.1fs, %d failed" %
+            (files, albums, time.time() - start, len(failed)))
+sys.exit(1 if failed else 0)
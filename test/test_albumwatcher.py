@@ -0,0 +1,110 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, DirCreatedEvent
+
+from discogstagger.albumwatcher import AlbumWatcher
+
+source_dir = "/tmp/dummy_albumwatcher"
+
+def setup_function(function):
+    if os.path.exists(source_dir):
+        shutil.rmtree(source_dir)
+    for album in ("first", "second/cd1", "second/cd2"):
+        os.makedirs(os.path.join(source_dir, album))
+
+def teardown_function(function):
+    shutil.rmtree(source_dir, ignore_errors=True)
+
+def write(name, content="data"):
+    path = os.path.join(source_dir, name)
+    with open(path, "a") as f:
+        f.write(content)
+    return path
+
+def test_album_dir():
+    watcher = AlbumWatcher(source_dir, None, ignore_dirs=[os.path.join(source_dir, "dest")])
+
+    assert watcher.album_dir(os.path.join(source_dir, "first", "01.flac")) == \
+        os.path.join(source_dir, "first")
+    assert watcher.album_dir(os.path.join(source_dir, "second", "cd2", "01.flac")) == \
+        os.path.join(source_dir, "second")
+    assert watcher.album_dir(os.path.join(source_dir, "second", "cd1"), True) == \
+        os.path.join(source_dir, "second")
+    assert watcher.album_dir(os.path.join(source_dir, "01.flac")) is None
+    assert watcher.album_dir(source_dir, True) is None
+    assert watcher.album_dir("/somewhere/else/01.flac") is None
+    assert watcher.album_dir(os.path.join(source_dir, "dest", "x", "01.flac")) is None
+
+def test_events():
+    watcher = AlbumWatcher(source_dir, None, done_file="dt.done")
+
+    watcher.on_any_event(FileCreatedEvent(write("first/01.flac")))
+    watcher.on_any_event(FileModifiedEvent(write("second/cd1/01.flac")))
+    watcher.on_any_event(FileModifiedEvent(write("second/cd2/01.flac")))
+    watcher.on_any_event(FileCreatedEvent(write("first/dt.done")))
+    watcher.on_any_event(DirCreatedEvent(source_dir))
+    # a file directly in the source directory belongs to no album
+    watcher.on_any_event(FileCreatedEvent(write("notes.txt")))
+
+    assert sorted(watcher.pending) == [os.path.join(source_dir, "first"),
+                                       os.path.join(source_dir, "second")]
+    assert len(watcher.pending[os.path.join(source_dir, "second")].changed) == 2
+
+def test_nested_events():
+    watcher = AlbumWatcher(source_dir, None, settle_time=10)
+    artist = os.path.join(source_dir, "artist")
+    album = os.path.join(artist, "album")
+    os.makedirs(os.path.join(album, "scans"))
+
+    watcher.on_any_event(DirCreatedEvent(artist))
+    watcher.on_any_event(DirCreatedEvent(album))
+    watcher.on_any_event(FileCreatedEvent(write("artist/album/01.flac")))
+    watcher.on_any_event(DirCreatedEvent(os.path.join(album, "scans")))
+    watcher.on_any_event(FileCreatedEvent(write("artist/album/scans/a.jpg")))
+
+    # one album for the whole upload, no part of it settles on its own
+    assert list(watcher.pending) == [artist]
+    now = watcher.pending[artist].last_event
+    assert watcher.settled(now + 10) == []
+    assert watcher.settled(now + 20) == [artist]
+    assert watcher.pending == {}
+
+def test_settle():
+    watcher = AlbumWatcher(source_dir, None, settle_time=10)
+    first = os.path.join(source_dir, "first")
+    second = os.path.join(source_dir, "second")
+
+    watcher.add(first, write("first/01.flac"))
+    watcher.add(second, write("second/cd1/01.flac"))
+    now = watcher.pending[second].last_event
+
+    # not quiet long enough
+    assert watcher.settled(now + 5) == []
+    # quiet, the changed files are checked once more after the settle time
+    assert watcher.settled(now + 10) == []
+
+    # the second album is still growing
+    write("second/cd1/01.flac", "more data")
+    assert watcher.settled(now + 20) == [first]
+    assert watcher.settled(now + 30) == [second]
+    assert watcher.pending == {}
+
+def test_queue():
+    processed = []
+    watcher = AlbumWatcher(source_dir, processed.append, settle_time=0)
+    first = os.path.join(source_dir, "first")
+
+    watcher.start()
+    watcher.enqueue(first)
+    watcher.stop()
+    watcher.join()
+
+    assert processed == [first]
@@ -0,0 +1,77 @@
+import os, sys
+import shutil
+import wave
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from ext.mediafile import MediaFile
+
+from discogstagger.audioprobe import probe, can_probe, ProbeError
+
+work_dir = "/tmp/dummy_audioprobe"
+
+def setup_function(function):
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+
+def teardown_function(function):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+def same_as_mediafile(path):
+    info = probe(path)
+    metadata = MediaFile(path)
+
+    assert info.type == metadata.type
+    assert info.samplerate == metadata.samplerate
+    assert info.bitdepth == metadata.bitdepth
+    assert info.channels == metadata.channels
+    assert info.bitrate == metadata.bitrate
+    assert abs(info.length - metadata.length) < 1e-6
+
+def test_flac_and_mp3():
+    for name in ("test.flac", "test.mp3"):
+        path = os.path.join(work_dir, name)
+        shutil.copyfile(os.path.join(parentdir, "test/files", name), path)
+        same_as_mediafile(path)
+
+        # large embedded art does not change anything
+        metadata = MediaFile(path)
+        with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as f:
+            metadata.art = f.read() * 50
+        metadata.save()
+        same_as_mediafile(path)
+
+def test_wav():
+    path = os.path.join(work_dir, "test.wav")
+    w = wave.open(path, "wb")
+    w.setnchannels(2)
+    w.setsampwidth(3)
+    w.setframerate(96000)
+    w.writeframes(b"\0" * 96000 * 6 * 2)
+    w.close()
+
+    info = probe(path)
+    assert info.type == "wav"
+    assert (info.samplerate, info.bitdepth, info.channels) == (96000, 24, 2)
+    assert info.length == 2.0
+    assert info.bitrate == 96000 * 24 * 2
+
+def test_not_probed():
+    path = os.path.join(work_dir, "test.ogg")
+    open(path, "w").close()
+    assert not can_probe(path)
+
+    path = os.path.join(work_dir, "broken.flac")
+    with open(path, "wb") as f:
+        f.write(b"no flac")
+    try:
+        probe(path)
+        assert False
+    except ProbeError:
+        pass
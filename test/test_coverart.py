@@ -0,0 +1,58 @@
+import os, sys
+import hashlib
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import pytest
+
+from discogstagger import coverart
+from discogstagger.coverart import prepare_coverart
+
+def cover():
+    with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as f:
+        return f.read()
+
+def test_without_pillow():
+    image = coverart.Image
+    coverart.Image = None
+    try:
+        prepared = prepare_coverart(cover(), 100, 50)
+    finally:
+        coverart.Image = image
+
+    assert prepared.data == cover()
+    assert prepared.digest == hashlib.sha1(cover()).hexdigest()
+    assert prepared.width is None and prepared.height is None
+
+def test_broken_image():
+    prepared = prepare_coverart(b"no image", 100, 50)
+
+    assert prepared.data == b"no image"
+
+def test_prepare():
+    pytest.importorskip("PIL")
+
+    prepared = prepare_coverart(cover(), 16, 50)
+
+    assert len(prepared.data) < len(cover())
+    assert max(prepared.width, prepared.height) == 16
+    assert prepared.digest == hashlib.sha1(prepared.data).hexdigest()
+
+def test_strip_metadata():
+    Image = pytest.importorskip("PIL.Image")
+    import io
+
+    # a small image, which does not get smaller, with an icc profile
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(output, "JPEG", quality=10,
+                                  icc_profile=b"profile" * 100)
+    imgdata = output.getvalue()
+
+    prepared = prepare_coverart(imgdata, 0, 95)
+    assert "icc_profile" not in Image.open(io.BytesIO(prepared.data)).info
+    assert prepared.digest == hashlib.sha1(prepared.data).hexdigest()
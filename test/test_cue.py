@@ -0,0 +1,127 @@
+import os, sys
+import codecs
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import ext.cue
+from ext.cue import CUE, ImageIndex, detect_encoding
+
+source_dir = "/tmp/dummy_cue"
+
+CUE_SHEET = """REM GENRE "Hard Rock"
+REM DATE 1980
+REM COMMENT "ExactAudioCopy v1.0"
+CATALOG 0123456789012
+PERFORMER "Motörhead"
+TITLE "Ace of Spades"
+FILE "image.flac" WAVE
+  TRACK 01 AUDIO
+    TITLE "Ace of Spades"
+    PERFORMER Lemmy
+    FLAGS dcp
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    TITLE  "Love Me Like a Reptile"
+    ISRC GBAJE8000002
+    INDEX 00   02:46:30
+    INDEX 01 02:48:00
+"""
+
+def setup_function(function):
+    if os.path.exists(source_dir):
+        shutil.rmtree(source_dir)
+    os.makedirs(source_dir)
+    open(os.path.join(source_dir, "image.flac"), "wb").close()
+
+def teardown_function(function):
+    shutil.rmtree(source_dir, ignore_errors=True)
+
+def write(data, name="image.cue"):
+    path = os.path.join(source_dir, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def test_detect_encoding():
+    text = "TITLE \"Motörhead\"\n"
+    assert detect_encoding(text.encode("ascii", "replace")) == "utf-8"
+    assert detect_encoding(text.encode("utf-8")) == "utf-8"
+    assert detect_encoding(codecs.BOM_UTF8 + text.encode("utf-8")) == "utf-8-sig"
+    assert detect_encoding(text.encode("utf-16")) == "utf-16"
+    # no utf-8, chardet decides
+    assert detect_encoding(text.encode("latin-1")) not in ("utf-8", None)
+
+def test_parse():
+    cue = CUE(write(CUE_SHEET.replace("\n", "\r\n").encode("utf-8")))
+
+    assert cue.file_encoding == "utf-8"
+    assert cue.catalog_number == "0123456789012"
+    assert cue.performer == "Motörhead"
+    assert cue.title == "Ace of Spades"
+    assert cue.genre == "Hard Rock"
+    assert cue.date == "1980"
+    assert cue.comment == "ExactAudioCopy v1.0"
+    assert cue.image_file_format == "WAVE"
+    assert cue.image_file_name == os.path.join(source_dir, "image.flac")
+    assert cue.remarks[0] == 'GENRE "Hard Rock"'
+
+    # the first entry holds the lines before the first track
+    assert len(cue.tracks) == 3
+    first, second = cue.tracks[1:]
+    assert (first.number, first.datatype) == (1, "AUDIO")
+    assert first.performer == "Lemmy"
+    assert first.flags == ["DCP"]
+    assert first.indexes == [("01", "00:00:00")]
+    assert second.title == "Love Me Like a Reptile"
+    assert second.isrc == "GBAJE8000002"
+    assert second.indexes == [("00", "02:46:30"), ("01", "02:48:00")]
+
+def test_encodings():
+    for encoding in ("utf-8-sig", "utf-16", "cp1252"):
+        cue = CUE(write(CUE_SHEET.encode(encoding)))
+        assert cue.performer == "Motörhead", encoding
+        assert len(cue.tracks) == 3
+
+def test_late_accents():
+    # the first accented character follows more than the sample size of
+    # plain ascii
+    tracks = "".join('  TRACK %02d AUDIO\n    TITLE "Track %d"\n    INDEX 01 %02d:00:00\n'
+                     % (n, n, n) for n in range(1, 80))
+    sheet = 'PERFORMER "Various"\nFILE "image.flac" WAVE\n' + tracks + \
+        '  TRACK 80 AUDIO\n    TITLE "Café Déjà vu"\n    INDEX 01 80:00:00\n'
+    data = sheet.encode("cp1252")
+    assert data.index(b"\xe9") > 4096
+
+    assert detect_encoding(data) not in ("ascii", "utf-8", None)
+    cue = CUE(write(data))
+    assert cue.tracks[-1].title == "Café Déjà vu"
+
+def test_locate_image(monkeypatch):
+    # the images were compressed after the cue sheets were written
+    for name in ("disc1.flac", "disc2.wv", "disc2.log", "other.flac"):
+        open(os.path.join(source_dir, name), "wb").close()
+    os.makedirs(os.path.join(source_dir, "scans"))
+
+    listed = []
+    scandir = os.scandir
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+    monkeypatch.setattr(ext.cue.os, "scandir", counting_scandir)
+
+    image_index = ImageIndex()
+    sheets = [CUE(write(CUE_SHEET.replace("image.flac", "%s.wav" % name).encode("utf-8"),
+                        "%s.cue" % name), image_index)
+              for name in ("disc1", "disc2", "disc")]
+    assert [os.path.basename(cue.image_file_name) for cue in sheets] == \
+        ["disc1.flac", "disc2.wv", "disc1.flac"]
+    # the directory is listed once for all sheets
+    assert listed == [source_dir]
+
+    assert image_index.locate(source_dir, "missing.wav") is None
@@ -0,0 +1,160 @@
+import os, sys
+import json
+import wave
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from ext.cue import CUE
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.fileutils import FileUtils
+from discogstagger.cuesplit import CueSplitter, index_frames, track_ranges, \
+    track_tags, track_file_name
+
+source_dir = "/tmp/dummy_cuesplit"
+
+CUE_SHEET = """REM GENRE Rock
+REM DATE 1999
+PERFORMER "The Artist"
+TITLE "The Album"
+FILE "image.wav" WAVE
+  TRACK 01 AUDIO
+    TITLE "First"
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    TITLE "Second"
+    INDEX 00 00:01:00
+    INDEX 01 00:01:37
+  TRACK 03 AUDIO
+    TITLE "Third"
+    ISRC USABC9912345
+    INDEX 01 00:02:00
+"""
+
+# records its arguments in the output file, reads the input from stdin
+# when encoding from a pipe and writes something when decoding
+FAKE_FLAC = """#!%s
+import sys, json
+args = sys.argv[1:]
+if "--decode" in args:
+    sys.stdout.write("RIFF" * 100)
+    sys.exit(0)
+if args[-1] == "-":
+    sys.stdin.read()
+with open(args[args.index("-o") + 1], "w") as f:
+    json.dump(args, f)
+""" % sys.executable
+
+class DummyOptions(object):
+    forceUpdate = False
+
+def setup_function(function):
+    if os.path.exists(source_dir):
+        shutil.rmtree(source_dir)
+    os.makedirs(source_dir)
+
+    with open(os.path.join(source_dir, "image.cue"), "w") as f:
+        f.write(CUE_SHEET)
+
+    image = wave.open(os.path.join(source_dir, "image.wav"), "wb")
+    image.setnchannels(2)
+    image.setsampwidth(2)
+    image.setframerate(44100)
+    image.writeframes(b"\0" * 4 * 44100 * 3)
+    image.close()
+
+    flac = os.path.join(source_dir, "bin", "flac")
+    os.makedirs(os.path.dirname(flac))
+    with open(flac, "w") as f:
+        f.write(FAKE_FLAC)
+    os.chmod(flac, 0o755)
+
+def teardown_function(function):
+    shutil.rmtree(source_dir, ignore_errors=True)
+
+def cue_sheet():
+    cue = CUE(os.path.join(source_dir, "image.cue"))
+    cue.output_format = "%n"
+    return cue
+
+def test_ranges():
+    assert index_frames("00:01:37") == 112
+    assert index_frames("10:00:00") == 45000
+
+    cue = cue_sheet()
+    ranges = [(t.number, start, end) for t, start, end in track_ranges(cue, 44100)]
+    # INDEX 01, not the pregap (INDEX 00), 588 samples per cd frame
+    assert ranges == [(1, 0, 65856), (2, 65856, 88200), (3, 88200, None)]
+
+def test_tags():
+    cue = cue_sheet()
+    track = cue.tracks[3]
+    assert track_file_name(cue, track) == "03.flac"
+    assert dict(track_tags(cue, track)) == {
+        "TITLE": "Third", "ARTIST": "The Artist", "ALBUM": "The Album",
+        "TRACKNUMBER": "3", "TRACKTOTAL": "3", "ISRC": "USABC9912345",
+        "GENRE": "Rock", "DATE": "1999"}
+
+    # the performer of a track on a compilation
+    track.performer = "The Guest"
+    assert dict(track_tags(cue, track))["ARTIST"] == "The Guest"
+
+def test_can_split():
+    cue = cue_sheet()
+    assert not CueSplitter(flac="no-such-flac").can_split([cue])
+    assert CueSplitter(flac=os.path.join(source_dir, "bin", "flac")).can_split([cue])
+
+    cue.image_file_name = os.path.join(source_dir, "image.ape")
+    assert not CueSplitter(flac=os.path.join(source_dir, "bin", "flac")).can_split([cue])
+
+def test_split():
+    cue = cue_sheet()
+    splitter = CueSplitter(workers=2, flac=os.path.join(source_dir, "bin", "flac"))
+    assert splitter.split([(cue, source_dir)])
+
+    with open(os.path.join(source_dir, "02.flac")) as f:
+        args = json.load(f)
+    assert "--skip=65856" in args and "--until=88200" in args
+    assert "TITLE=Second" in args
+    assert args[-1] == os.path.join(source_dir, "image.wav")
+
+    with open(os.path.join(source_dir, "03.flac")) as f:
+        args = json.load(f)
+    assert not [a for a in args if a.startswith("--until")]
+    assert not [f for f in os.listdir(source_dir) if f.endswith(".part")]
+
+def test_split_flac():
+    # a flac image with the stream info only
+    bits = (44100 << 44) | (1 << 41) | (15 << 36) | (44100 * 3)
+    with open(os.path.join(source_dir, "image.flac"), "wb") as f:
+        f.write(b"fLaC" + bytes([0x80, 0, 0, 34]) + b"\0" * 10 +
+                bits.to_bytes(8, "big") + b"\0" * 16)
+
+    cue = cue_sheet()
+    cue.image_file_name = os.path.join(source_dir, "image.flac")
+    splitter = CueSplitter(flac=os.path.join(source_dir, "bin", "flac"))
+    assert splitter.split([(cue, source_dir)])
+
+    # decoded in a pipe, only the range of the track
+    with open(os.path.join(source_dir, "02.flac")) as f:
+        args = json.load(f)
+    assert args[-1] == "-"
+    assert "--skip=65856" not in args
+
+def test_process_cue_files():
+    tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+    tagger_config.set("cue", "parse_cue_files", "True")
+    file_utils = FileUtils(tagger_config, DummyOptions())
+    file_utils.cue_splitter = CueSplitter(
+        flac=os.path.join(source_dir, "bin", "flac"))
+
+    assert file_utils._processCueFiles(source_dir, ["image.cue"]) == 0
+    assert sorted(f for f in os.listdir(source_dir) if f.endswith(".flac")) == \
+        ["01.flac", "02.flac", "03.flac"]
+    assert sorted(os.listdir(os.path.join(source_dir, ".cue"))) == \
+        ["image.cue", "image.wav"]
@@ -0,0 +1,66 @@
+import os, sys
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import discogs_client as discogs
+
+from discogstagger.dumpindex import DumpIndex, DumpFetcher
+
+dumpdir = os.path.join(parentdir, "test/dump")
+
+def create_index():
+    dump_index = DumpIndex(":memory:")
+    for name in ("releases.xml", "masters.xml", "artists.xml"):
+        dump_index.import_dump(os.path.join(dumpdir, name))
+    return dump_index
+
+def test_import():
+
+    dump_index = create_index()
+
+    assert len(dump_index) == 2
+
+    release = dump_index.release(1448190)
+    assert release["title"] == "Megahits 2001 Die Erste"
+    assert release["year"] == 2001
+    assert release["master_id"] == 42
+    assert release["formats"][0]["qty"] == "2"
+    assert [t["type_"] for t in release["tracklist"]] == ["heading", "track", "track"]
+
+    assert dump_index.master(42)["main_release"] == 1448190
+    assert dump_index.artist(1)["realname"] == "Luigino Celestino Di Agostino"
+
+def test_search():
+
+    dump_index = create_index()
+
+    count, results = dump_index.search("megahits 2001", "release")
+    assert count == 1
+    assert results[0]["id"] == 1448190
+
+    count, results = dump_index.search("Megahits erste")
+    assert sorted(r["type"] for r in results) == ["master", "release"]
+
+    count, results = dump_index.search("gigi dagostino", "artist")
+    assert results[0]["id"] == 1
+
+def test_client_uses_dump():
+
+    client = discogs.Client("discogstagger test")
+    client._fetcher = DumpFetcher(create_index())
+
+    release = client.release(3083)
+    assert release.title == "L'Amour Toujours"
+    assert release.tracklist[0].duration == "6:59"
+
+    results = client.search("Megahits 2001", type="master")
+    master = results[0]
+    assert [v.id for v in master.versions] == [1448190]
+
+    artist = client.search("Gigi D'Agostino", type="artist")[0]
+    assert [r.title for r in artist.releases] == ["L'Amour Toujours"]
@@ -0,0 +1,58 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.httpsession import download, UMASK
+
+target_dir = "/tmp/dummy_httpsession"
+
+class DummyResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+class DummySession(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, url, stream=False, timeout=None):
+        return DummyResponse(self.data)
+
+def setup_function(function):
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    os.makedirs(target_dir)
+
+def teardown_function(function):
+    shutil.rmtree(target_dir, ignore_errors=True)
+
+def test_download():
+    target_file = os.path.join(target_dir, "folder.jpg")
+    download(DummySession(b"image" * 1000), "http://example.com/a.jpg",
+             target_file, chunk_size=100)
+
+    with open(target_file, "rb") as f:
+        assert f.read() == b"image" * 1000
+    assert os.listdir(target_dir) == ["folder.jpg"]
+    # as any other file created, not the 0600 of the temporary file
+    assert os.stat(target_file).st_mode & 0o777 == 0o666 & ~UMASK
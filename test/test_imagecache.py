@@ -0,0 +1,72 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.imagecache import ImageCache
+
+cache_dir = "/tmp/dummy_image_cache"
+target_dir = "/tmp/dummy_image_target"
+
+def setup_function(function):
+    for path in (cache_dir, target_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(target_dir)
+
+def teardown_function(function):
+    for path in (cache_dir, target_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+def test_store_and_fetch():
+
+    cache = ImageCache(cache_dir)
+    url = "https://img.discogs.com/R-1448190-1220476110.jpeg"
+
+    image = os.path.join(target_dir, "download.jpg")
+    with open(image, "wb") as fh:
+        fh.write(b"\xff\xd8\xff\xe0 not really a jpeg")
+
+    assert not cache.fetch(url, os.path.join(target_dir, "folder.jpg"))
+
+    cache.store(url, image)
+
+    assert url in cache
+    assert cache.fetch(url, os.path.join(target_dir, "folder.jpg"))
+    with open(os.path.join(target_dir, "folder.jpg"), "rb") as fh:
+        assert fh.read() == b"\xff\xd8\xff\xe0 not really a jpeg"
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+def test_content_is_stored_once():
+
+    cache = ImageCache(cache_dir)
+
+    image = os.path.join(target_dir, "download.jpg")
+    with open(image, "wb") as fh:
+        fh.write(b"shared artwork")
+
+    # a reissue using the same artwork under a different url
+    first = cache.store("https://img.discogs.com/R-1.jpeg", image)
+    second = cache.store("https://img.discogs.com/R-2.jpeg", image)
+
+    assert first == second
+    assert len(cache) == 1
+
+def test_missing_object_is_a_miss():
+
+    cache = ImageCache(cache_dir)
+    url = "https://img.discogs.com/R-3083.jpeg"
+
+    image = os.path.join(target_dir, "download.jpg")
+    with open(image, "wb") as fh:
+        fh.write(b"gone")
+
+    os.remove(cache.object_path(cache.store(url, image)))
+
+    assert cache.lookup(url) is None
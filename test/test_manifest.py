@@ -0,0 +1,112 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.manifest import Manifest, ALGORITHM, file_digest
+from discogstagger.transfer import FileTransfer
+from discogstagger.httpsession import UMASK
+
+source_dir = "/tmp/dummy_manifest_source"
+target_dir = "/tmp/dummy_manifest_target"
+manifest_path = os.path.join(target_dir, "dt.manifest")
+
+def setup_function(function):
+    for path in (source_dir, target_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    for name in ("01.flac", "02.flac"):
+        with open(os.path.join(source_dir, name), "wb") as f:
+            f.write(os.urandom(300000))
+
+def teardown_function(function):
+    for path in (source_dir, target_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+def transfer(manifest, mode="copy"):
+    file_transfer = FileTransfer(mode, checksum=manifest.algorithm)
+    for name in ("01.flac", "02.flac"):
+        source = os.path.join(source_dir, name)
+        target = os.path.join(target_dir, name)
+        file_transfer.transfer(source, target)
+        manifest.record(source, target, file_transfer.checksums[target])
+    return file_transfer
+
+def test_checksums():
+    manifest = Manifest(manifest_path)
+    for mode in ("copy", "hardlink"):
+        file_transfer = transfer(manifest, mode)
+        for target, checksum in file_transfer.checksums.items():
+            assert checksum == file_digest(target, ALGORITHM)
+
+def test_without_checksum():
+    file_transfer = FileTransfer("copy", checksum=ALGORITHM)
+    source = os.path.join(source_dir, "01.flac")
+    target = os.path.join(target_dir, "01.flac")
+    file_transfer.transfer(source, target, compute_checksum=False)
+    assert file_transfer.checksums == {}
+
+    # computed when saving
+    manifest = Manifest(manifest_path)
+    manifest.record(source, target)
+    manifest.save()
+    assert Manifest(manifest_path).entries["01.flac"]["hash"] == file_digest(target)
+    assert os.stat(manifest_path).st_mode & 0o777 == 0o666 & ~UMASK
+
+def test_unchanged():
+    manifest = Manifest(manifest_path)
+    source = os.path.join(source_dir, "01.flac")
+    target = os.path.join(target_dir, "01.flac")
+    assert manifest.unchanged(source, target) is None
+
+    transfer(manifest)
+    manifest.save()
+
+    manifest = Manifest(manifest_path)
+    assert manifest.unchanged(source, target) is True
+
+    # truncated copy
+    with open(target, "r+b") as f:
+        f.truncate(1000)
+    assert manifest.unchanged(source, target) is False
+
+def test_changed_source():
+    manifest = Manifest(manifest_path)
+    transfer(manifest)
+    manifest.save()
+
+    source = os.path.join(source_dir, "02.flac")
+    with open(source, "ab") as f:
+        f.write(b"more")
+    assert Manifest(manifest_path).unchanged(
+        source, os.path.join(target_dir, "02.flac")) is False
+
+def test_save_and_verify():
+    manifest = Manifest(manifest_path)
+    transfer(manifest)
+
+    # tagging changes the target after the transfer
+    target = os.path.join(target_dir, "01.flac")
+    with open(target, "ab") as f:
+        f.write(b"tags")
+    manifest.save()
+
+    manifest = Manifest(manifest_path)
+    assert manifest.entries["01.flac"]["hash"] == file_digest(target)
+    assert manifest.entries["01.flac"]["size"] == 300004
+    assert manifest.verify() == []
+
+    with open(target, "r+b") as f:
+        f.write(b"rot")
+    os.remove(os.path.join(target_dir, "02.flac"))
+    assert manifest.verify() == ["01.flac", "02.flac"]
+
+    manifest.save()
+    assert list(Manifest(manifest_path).entries) == ["01.flac"]
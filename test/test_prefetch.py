@@ -0,0 +1,122 @@
+import os, sys
+import threading
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import pytest
+
+from discogstagger.prefetch import ReleasePrefetcher
+
+class DummyConnector(object):
+    """ records the releases fetched, the releases in blocked wait for the
+        gate, those in failing fail once
+    """
+
+    def __init__(self, blocked=(), failing=()):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+        self.blocked = set(blocked)
+        self.failing = set(failing)
+
+    def fetch_release(self, release_id):
+        with self.lock:
+            self.calls.append(release_id)
+            failing = release_id in self.failing
+            self.failing.discard(release_id)
+        if release_id in self.blocked:
+            self.gate.wait(5)
+        if failing:
+            raise IOError("connection reset")
+        return "release %s" % release_id
+
+def test_in_order():
+    connector = DummyConnector()
+    prefetcher = ReleasePrefetcher(connector, workers=2, depth=3)
+    prefetcher.start([1, 2, 3, 4, 5])
+
+    assert [prefetcher.fetch_release(i) for i in range(1, 6)] == \
+        ["release %d" % i for i in range(1, 6)]
+    prefetcher.shutdown()
+    # every release is fetched once
+    assert sorted(connector.calls) == ["1", "2", "3", "4", "5"]
+
+def test_depth():
+    connector = DummyConnector(blocked=[str(i) for i in range(1, 11)])
+    prefetcher = ReleasePrefetcher(connector, workers=2, depth=3)
+    prefetcher.start(range(1, 11))
+
+    # no more than depth releases in flight, the others wait
+    assert list(prefetcher.futures) == ["1", "2", "3"]
+    assert len(prefetcher.pending) == 7
+
+    connector.gate.set()
+    assert prefetcher.fetch_release(1) == "release 1"
+    assert list(prefetcher.futures) == ["2", "3", "4"]
+    assert len(prefetcher.pending) == 6
+    prefetcher.shutdown()
+    assert not set(connector.calls) - set(["1", "2", "3", "4"])
+
+def test_skipped():
+    # a single worker, busy with the first release
+    connector = DummyConnector(blocked=["1"])
+    prefetcher = ReleasePrefetcher(connector, workers=1, depth=4)
+    prefetcher.start([1, 2, 3, 4, 5])
+    timer = threading.Timer(0.1, connector.gate.set)
+    timer.start()
+
+    # the first two albums were skipped by the tagging loop
+    assert prefetcher.fetch_release(3) == "release 3"
+    timer.join()
+    assert list(prefetcher.futures) == ["4", "5"]
+    prefetcher.shutdown()
+    # the queued one is cancelled, the running one completes
+    assert "2" not in connector.calls
+
+def test_skipped_in_flight():
+    connector = DummyConnector(blocked=["1", "2"])
+    prefetcher = ReleasePrefetcher(connector, workers=2, depth=2)
+    prefetcher.start([1, 2, 3, 4, 5])
+    connector.gate.set()
+
+    # all releases in flight skipped, the release is fetched directly
+    assert prefetcher.fetch_release(4) == "release 4"
+    assert connector.calls.count("4") == 1
+    assert list(prefetcher.futures) == ["5"]
+    assert not prefetcher.pending
+    prefetcher.shutdown()
+    assert "3" not in connector.calls
+
+def test_fallback():
+    connector = DummyConnector(failing=["2"])
+    prefetcher = ReleasePrefetcher(connector, workers=2, depth=3)
+    prefetcher.start([1, 2])
+
+    assert prefetcher.fetch_release(1) == "release 1"
+    # the prefetch failed, the release is fetched again
+    assert prefetcher.fetch_release(2) == "release 2"
+    assert connector.calls.count("2") == 2
+    # not prefetched at all
+    assert prefetcher.fetch_release(99) == "release 99"
+    assert connector.calls.count("99") == 1
+    prefetcher.shutdown()
+
+def test_shutdown():
+    connector = DummyConnector(blocked=["1"])
+    prefetcher = ReleasePrefetcher(connector, workers=1, depth=2)
+    prefetcher.start([1, 2, 3])
+    # the running release is waited for
+    timer = threading.Timer(0.1, connector.gate.set)
+    timer.start()
+    prefetcher.shutdown()
+    timer.join()
+
+    assert not prefetcher.futures and not prefetcher.pending
+    assert connector.calls == ["1"]
+    with pytest.raises(RuntimeError):
+        prefetcher.executor.submit(connector.fetch_release, "4")
@@ -0,0 +1,59 @@
+import os, sys
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.ratelimit import TokenBucket, RateLimiter
+
+def test_bucket_burst():
+
+    bucket = TokenBucket("metadata", 60)
+
+    # a full bucket allows bursts up to the rate
+    for x in range(0, 60):
+        assert bucket.reserve() == 0
+
+    # afterwards one request per second
+    wait = bucket.reserve()
+    assert 0.9 < wait <= 1.0
+
+def test_bucket_learns_from_headers():
+
+    bucket = TokenBucket("metadata", 60)
+    bucket.learn(25, 0)
+
+    assert bucket.capacity == 25
+    assert bucket.reserve() > 2
+
+def test_limiter_counts_waiting_time():
+
+    limiter = RateLimiter({"metadata": 6000, "search": 60, "image": 60})
+    limiter.update("metadata", {"X-Discogs-Ratelimit": "6000",
+                                "X-Discogs-Ratelimit-Remaining": "0"})
+
+    wait = limiter.acquire("metadata")
+
+    assert wait > 0
+    assert limiter.waited == wait
+    assert limiter.requests == 1
+
+def test_retry_after():
+
+    limiter = RateLimiter({"metadata": 60, "search": 60, "image": 60}, backoff=2.0)
+
+    assert limiter.retry_after("search", {"Retry-After": "3"}, 0) == 3
+    assert limiter.retry_after("search", {}, 1) == 4.0
+    assert limiter.buckets["search"].reserve() > 3
+
+def test_from_config():
+
+    config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+    limiter = RateLimiter.from_config(config)
+
+    assert sorted(limiter.buckets.keys()) == ["image", "metadata", "search"]
+    assert limiter.max_retries == 5
@@ -0,0 +1,70 @@
+import os, sys
+import time
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.releasecache import ReleaseCache
+
+def test_put_and_get():
+
+    cache = ReleaseCache(":memory:")
+
+    assert cache.get(1448190) is None
+
+    cache.put(1448190, {"id": 1448190, "title": "Megahits 2001 Die Erste"})
+
+    assert cache.get("1448190")["title"] == "Megahits 2001 Die Erste"
+    assert len(cache) == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+def test_ttl():
+
+    cache = ReleaseCache(":memory:", ttl=60)
+    cache.put(3083, {"id": 3083})
+
+    assert cache.get(3083) is not None
+
+    # age the entry beyond the ttl
+    cache.connection.execute("UPDATE releases SET fetched = ?", (time.time() - 120,))
+
+    assert cache.get(3083) is None
+
+def test_lru_eviction():
+
+    cache = ReleaseCache(":memory:", max_entries=2)
+    cache.put(1, {"id": 1})
+    time.sleep(0.01)
+    cache.put(2, {"id": 2})
+    time.sleep(0.01)
+
+    # touch the first release, so that the second one is the least recently used
+    cache.get(1)
+    time.sleep(0.01)
+    cache.put(3, {"id": 3})
+
+    assert len(cache) == 2
+    assert 1 in cache
+    assert 2 not in cache
+    assert 3 in cache
+
+def test_persistence():
+
+    path = os.path.join("/tmp/dummy_release_cache", "releases.db")
+    if os.path.exists(path):
+        os.remove(path)
+
+    cache = ReleaseCache(path)
+    cache.put(13748, {"id": 13748})
+    cache.close()
+
+    cache = ReleaseCache(path)
+    assert cache.get(13748) == {"id": 13748}
+    cache.close()
+
+    os.remove(path)
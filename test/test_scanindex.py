@@ -0,0 +1,104 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.scanindex import ScanIndex, DONE
+
+source_dir = "/tmp/dummy_scanindex"
+
+def album(*names):
+    path = os.path.join(source_dir, *names)
+    os.makedirs(path)
+    open(os.path.join(path, "id.txt"), "w").close()
+    return path
+
+def setup_function(function):
+    if os.path.exists(source_dir):
+        shutil.rmtree(source_dir)
+
+    album("artist", "first")
+    album("artist", "second")
+    album("other", "third")
+
+def teardown_function(function):
+    shutil.rmtree(source_dir, ignore_errors=True)
+
+def albums(found):
+    return [os.path.relpath(p, source_dir) for p, has_id_file in found if has_id_file]
+
+def test_walk():
+    scan_index = ScanIndex(":memory:")
+
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first", "artist/second", "other/third"]
+    assert len(found) == 6
+    assert scan_index.listed == 6
+
+    # nothing changed, nothing is listed again
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first", "artist/second", "other/third"]
+    assert scan_index.listed == 0
+    assert scan_index.unchanged == 6
+
+def test_changes():
+    scan_index = ScanIndex(":memory:")
+    scan_index.walk(source_dir, "id.txt", "dt.done")
+
+    shutil.rmtree(os.path.join(source_dir, "artist", "second"))
+    album("other", "fourth")
+
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first", "other/fourth", "other/third"]
+    # only the parents of the changed directories (and the new album)
+    assert scan_index.listed == 3
+    assert scan_index.status(os.path.join(source_dir, "artist", "second")) is None
+
+def test_done():
+    scan_index = ScanIndex(":memory:")
+    scan_index.walk(source_dir, "id.txt", "dt.done")
+
+    first = os.path.join(source_dir, "artist", "first")
+    open(os.path.join(first, "dt.done"), "w").close()
+    scan_index.mark_done(first)
+    assert scan_index.status(first) == DONE
+
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/second", "other/third"]
+    assert scan_index.skipped == 1
+
+    found = scan_index.walk(source_dir, "id.txt", "dt.done", include_done=True)
+    assert albums(found) == ["artist/first", "artist/second", "other/third"]
+
+def test_done_file():
+    scan_index = ScanIndex(":memory:")
+
+    open(os.path.join(source_dir, "other", "third", "dt.done"), "w").close()
+
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first", "artist/second"]
+    assert scan_index.status(os.path.join(source_dir, "other", "third")) == DONE
+
+def test_done_changed():
+    scan_index = ScanIndex(":memory:")
+    first = os.path.join(source_dir, "artist", "first")
+    open(os.path.join(first, "dt.done"), "w").close()
+    scan_index.mark_done(first)
+    scan_index.walk(source_dir, "id.txt", "dt.done")
+
+    # a disc added below a done album is found
+    album("artist", "first", "cd2")
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first/cd2", "artist/second", "other/third"]
+
+    # without the done file, the album is tagged again
+    os.remove(os.path.join(first, "dt.done"))
+    found = scan_index.walk(source_dir, "id.txt", "dt.done")
+    assert albums(found) == ["artist/first", "artist/first/cd2",
+                             "artist/second", "other/third"]
+    assert scan_index.status(first) != DONE
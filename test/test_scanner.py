@@ -0,0 +1,119 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.fileutils import FileUtils
+from discogstagger.scanner import scan
+from discogstagger.discogsalbum import DiscogsSearch
+from discogstagger.taggerutils import TaggerUtils
+from ext.mediafile import MediaFile
+
+source_dir = "/tmp/dummy_scanner"
+
+class DummyOptions(object):
+    forceUpdate = False
+
+def setup_function(function):
+    if os.path.exists(source_dir):
+        shutil.rmtree(source_dir)
+
+    # artist/multi disc album, artist/single disc album, artist/done album
+    for album, discs in (("multi", ["cd1", "CD 2"]), ("single", [""]), ("done", [""])):
+        for disc in discs:
+            disc_dir = os.path.join(source_dir, "artist", album, disc)
+            os.makedirs(disc_dir)
+            for name in ("01.flac", "02.flac", "cover.jpg"):
+                shutil.copy(os.path.join(parentdir, "test/files/test.flac"),
+                            os.path.join(disc_dir, name))
+    os.makedirs(os.path.join(source_dir, "artist", "single", ".cue"))
+    open(os.path.join(source_dir, "artist", "single", "album.cue"), "w").close()
+    open(os.path.join(source_dir, "artist", "done", "dt.done"), "w").close()
+
+def teardown_function(function):
+    shutil.rmtree(source_dir, ignore_errors=True)
+
+def test_inventory():
+
+    inventory = scan(os.path.join(source_dir, "artist", "single"))
+
+    assert inventory.dirs == [".cue"]
+    assert inventory.audio_files() == ["01.flac", "02.flac"]
+    assert inventory.cue_files == ["album.cue"]
+    assert inventory.other_files == ["cover.jpg"]
+    assert inventory.names == [".cue", "01.flac", "02.flac", "album.cue", "cover.jpg"]
+    assert inventory.files["01.flac"].size == os.path.getsize(
+        os.path.join(parentdir, "test/files/test.flac"))
+
+def test_audio_paths():
+
+    inventory = scan(os.path.join(source_dir, "artist", "multi"))
+
+    assert inventory.disc_dirs() == ["CD 2", "cd1"]
+    assert [os.path.relpath(p, inventory.path) for p in inventory.audio_paths()] == \
+        ["CD 2/01.flac", "CD 2/02.flac", "cd1/01.flac", "cd1/02.flac"]
+
+def test_get_audio_dirs():
+
+    tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+    if not tagger_config.has_section("cue"):
+        tagger_config.add_section("cue")
+    tagger_config.set("cue", "parse_cue_files", "False")
+    tagger_config.set("cue", "cue_done_dir", ".cue")
+    file_utils = FileUtils(tagger_config, DummyOptions())
+
+    source_dirs = file_utils.get_audio_dirs(source_dir)
+
+    assert sorted(source_dirs) == [os.path.join(source_dir, "artist", "multi") + "/",
+                                   os.path.join(source_dir, "artist", "single") + "/"]
+
+    # the inventory of the scan is handed to the next stages
+    inventory = file_utils.album_inventory(source_dirs[0])
+    assert inventory.path + "/" == source_dirs[0]
+    assert file_utils.album_inventory(source_dirs[0]) is not inventory
+
+def test_entry():
+
+    inventory = scan(os.path.join(source_dir, "artist"))
+
+    entry = inventory.entry(os.path.join(source_dir, "artist", "multi", "CD 2", "02.flac"))
+    assert entry.name == "02.flac"
+    assert entry is inventory.child("multi").child("CD 2").files["02.flac"]
+    assert inventory.entry(os.path.join(source_dir, "artist", "multi", "03.flac")) is None
+    assert inventory.entry(os.path.join(source_dir, "other", "01.flac")) is None
+
+def test_search_metadata():
+
+    album_dir = os.path.join(source_dir, "artist", "single")
+    # the file names do not sort in track order
+    for name, track in (("01.flac", 2), ("02.flac", 1)):
+        metadata = MediaFile(os.path.join(album_dir, name))
+        metadata.track = track
+        metadata.album = "album"
+        metadata.save()
+
+    inventory = scan(album_dir)
+    search = DiscogsSearch.__new__(DiscogsSearch)
+    search.cue_done_dir = ".cue"
+    search.getSearchParams(album_dir, inventory)
+
+    entry = inventory.files["01.flac"]
+    assert entry.metadata["track"] == 2
+    assert entry.metadata["artist"] == ["discogstagger"]
+    assert entry.audio_info.type == "flac"
+    assert entry.audio_info.samplerate == 44100
+
+    # the files are mapped to the tracks by their track numbers
+    tagger_utils = TaggerUtils.__new__(TaggerUtils)
+    target_list = [os.path.join(album_dir, "01.flac"), os.path.join(album_dir, "02.flac")]
+    assert tagger_utils._order_by_tracknumber(target_list, inventory) == \
+        [os.path.join(album_dir, "02.flac"), os.path.join(album_dir, "01.flac")]
+
+    # without metadata, the sorted order is kept
+    assert tagger_utils._order_by_tracknumber(target_list, scan(album_dir)) == target_list
@@ -0,0 +1,82 @@
+import os, sys
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger import discogsalbum
+from discogstagger.discogsalbum import DiscogsSearch
+
+current = [{'duration': '0:03:42'}, {'duration': '0:06:59'}, {'duration': '1:03:00'}]
+versions = [
+    [{'duration': '3:42'}, {'duration': '6:59'}, {'duration': '63:00'}],
+    [{'duration': '3:40'}, {'duration': '7:05'}, {'duration': '1:03:01'}],
+    [{'duration': '3:42'}, {'duration': ''}, {'duration': '63:00'}],
+]
+
+def test_duration_seconds():
+
+    search = DiscogsSearch.__new__(DiscogsSearch)
+
+    assert search._durationSeconds('3:42') == 222
+    assert search._durationSeconds('63:00') == 3780
+    assert search._durationSeconds('1:03:00') == 3780
+    assert search._durationSeconds('') is None
+    assert search._durationSeconds('3.42') is None
+
+def test_score_track_lengths():
+
+    search = DiscogsSearch.__new__(DiscogsSearch)
+
+    # a difference only counts, if it is bigger than the differences so far
+    expected = [0.0, (2 + 6) / 3, 999 / 3]
+
+    assert search._scoreTrackLengths(current, versions) == expected
+
+    numpy = discogsalbum.numpy
+    discogsalbum.numpy = None
+    try:
+        assert search._scoreTrackLengths(current, versions) == expected
+    finally:
+        discogsalbum.numpy = numpy
+
+class DummyArtist(object):
+    def __init__(self, name):
+        self.name = name
+
+class DummyRelease(object):
+    def __init__(self, id, title, artist):
+        self.id = id
+        self.title = title
+        self.artists = [DummyArtist(artist)]
+
+def signature_search(release):
+    search = DiscogsSearch.__new__(DiscogsSearch)
+    search.search_params = {
+        'albumartist': 'Motörhead', 'artist': 'Motörhead', 'artists': ['Motörhead'],
+        'album': 'Ace of Spades (Bonus Tracks)', 'tracks': [{'title': 'Ace of Spades'}]}
+    search.signature_index = object()
+    search.search_signature = lambda: {0.5: release}
+
+    searched = []
+    def search_switcher():
+        searched.append(True)
+    search.search_switcher = search_switcher
+    return search, searched
+
+def test_signature_match():
+    # the title or the artist of the release matches the search
+    for release in (DummyRelease(1, 'Ace Of Spades', 'Lemmy'),
+                    DummyRelease(2, 'Overkill', 'Motörhead (2)')):
+        search, searched = signature_search(release)
+        assert search.search_discogs() is release
+        assert searched == []
+
+def test_signature_collision():
+    # the durations match an unrelated (short) release, discogs is searched
+    search, searched = signature_search(DummyRelease(3, 'Other Album', 'Other Artist'))
+    assert search.search_discogs() is None
+    assert searched == [True]
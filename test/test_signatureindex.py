@@ -0,0 +1,47 @@
+import os, sys
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.signatureindex import SignatureIndex, track_durations
+
+tracklist = [
+    {"position": "", "title": "CD 1", "duration": "", "type_": "heading"},
+    {"position": "1", "title": "Intro", "duration": "1:02", "type_": "track"},
+    {"position": "2", "title": "La Passion", "duration": "3:42", "type_": "track"},
+    {"position": "3", "title": "L'Amour Toujours", "duration": "6:59", "type_": "track"},
+    {"position": "4", "title": "Outro", "duration": "63:00", "type_": "track"},
+    {"position": "Video", "title": "Making Of", "duration": "12:00", "type_": "track"},
+]
+
+def test_track_durations():
+
+    assert track_durations(tracklist) == [62, 222, 419, 3780]
+
+def test_lookup():
+
+    index = SignatureIndex(":memory:")
+    index.add(1448190, tracklist)
+    index.add(3083, [{"position": str(x), "duration": "4:00"} for x in range(4)])
+
+    assert len(index) == 2
+
+    # the audio files are some seconds off, across the quantization steps
+    matches = index.lookup([60, 224, 421, 3778])
+    assert matches[0] == (1448190, [62, 222, 419, 3780])
+
+    assert index.lookup([62, 222, 419]) == []
+    assert index.lookup([62, 222]) == []
+
+def test_changed_release():
+
+    index = SignatureIndex(":memory:")
+    index.add(1448190, tracklist)
+    index.add(1448190, [{"position": str(x), "duration": "5:00"} for x in range(4)])
+
+    assert index.lookup([62, 222, 419, 3780]) == []
+    assert index.lookup([300, 300, 300, 300])[0][0] == 1448190
@@ -0,0 +1,209 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from ext.mediafile import MediaFile
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.album import Album, Disc, Track
+from discogstagger.tracksession import TrackSession, PaddingPolicy, track_session
+from discogstagger.taggerutils import FileHandler
+
+work_dir = "/tmp/dummy_tracksession"
+source_file = os.path.join(work_dir, "source.flac")
+target_file = os.path.join(work_dir, "target.flac")
+
+def setup_function(function):
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    shutil.copyfile(os.path.join(parentdir, "test/files/test.flac"), source_file)
+
+def teardown_function(function):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+def tagger_config():
+    tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+    for section, values in (("cue", {"cue_done_dir": ".cue"}),
+                            ("replaygain", {"add_tags": "True",
+                                            "application": "loudgain"}),
+                            ("details", {"variousartists": "Various",
+                                         "releasecountry_formatted": ""})):
+        if not tagger_config.has_section(section):
+            tagger_config.add_section(section)
+        for name, value in values.items():
+            tagger_config.set(section, name, value)
+    return tagger_config
+
+def dummy_album():
+    album = Album(4711, "album", ["artist"])
+    album.labels = ["label"]
+    album.catnumbers = ["cat 1"]
+    album.sourcedir = work_dir
+    album.target_dir = os.path.join(work_dir, "target")
+    os.makedirs(album.target_dir)
+
+    disc = Disc(1)
+    disc.target_dir = None
+    album.discs.append(disc)
+    for tracknumber in (1, 2, 3):
+        track = Track(tracknumber, "track %d" % tracknumber, ["artist"])
+        track.discnumber = 1
+        track.orig_file = "%02d.flac" % tracknumber
+        track.new_file = "%02d-track.flac" % tracknumber
+        track.full_path = os.path.join(work_dir, track.orig_file)
+        shutil.copyfile(source_file, track.full_path)
+        shutil.copyfile(source_file, os.path.join(album.target_dir, track.new_file))
+        disc.tracks.append(track)
+    return album
+
+def test_single_save():
+    with open(source_file, "rb") as f:
+        original = f.read()
+
+    session = TrackSession(source_file)
+    assert session.type == "flac"
+    assert session.metadata.title == "test"
+
+    session.clear()
+    session.update({"title": "new title", "artist": ["new artist"]})
+    with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as f:
+        session.update({"art": f.read()})
+    session.update({"rg_track_gain": -6.5, "rg_track_peak": 0.5})
+
+    # nothing is written until the session is saved
+    with open(source_file, "rb") as f:
+        assert f.read() == original
+
+    shutil.copyfile(source_file, target_file)
+    assert session.save(target_file)
+    assert not session.save(target_file)
+
+    metadata = MediaFile(target_file)
+    assert metadata.title == "new title"
+    assert metadata.artist == ["new artist"]
+    assert metadata.art is not None
+    assert metadata.rg_track_gain == -6.5
+    assert metadata.discogs_id is None
+
+    assert MediaFile(source_file).title == "test"
+
+def test_unchanged():
+    with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as f:
+        art = f.read()
+
+    session = TrackSession(source_file)
+    session.clear()
+    session.update({"title": "new title", "art": art})
+    assert session.save()
+
+    # the same tags again, the file is not written
+    mtime = os.stat(source_file).st_mtime_ns
+    session = TrackSession(source_file)
+    session.clear()
+    session.update({"art": art, "title": "new title"})
+    assert not session.save()
+    assert os.stat(source_file).st_mtime_ns == mtime
+
+    # a copy, which is tagged already
+    shutil.copyfile(source_file, target_file)
+    session = TrackSession(source_file)
+    session.update({"title": "new title"})
+    assert not session.save(target_file)
+
+    # the art differs
+    session = TrackSession(source_file)
+    session.update({"art": art + b"\0"})
+    assert session.save()
+    assert MediaFile(source_file).art == art + b"\0"
+
+def test_padding():
+    with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as f:
+        art = f.read()
+    padding = PaddingPolicy(4096)
+
+    # the art does not fit, the file is rewritten with padding for later
+    session = TrackSession(source_file)
+    session.update({"title": "new title", "art": art})
+    assert session.save(padding=padding)
+    assert session.rewritten
+    size = os.path.getsize(source_file)
+
+    # changes fitting into the padding are written in place
+    session = TrackSession(source_file)
+    session.update({"title": "a much longer title than before", "comments": "x" * 2000})
+    assert session.save(padding=padding)
+    assert not session.rewritten
+    assert os.path.getsize(source_file) == size
+
+    # even replacing the art by a larger one
+    session = TrackSession(source_file)
+    session.update({"art": art + b"\0" * 1000})
+    assert session.save(padding=padding)
+    assert not session.rewritten
+    assert os.path.getsize(source_file) == size
+
+    assert MediaFile(source_file).title == "a much longer title than before"
+
+def test_track_session():
+    track = Track(1, "title", ["artist"])
+
+    session = track_session(track, source_file)
+    assert track.session is session
+    assert track_session(track, target_file) is session
+
+def test_loudgain_values():
+    file_handler = FileHandler(Album(1, "album", ["artist"]), tagger_config())
+
+    output = "\n".join([
+        "Scanning 2 files...",
+        "\t".join(["File", "Loudness", "Range", "True_Peak", "True_Peak_dBTP",
+                   "Reference", "Will_clip", "Clip_prevent", "Gain",
+                   "New_Peak", "New_Peak_dBTP"]),
+        "\t".join(["/music/01.flac", "-11.16 LUFS", "6.71 LU", "0.988525",
+                   "-0.10 dBTP", "-18.00 LUFS", "N", "Y", "-6.84 dB",
+                   "0.449784", "-6.94 dBTP"]),
+        "\t".join(["/music/02.flac", "-13.00 LUFS", "5.00 LU", "0.800000",
+                   "-1.94 dBTP", "-18.00 LUFS", "N", "Y", "-5.00 dB",
+                   "0.449886", "-6.94 dBTP"]),
+        "\t".join(["Album", "-12.00 LUFS", "6.71 LU", "0.988525",
+                   "-0.10 dBTP", "-18.00 LUFS", "N", "Y", "-6.00 dB",
+                   "0.495395", "-6.10 dBTP"]),
+    ])
+
+    values, album = file_handler._loudgain_values(output)
+
+    assert values == {"/music/01.flac": (-6.84, 0.449784),
+                      "/music/02.flac": (-5.0, 0.449886)}
+    assert album == (-6.0, 0.495395)
+
+def test_write_tracks_jobs():
+    from discogstagger.taggerutils import TagHandler
+
+    config = tagger_config()
+    album = dummy_album()
+    album.disc(1).track(2).replaygain = {"rg_track_gain": -3.0}
+    # opened by an earlier stage, the sessions stay in this process
+    track_session(album.disc(1).track(1), album.disc(1).track(1).full_path)
+
+    file_handler = FileHandler(album, config)
+    assert file_handler.write_tracks(TagHandler(album, config), jobs=2) == 3
+    assert file_handler.in_place_writes + file_handler.rewrites == 3
+
+    for track in album.disc(1).tracks:
+        metadata = MediaFile(os.path.join(album.target_dir, track.new_file))
+        assert metadata.title == track.title
+        assert metadata.album == "album"
+        assert metadata.track == track.tracknumber
+        assert metadata.tracktotal == 3
+        # the source files are not touched
+        assert MediaFile(track.full_path).title == "test"
+
+    metadata = MediaFile(os.path.join(album.target_dir, "02-track.flac"))
+    assert metadata.rg_track_gain == -3.0
@@ -0,0 +1,270 @@
+import os, sys
+import shutil
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import pytest
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.album import Album, Disc
+from discogstagger.taggerutils import FileHandler
+from discogstagger.transfer import FileTransfer
+import discogstagger.manifest
+
+source_dir = "/tmp/dummy_transfer_source"
+target_dir = "/tmp/dummy_transfer_target"
+
+def setup_function(function):
+    for path in (source_dir, target_dir):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    with open(os.path.join(source_dir, "track.flac"), "wb") as f:
+        f.write(b"fLaC" + os.urandom(200000))
+
+def teardown_function(function):
+    for path in (source_dir, target_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+def content(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def transfer(mode):
+    source = os.path.join(source_dir, "track.flac")
+    target = os.path.join(target_dir, "01-track.flac")
+    data = content(source)
+    file_transfer = FileTransfer(mode)
+    method = file_transfer.transfer(source, target)
+    assert content(target) == data
+    assert file_transfer.stats.methods == {method: 1}
+    assert file_transfer.stats.bytes == len(data)
+    # no temporary files are left
+    assert os.listdir(target_dir) == ["01-track.flac"]
+    return method, source, target
+
+def test_copy():
+    method, source, target = transfer("copy")
+    assert method == "copy"
+    assert os.stat(source).st_ino != os.stat(target).st_ino
+
+def test_auto():
+    method, source, target = transfer("auto")
+    assert method in ("reflink", "copy_file_range", "copy")
+    assert os.path.exists(source)
+    assert os.stat(source).st_ino != os.stat(target).st_ino
+
+def test_hardlink():
+    method, source, target = transfer("hardlink")
+    assert method == "hardlink"
+    assert os.stat(source).st_ino == os.stat(target).st_ino
+
+def test_move():
+    method, source, target = transfer("move")
+    assert method == "move"
+    assert not os.path.exists(source)
+
+def test_replace():
+    target = os.path.join(target_dir, "01-track.flac")
+    with open(target, "wb") as f:
+        f.write(b"old")
+
+    FileTransfer("auto").transfer(os.path.join(source_dir, "track.flac"), target)
+    assert content(target) == content(os.path.join(source_dir, "track.flac"))
+
+def test_mode():
+    source = os.path.join(source_dir, "track.flac")
+    for mode in (0o644, 0o640):
+        os.chmod(source, mode)
+        for transfer_mode in ("copy", "copy_file_range", "auto", "hardlink"):
+            target = os.path.join(target_dir, "%s.flac" % transfer_mode)
+            FileTransfer(transfer_mode).transfer(source, target)
+            assert os.stat(target).st_mode & 0o777 == mode, transfer_mode
+
+def test_copy_file_range_nothing(monkeypatch):
+    # the first call copies a part, then nothing more
+    calls = []
+    def short_copy_file_range(src, dst, count, *args):
+        calls.append(count)
+        if len(calls) > 1:
+            return 0
+        return os.write(dst, os.read(src, 1000))
+    monkeypatch.setattr(os, "copy_file_range", short_copy_file_range, raising=False)
+
+    method, source, target = transfer("copy_file_range")
+    # a plain copy instead of a truncated one
+    assert method == "copy"
+    assert len(calls) == 2
+
+def test_unsupported():
+    file_transfer = FileTransfer("hardlink")
+    devices = (os.stat(source_dir).st_dev, os.stat(target_dir).st_dev)
+    file_transfer.unsupported[devices] = set(["hardlink", "reflink"])
+
+    method = file_transfer.transfer(os.path.join(source_dir, "track.flac"),
+                                    os.path.join(target_dir, "01-track.flac"))
+    assert method in ("copy_file_range", "copy")
+
+def test_transfer_all():
+    jobs = []
+    for i in range(8):
+        source = os.path.join(source_dir, "%02d.flac" % i)
+        with open(source, "wb") as f:
+            f.write(os.urandom(1000 * (i + 1)))
+        jobs.append((source, os.path.join(target_dir, "%02d.flac" % i), None))
+    jobs.append((os.path.join(source_dir, "track.flac"),
+                 os.path.join(target_dir, "track.flac"), "copy"))
+
+    file_transfer = FileTransfer("auto", workers=4, buffer_size=4096)
+    methods, stats = file_transfer.transfer_all(jobs)
+    assert len(methods) == 9
+    assert methods[-1] == "copy"
+    for source, target, mode in jobs:
+        assert content(source) == content(target)
+
+    assert stats.files == 9
+    assert stats.bytes == 36000 + 200004
+    assert sum(stats.methods.values()) == 9
+    assert stats.elapsed > 0
+    assert "9 files" in str(stats)
+    assert file_transfer.stats.files == 9
+
+def test_ignore_errors():
+    jobs = [(os.path.join(source_dir, "missing.flac"),
+             os.path.join(target_dir, "missing.flac"), None),
+            (os.path.join(source_dir, "track.flac"),
+             os.path.join(target_dir, "track.flac"), None)]
+
+    with pytest.raises(OSError):
+        FileTransfer("copy").transfer_all(jobs)
+
+    file_transfer = FileTransfer("copy", workers=2)
+    methods, stats = file_transfer.transfer_all(jobs, ignore_errors=True)
+    assert methods == [None, "copy"]
+    assert stats.files == 1
+    assert stats.failed == 1
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        FileTransfer("teleport")
+
+def tagger_config():
+    tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+    for section, values in (("cue", {"cue_done_dir": ".cue"}),
+                            ("replaygain", {"add_tags": "False",
+                                            "application": "loudgain"})):
+        if not tagger_config.has_section(section):
+            tagger_config.add_section(section)
+        for name, value in values.items():
+            tagger_config.set(section, name, value)
+    return tagger_config
+
+def test_keep_original():
+    config = tagger_config()
+    config.set("details", "transfer_mode", "move")
+    config.set("details", "keep_original", "True")
+
+    source = os.path.join(source_dir, "track.flac")
+    file_handler = FileHandler(None, config)
+    method = file_handler.transfer_file(
+        source, os.path.join(target_dir, "01-track.flac"), tagged=True)
+    assert method != "move"
+    assert os.path.exists(source)
+
+    config.set("details", "keep_original", "False")
+    file_handler = FileHandler(None, config)
+    method = file_handler.transfer_file(
+        source, os.path.join(target_dir, "01-track.flac"), tagged=True)
+    assert method == "move"
+    assert not os.path.exists(source)
+
+def test_copy_other_files():
+    config = tagger_config()
+    config.set("details", "copy_other_files", "True")
+    config.set("details", "manifest_file", "")
+
+    os.makedirs(os.path.join(source_dir, "scans"))
+    for name in ("scans/front.png", "scans/back.png", "album.log"):
+        with open(os.path.join(source_dir, name), "wb") as f:
+            f.write(os.urandom(5000))
+    os.chmod(os.path.join(source_dir, "scans/back.png"), 0o640)
+
+    album = Album(4711, "album", ["artist"])
+    album.sourcedir = source_dir
+    album.target_dir = target_dir
+    album.copy_files = ["scans", "album.log"]
+    disc = Disc(1)
+    disc.target_dir = None
+    disc.copy_files = []
+    album.discs.append(disc)
+
+    file_handler = FileHandler(album, config)
+    file_handler.copy_other_files()
+    assert file_handler.transfer.stats.files == 3
+    assert file_handler.transfer.stats.skipped == 0
+    for name in ("scans/front.png", "scans/back.png", "album.log"):
+        assert content(os.path.join(target_dir, name)) == \
+            content(os.path.join(source_dir, name))
+        # copy2 semantics, the mode and mtime of the source
+        source_stat = os.stat(os.path.join(source_dir, name))
+        target_stat = os.stat(os.path.join(target_dir, name))
+        assert target_stat.st_mode == source_stat.st_mode
+        assert target_stat.st_mtime == source_stat.st_mtime
+
+    # a changed source is transferred again, the others are skipped
+    with open(os.path.join(source_dir, "album.log"), "ab") as f:
+        f.write(b"more")
+    file_handler = FileHandler(album, config)
+    file_handler.copy_other_files()
+    assert file_handler.transfer.stats.files == 1
+    assert file_handler.transfer.stats.skipped == 2
+    assert content(os.path.join(target_dir, "album.log")) == \
+        content(os.path.join(source_dir, "album.log"))
+
+    # same content, but another mtime
+    os.utime(os.path.join(target_dir, "album.log"), (0, 0))
+    config.set("details", "skip_unchanged_hash", "True")
+    file_handler = FileHandler(album, config)
+    file_handler.copy_other_files()
+    assert file_handler.transfer.stats.files == 0
+    assert file_handler.transfer.stats.skipped == 3
+
+def test_tagged_checksums(monkeypatch):
+    config = tagger_config()
+    config.set("details", "manifest_file", "dt.manifest")
+    with open(os.path.join(source_dir, "album.log"), "wb") as f:
+        f.write(os.urandom(5000))
+
+    album = Album(4711, "album", ["artist"])
+    album.target_dir = target_dir
+    file_handler = FileHandler(album, config)
+    file_handler.open_manifest()
+
+    track = os.path.join(target_dir, "01-track.flac")
+    log = os.path.join(target_dir, "album.log")
+    file_handler.transfer_files(
+        [(os.path.join(source_dir, "track.flac"), track)], tagged=True)
+    file_handler.transfer_files([(os.path.join(source_dir, "album.log"), log)])
+    assert file_handler.transfer.checksums == {}
+    # the track is hashed after tagging only
+    assert file_handler.manifest.entries["01-track.flac"]["hash"] is None
+    assert file_handler.manifest.entries["album.log"]["hash"] is not None
+
+    with open(track, "ab") as f:
+        f.write(b"tags")
+
+    hashed = []
+    file_digest = discogstagger.manifest.file_digest
+    def counting_file_digest(path, *args):
+        hashed.append(path)
+        return file_digest(path, *args)
+    monkeypatch.setattr(discogstagger.manifest, "file_digest", counting_file_digest)
+    file_handler.save_manifest()
+    assert hashed == [track]
+    assert file_handler.manifest.entries["01-track.flac"]["hash"] == file_digest(track)